@@ -0,0 +1,368 @@
+"""
+Benchmark of the TFTP server against a local stand-in for Cobbler.
+
+The stand-in serves generated files over XML-RPC and, optionally, over HTTP
+range requests, with an injectable latency. A load generator downloads them
+with several concurrent TFTP clients and reports the throughput, the session
+latencies and the number of calls that reached the stand-in.
+"""
+
+import logging
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+import xmlrpc.client
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+from cobbler_tftp.server import start_listener
+from cobbler_tftp.settings import Settings
+
+# TFTP opcodes, see RFC 1350 and RFC 2347.
+OPCODE_RRQ = 1
+OPCODE_DATA = 3
+OPCODE_ACK = 4
+OPCODE_ERROR = 5
+OPCODE_OACK = 6
+# Seconds the benchmark waits for the server to answer its first request.
+STARTUP_TIMEOUT = 30.0
+# Token handed out by the stand-in.
+TOKEN = "benchmark"
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def file_content(name: str, size: int) -> bytes:
+    """
+    Generate the content of a benchmark file.
+
+    :param name: Name of the file.
+    :param size: Size of the file in bytes.
+    :return: The content, which differs between files.
+    """
+    pattern = (name.encode("UTF-8") + bytes(range(256))) * 16
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class _FakeCobblerHandler(SimpleXMLRPCRequestHandler):
+    """Serves XML-RPC calls and the files over HTTP with keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ()
+    server: "FakeCobbler"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve a file with a range request, like a web server would."""
+        self.server.count("GET")
+        time.sleep(self.server.latency)
+        content = self.server.files.get(self.path.lstrip("/"))
+        match = _RANGE.fullmatch(self.headers.get("Range", ""))
+        if content is None or match is None:
+            self.send_error(404)
+            return
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(content) - 1), len(content) - 1)
+        if start >= len(content):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(content)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(content[start : end + 1])
+
+    def log_message(self, format: str, *args: object):  # pylint: disable=W0622
+        pass
+
+
+class FakeCobbler(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    Stand-in for the Cobbler API, implementing the calls the TFTP server
+    makes. Every call is counted.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files: Dict[str, bytes], latency: float = 0):
+        """
+        Start serving on a random local port.
+
+        :param files: Contents of the files by path.
+        :param latency: Time in seconds every file request is delayed.
+        """
+        super().__init__(
+            ("127.0.0.1", 0),
+            requestHandler=_FakeCobblerHandler,
+            logRequests=False,
+            allow_none=True,
+        )
+        self.files = files
+        self.latency = latency
+        self.calls: "Counter[str]" = Counter()
+        self._lock = threading.Lock()
+        self.register_function(self._login, "login")
+        self.register_function(self._logout, "logout")
+        self.register_function(self._last_modified_time, "last_modified_time")
+        self.register_function(self._get_tftp_file, "get_tftp_file")
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def uri(self) -> str:
+        """URI of the stand-in, which serves the files below its root."""
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def count(self, call: str) -> None:
+        """
+        Count a call.
+
+        :param call: Name of the call.
+        """
+        with self._lock:
+            self.calls[call] += 1
+
+    def _login(self, username: str, password: str) -> str:
+        self.count("login")
+        return TOKEN
+
+    def _logout(self, token: str) -> bool:
+        self.count("logout")
+        return True
+
+    def _last_modified_time(self, token: str) -> float:
+        self.count("last_modified_time")
+        return 0.0
+
+    def _get_tftp_file(
+        self, path: str, offset: int, size: int, token: str
+    ) -> Tuple[xmlrpc.client.Binary, int]:
+        self.count("get_tftp_file")
+        time.sleep(self.latency)
+        content = self.files.get(path)
+        if content is None:
+            raise xmlrpc.client.Fault(1, f"File not found: {path}")
+        return xmlrpc.client.Binary(content[offset : offset + size]), len(content)
+
+
+class SessionResult(NamedTuple):
+    """Outcome of a single TFTP download."""
+
+    duration: float
+    size: int
+    error: Optional[str]
+
+
+def download(
+    address: Tuple[str, int],
+    path: str,
+    block_size: int = 512,
+    window_size: int = 1,
+    timeout: float = 2,
+    retries: int = 5,
+) -> int:
+    """
+    Download a file with TFTP.
+
+    :param address: Address and port of the server.
+    :param path: Path of the file.
+    :param block_size: Block size requested with the ``blksize`` option.
+    :param window_size: Window size requested with the ``windowsize`` option.
+    :param timeout: Time in seconds to wait for a packet.
+    :param retries: Number of times a packet is sent again after a timeout.
+    :return: Number of bytes received.
+    """
+    options = [("blksize", str(block_size)), ("tsize", "0")]
+    if window_size > 1:
+        options.append(("windowsize", str(window_size)))
+    request = struct.pack("!H", OPCODE_RRQ) + b"\0".join(
+        [path.encode("UTF-8"), b"octet"]
+        + [item.encode("ascii") for option in options for item in option]
+        + [b""]
+    )
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        last_packet, destination = request, address
+        # Without an OACK, the server uses the defaults of RFC 1350.
+        block_size, window_size = 512, 1
+        expected, received, failures = 1, 0, 0
+        sock.sendto(request, address)
+        while True:
+            try:
+                packet, peer = sock.recvfrom(65536)
+            except socket.timeout:
+                failures += 1
+                if failures > retries:
+                    raise
+                sock.sendto(last_packet, destination)
+                continue
+            failures = 0
+            destination = peer
+            opcode = struct.unpack("!H", packet[:2])[0]
+            if opcode == OPCODE_ERROR:
+                message = packet[4:-1].decode("latin-1")
+                raise OSError(
+                    f"TFTP error {struct.unpack('!H', packet[2:4])[0]}: {message}"
+                )
+            if opcode == OPCODE_OACK:
+                fields = packet[2:].split(b"\0")
+                acked = dict(zip(fields[0:-1:2], fields[1::2]))
+                block_size = int(acked.get(b"blksize", 512))
+                window_size = int(acked.get(b"windowsize", 1))
+                last_packet = struct.pack("!HH", OPCODE_ACK, 0)
+                sock.sendto(last_packet, peer)
+                continue
+            if opcode != OPCODE_DATA:
+                continue
+            block_number = struct.unpack("!H", packet[2:4])[0]
+            data = packet[4:]
+            if block_number != expected % 65536:
+                # Acknowledge the last block received in order, see RFC 7440.
+                sock.sendto(last_packet, peer)
+                continue
+            received += len(data)
+            last = len(data) < block_size
+            if last or expected % window_size == 0:
+                last_packet = struct.pack("!HH", OPCODE_ACK, block_number)
+                sock.sendto(last_packet, peer)
+            expected += 1
+            if last:
+                return received
+
+
+class BenchmarkResult(NamedTuple):
+    """Summary of a benchmark run."""
+
+    sessions: List[SessionResult]
+    duration: float
+    calls: Dict[str, int]
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Get a percentile of the durations of the successful sessions.
+
+        :param fraction: The percentile as a fraction between 0 and 1.
+        :return: The duration in seconds, or 0 if no session succeeded.
+        """
+        durations = sorted(
+            session.duration for session in self.sessions if session.error is None
+        )
+        if not durations:
+            return 0.0
+        return durations[round(fraction * (len(durations) - 1))]
+
+    def report(self) -> str:
+        """
+        Format the result for humans.
+
+        :return: The report, one value per line.
+        """
+        errors = Counter(s.error for s in self.sessions if s.error is not None)
+        size = sum(session.size for session in self.sessions)
+        lines = [
+            f"Sessions:      {len(self.sessions)} ({sum(errors.values())} failed)",
+            f"Duration:      {self.duration:.2f} s",
+            f"Throughput:    {size / self.duration / 2**20:.2f} MiB/s, "
+            f"{len(self.sessions) / self.duration:.1f} sessions/s",
+            f"Latency p50:   {self.percentile(0.5) * 1000:.1f} ms",
+            f"Latency p99:   {self.percentile(0.99) * 1000:.1f} ms",
+            "Upstream calls: "
+            + (
+                ", ".join(f"{call}={n}" for call, n in sorted(self.calls.items()))
+                or "none"
+            ),
+        ]
+        lines.extend(
+            f"Error:         {error} ({n}x)" for error, n in errors.most_common()
+        )
+        return "\n".join(lines)
+
+
+def _free_port(address: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((address, 0))
+        return sock.getsockname()[1]
+
+
+def run_benchmark(
+    settings: Settings,
+    file_sizes: Sequence[int],
+    sessions: int,
+    clients: int,
+    latency: float = 0,
+    http: bool = False,
+    block_size: int = 1468,
+    window_size: int = 1,
+) -> BenchmarkResult:
+    """
+    Start the stand-in and a server, then download the files with several
+    clients at once.
+
+    The server is configured from the settings, except that it talks to the
+    stand-in, listens on a free local port and has no static fallback
+    directory.
+
+    :param settings: The cobbler-tftp application settings.
+    :param file_sizes: Sizes of the files served by the stand-in in bytes.
+    :param sessions: Total number of downloads, spread over the files.
+    :param clients: Number of downloads running at the same time.
+    :param latency: Time in seconds every file request to the stand-in takes.
+    :param http: Fetch the files over HTTP instead of XML-RPC.
+    :param block_size: Block size requested by the clients.
+    :param window_size: Window size requested by the clients.
+    :return: The result.
+    """
+    files = {
+        f"bench/file{index}": file_content(f"file{index}", size)
+        for index, size in enumerate(file_sizes)
+    }
+    paths = list(files)
+    cobbler = FakeCobbler(files, latency)
+    settings.uri = cobbler.uri + "RPC2"
+    settings.file_uri = cobbler.uri if http else None
+    settings.tftp_addr = "127.0.0.1"
+    settings.tftp_port = _free_port(settings.tftp_addr)
+    settings.static_fallback_dir = None
+    settings.metrics_port = 0
+    address = (settings.tftp_addr, settings.tftp_port)
+    server = start_listener(settings)
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                download(address, paths[0], block_size, window_size, 1, 0)
+                break
+            except OSError:
+                if time.monotonic() > deadline or not server.is_alive():
+                    raise
+        cobbler.calls.clear()
+
+        def session(index: int) -> SessionResult:
+            path = paths[index % len(paths)]
+            start_time = time.monotonic()
+            try:
+                size = download(
+                    address, path, block_size, window_size, settings.tftp_timeout
+                )
+            except OSError as err:
+                return SessionResult(time.monotonic() - start_time, 0, str(err))
+            error = None if size == len(files[path]) else "Incomplete download"
+            return SessionResult(time.monotonic() - start_time, size, error)
+
+        start_time = time.monotonic()
+        with ThreadPoolExecutor(clients) as executor:
+            results = list(executor.map(session, range(sessions)))
+        duration = time.monotonic() - start_time
+    finally:
+        server.terminate()
+        server.join(settings.tftp_timeout)
+        cobbler.shutdown()
+        cobbler.server_close()
+    logging.debug("Benchmark finished after %f seconds", duration)
+    return BenchmarkResult(results, duration, dict(cobbler.calls))
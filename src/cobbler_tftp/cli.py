@@ -13,6 +13,7 @@ from typing import List, Optional
 import click
 from daemon import DaemonContext  # type: ignore
 
+from cobbler_tftp.bench import run_benchmark
 from cobbler_tftp.server import run_server
 from cobbler_tftp.settings import SettingsFactory
 from cobbler_tftp.utils import copy_file  # type: ignore
@@ -215,8 +216,93 @@ def setup(
         sys.exit(1)
 
 
+@cli.command()
+@click.option(
+    "--config", "-c", type=click.Path(), help="Set location of configuration file."
+)
+@click.option(
+    "--settings",
+    "-s",
+    multiple=True,
+    help="""Set custom settings in format:\n
+    <PARENT_YAML_KEY>.<CHILD_YAML_KEY>.<...>.<KEY_NAME>=<VALUE>.\n
+    The value is parsed as YAML. Quotes around the value are recommended for strings.""",
+)
+@click.option(
+    "--file-size",
+    "-f",
+    type=int,
+    multiple=True,
+    default=[1048576],
+    show_default=True,
+    help="Size of a file served by the stand-in in bytes, may be given several times.",
+)
+@click.option(
+    "--sessions", "-n", default=100, show_default=True, help="Number of downloads."
+)
+@click.option(
+    "--clients",
+    "-j",
+    default=10,
+    show_default=True,
+    help="Number of downloads running at the same time.",
+)
+@click.option(
+    "--latency",
+    default=0.0,
+    show_default=True,
+    help="Time in milliseconds every file request to the stand-in takes.",
+)
+@click.option(
+    "--http/--xmlrpc",
+    default=False,
+    show_default=True,
+    help="Fetch the files from the stand-in over HTTP or XML-RPC.",
+)
+@click.option(
+    "--blksize", default=1468, show_default=True, help="Block size of the clients."
+)
+@click.option(
+    "--windowsize", default=1, show_default=True, help="Window size of the clients."
+)
+def bench(
+    config: Optional[str],
+    settings: List[str],
+    file_size: List[int],
+    sessions: int,
+    clients: int,
+    latency: float,
+    http: bool,
+    blksize: int,
+    windowsize: int,
+):
+    """
+    Benchmark the server against a local stand-in for Cobbler.
+    """
+    config_path = None if config is None else Path(config)
+    application_settings = SettingsFactory().build_settings(
+        config_path, False, None, settings
+    )
+    click.echo(
+        f"Benchmarking the {application_settings.tftp_engine} engine with "
+        f"{sessions} downloads by {clients} clients..."
+    )
+    result = run_benchmark(
+        application_settings,
+        file_size,
+        sessions,
+        clients,
+        latency / 1000,
+        http,
+        blksize,
+        windowsize,
+    )
+    click.echo(result.report())
+
+
 cli.add_command(start)
 cli.add_command(version)
 cli.add_command(print_default_config)
 cli.add_command(stop)
 cli.add_command(setup)
+cli.add_command(bench)
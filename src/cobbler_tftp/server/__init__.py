@@ -4,11 +4,29 @@ This package contains the actual TFTP server.
 
 import logging
 import logging.config
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
 from importlib.resources import files
+from typing import Any, Dict, List, Union
 
+from cobbler_tftp.server import logs, metrics, profiling
+from cobbler_tftp.server.aio import AsyncTFTPServer
+from cobbler_tftp.server.metrics import start_metrics_server
 from cobbler_tftp.server.tftp import TFTPServer
+from cobbler_tftp.server.workers import PreforkTFTPServer
 from cobbler_tftp.settings import Settings
 
+# Listeners that exit sooner after being started failed immediately.
+LISTENER_MIN_UPTIME = 5.0
+# Immediate failures in a row after which the supervisor gives up.
+LISTENER_MAX_FAILURES = 5
+
+
+def _exit_on_sigterm(signum: int, frame: Any):
+    raise SystemExit(0)
+
 
 def run_server(application_settings: Settings):
     """Set up logging, initialize the server and run it."""
@@ -17,14 +35,143 @@ def run_server(application_settings: Settings):
     if logging_conf is None or not logging_conf.exists():
         logging_conf = files("cobbler_tftp.settings.data").joinpath("logging.conf")  # type: ignore
     logging.config.fileConfig(str(logging_conf))  # type: ignore
+    logs.configure_logging(application_settings)
     logging.debug("Server starting...")
+    if application_settings.metrics_port > 0:
+        # The listeners share the metrics, so only this process serves them.
+        metrics.REGISTRY.enable()
+        try:
+            start_metrics_server(
+                application_settings.metrics_addr, application_settings.metrics_port
+            )
+        except OSError as err:
+            logging.error("Could not start the metrics endpoint: %r", err)
+    if application_settings.profiling_enabled:
+        profiling.enable()
+    # Handled by all processes, which share whether profiling is on.
+    signal.signal(profiling.PROFILE_SIGNAL, profiling.toggle)
+    if application_settings.tftp_listeners > 1:
+        _supervise_listeners(application_settings)
+    elif not _serve(application_settings):
+        raise SystemExit(1)
+
+
+def _serve(application_settings: Settings) -> bool:
+    """
+    Set up a server and run it until it stops.
+
+    :param application_settings: The cobbler-tftp application settings.
+    :return: False if the server could not be set up.
+    """
     try:
-        server = TFTPServer(application_settings)
+        server: Union[TFTPServer, AsyncTFTPServer]
+        if application_settings.tftp_engine == "prefork":
+            server = PreforkTFTPServer(application_settings)
+        elif application_settings.tftp_engine == "asyncio":
+            server = AsyncTFTPServer(application_settings)
+        else:
+            server = TFTPServer(application_settings)
     except:  # pylint: disable=bare-except
         logging.exception("Fatal exception while setting up server")
-        return
+        return False
     try:
         server.run()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("Server stopping...")
     except:  # pylint: disable=bare-except
         logging.exception("Fatal exception in server")
     server.cleanup()
+    return True
+
+
+def _run_listener(application_settings: Settings):
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    if not _serve(application_settings):
+        raise SystemExit(1)
+
+
+def start_listener(application_settings: Settings) -> multiprocessing.Process:
+    """
+    Run a server in a new process, which stops on SIGTERM.
+
+    :param application_settings: The cobbler-tftp application settings.
+    :return: The started process.
+    """
+    # Listeners fork handler processes, so they must not be daemonic.
+    listener = multiprocessing.Process(
+        target=_run_listener, args=(application_settings,)
+    )
+    listener.start()
+    return listener
+
+
+def _supervise_listeners(application_settings: Settings):
+    """
+    Run one server per listener process, all sharing the TFTP port, and
+    restart listeners that die.
+
+    Listeners that fail right after being started are restarted with an
+    exponential backoff. After ``LISTENER_MAX_FAILURES`` such failures in a
+    row the supervisor stops all listeners and exits with code 1.
+    """
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    listeners: List[multiprocessing.Process] = []
+    started: List[float] = []
+    # Time at which dead listeners are restarted, by index.
+    restarts: Dict[int, float] = {}
+    failures = 0
+    try:
+        for _ in range(application_settings.tftp_listeners):
+            listeners.append(start_listener(application_settings))
+            started.append(time.monotonic())
+        while True:
+            timeout = None
+            if restarts:
+                timeout = max(min(restarts.values()) - time.monotonic(), 0.0)
+            multiprocessing.connection.wait(
+                [
+                    listener.sentinel
+                    for index, listener in enumerate(listeners)
+                    if index not in restarts
+                ],
+                timeout,
+            )
+            now = time.monotonic()
+            for index, listener in enumerate(listeners):
+                if index in restarts or listener.exitcode is None:
+                    continue
+                if now - started[index] < LISTENER_MIN_UPTIME:
+                    failures += 1
+                else:
+                    failures = 0
+                if failures >= LISTENER_MAX_FAILURES:
+                    logging.critical(
+                        "Listener %d exited with code %d, giving up after %d "
+                        "failed starts",
+                        listener.pid,
+                        listener.exitcode,
+                        failures,
+                    )
+                    raise SystemExit(1)
+                delay = 2.0 ** (failures - 1) if failures else 0.0
+                logging.error(
+                    "Listener %d exited with code %d, restarting it in %.0fs",
+                    listener.pid,
+                    listener.exitcode,
+                    delay,
+                )
+                restarts[index] = now + delay
+            for index, restart in list(restarts.items()):
+                if restart <= now:
+                    del restarts[index]
+                    listeners[index] = start_listener(application_settings)
+                    started[index] = time.monotonic()
+    except (KeyboardInterrupt, SystemExit) as err:
+        logging.info("Server stopping...")
+        if err.args and err.args[0]:
+            raise
+    finally:
+        for listener in listeners:
+            listener.terminate()
+        for listener in listeners:
+            listener.join(application_settings.tftp_timeout)
@@ -0,0 +1,486 @@
+"""
+This module contains a TFTP server that serves all sessions as coroutines on
+an asyncio event loop instead of forking a process for each session.
+
+Blocking work, like calls to the Cobbler API and file reads, is done in a
+thread pool, so one process can serve thousands of concurrent sessions.
+"""
+
+import asyncio
+import collections
+import ipaddress
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from fbtftp import constants  # type: ignore[reportMissingTypeStubs]
+from fbtftp import ResponseData, SessionStats  # type: ignore[reportMissingTypeStubs]
+from fbtftp.netascii import NetasciiReader  # type: ignore[reportMissingTypeStubs]
+
+from cobbler_tftp.server import logs, metrics
+from cobbler_tftp.server.cache import SharedFileCache
+from cobbler_tftp.server.client import CobblerClientPool, TokenManager
+from cobbler_tftp.server.invalidation import CacheInvalidator
+from cobbler_tftp.server.tftp import ResponseResolver, handler_stats_cb
+from cobbler_tftp.settings import Settings
+
+T = TypeVar("T")
+
+# Limits of the blksize option, see RFC 2348.
+MIN_BLKSIZE = 8
+MAX_BLKSIZE = 65464
+# Limits of the timeout option in seconds, see RFC 2349.
+MIN_TIMEOUT = 1
+MAX_TIMEOUT = 255
+# Block numbers wrap around to 0 after the maximum.
+BLOCK_COUNT = constants.MAX_BLOCK_NUMBER + 1
+
+
+class TFTPError(Exception):
+    """Error that ends a session and is reported to the client."""
+
+    def __init__(self, code: int, message: str):
+        """
+        Create a TFTP error.
+
+        :param code: TFTP error code.
+        :param message: Error message for the client.
+        """
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _PeerAbort(Exception):
+    """The client ended the session with an error packet."""
+
+
+def _option_value(key: str, value: str, low: int, high: int) -> int:
+    try:
+        return min(max(int(value), low), high)
+    except ValueError:
+        raise TFTPError(
+            constants.ERR_INVALID_OPTIONS, f"Invalid value for {key}: {value!r}"
+        ) from None
+
+
+class _SessionProtocol(asyncio.DatagramProtocol):
+    """Receives the packets of a single session."""
+
+    def __init__(self, peer: Tuple[str, int]):
+        self._peer = peer
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.packets: "asyncio.Queue[bytes]" = asyncio.Queue()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        if addr[:2] != self._peer[:2]:
+            # Packets from other hosts must not terminate the session, see RFC 1350.
+            message = b"Unknown transfer ID"
+            self.transport.sendto(  # type: ignore[union-attr]
+                struct.pack(
+                    "!HH", constants.OPCODE_ERROR, constants.ERR_UNKNOWN_TRANSFER_ID
+                )
+                + message
+                + b"\x00",
+                addr,
+            )
+            return
+        self.packets.put_nowait(data)
+
+
+class AsyncSession:
+    """A single TFTP read request served on the event loop."""
+
+    def __init__(
+        self,
+        server: "AsyncTFTPServer",
+        peer: Tuple[str, int],
+        path: str,
+        options: Dict[str, str],
+    ):
+        """
+        Initialize the session.
+
+        :param server: The server that received the request.
+        :param peer: Tuple containing the client address and port.
+        :param path: Request file path.
+        :param options: Options requested by the client, including the mode.
+        """
+        self._server = server
+        self._settings = server.settings
+        self._peer = peer
+        self._path = path
+        self._options = options
+        self._block_size = constants.DEFAULT_BLKSIZE
+        self._timeout = self._settings.tftp_timeout
+        self._window_size = 1
+        self._protocol: Optional[_SessionProtocol] = None
+        self._stats = SessionStats(
+            (self._settings.tftp_addr, self._settings.tftp_port), peer, path
+        )
+        # The token is acquired while resolving, see metrics.session_phases().
+        self._stats.request_time = self._stats.start_time
+        self._stats.resolved_time = None
+        self._stats.fetch_durations = []
+        self._stats.first_data_time = None
+        self._stats.last_data_time = None
+        self._stats.last_ack_time = None
+        metrics.SESSIONS_ACTIVE.inc()
+
+    def _send(self, packet: bytes) -> None:
+        self._protocol.transport.sendto(packet, self._peer)  # type: ignore[union-attr]
+        self._stats.packets_sent += 1
+
+    def _send_error(self, code: int, message: str) -> None:
+        self._stats.error = {"error_code": code, "error_message": message}
+        self._send(
+            struct.pack("!HH", constants.OPCODE_ERROR, code)
+            + message.encode("latin-1")
+            + b"\x00"
+        )
+
+    def _send_window(self, window: Deque[Tuple[int, bytes]]) -> None:
+        for _, packet in window:
+            self._send(packet)
+
+    async def _await_ack(self, window: Deque[Tuple[int, bytes]]) -> None:
+        """
+        Wait until the client acknowledges a packet of the window and remove
+        all packets up to the acknowledged one. Retransmits the window on
+        timeouts.
+        """
+        retransmits = 0
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    self._protocol.packets.get(),  # type: ignore[union-attr]
+                    max(deadline - time.monotonic(), 0),
+                )
+            except asyncio.TimeoutError:
+                if retransmits >= self._settings.tftp_retries:
+                    raise TFTPError(
+                        constants.ERR_UNDEFINED,
+                        f"timeout after {retransmits} retransmits.",
+                    ) from None
+                retransmits += 1
+                self._stats.retransmits += 1
+                self._send_window(window)
+                deadline = time.monotonic() + self._timeout
+                continue
+            if len(data) < 4:
+                raise TFTPError(constants.ERR_ILLEGAL_OPERATION, "Packet too short")
+            opcode, number = struct.unpack("!HH", data[:4])
+            if opcode == constants.OPCODE_ERROR:
+                self._stats.error = {
+                    "error_code": number,
+                    "error_message": data[4:-1].decode("ascii", "ignore"),
+                }
+                raise _PeerAbort()
+            if opcode != constants.OPCODE_ACK:
+                raise TFTPError(
+                    constants.ERR_ILLEGAL_OPERATION, "I only do reads, really"
+                )
+            if any(block_number == number for block_number, _ in window):
+                while window.popleft()[0] != number:
+                    pass
+                self._stats.packets_acked += 1
+                return
+            if self._window_size > 1 and number == (window[0][0] - 1) % BLOCK_COUNT:
+                # The client missed the first block of the window, see RFC 7440.
+                self._send_window(window)
+                deadline = time.monotonic() + self._timeout
+            # Duplicate ACKs are ignored in lock-step mode to avoid the
+            # Sorcerer's Apprentice bug.
+
+    async def _negotiate(self, response: ResponseData) -> Dict[str, str]:
+        acked: Dict[str, str] = collections.OrderedDict()
+        for key, value in self._options.items():
+            if key == "blksize":
+                self._block_size = _option_value(key, value, MIN_BLKSIZE, MAX_BLKSIZE)
+                acked[key] = str(self._block_size)
+            elif key == "tsize":
+                acked[key] = str(await self._server.run_blocking(response.size))
+            elif key == "timeout":
+                self._timeout = _option_value(key, value, MIN_TIMEOUT, MAX_TIMEOUT)
+                acked[key] = str(self._timeout)
+            elif key == "windowsize" and self._settings.tftp_max_window_size > 1:
+                self._window_size = _option_value(
+                    key, value, 1, self._settings.tftp_max_window_size
+                )
+                acked[key] = str(self._window_size)
+        self._stats.blksize = self._block_size
+        self._stats.options = acked
+        return acked
+
+    async def _transfer(self, response: ResponseData) -> None:
+        window: Deque[Tuple[int, bytes]] = collections.deque()
+        acked = await self._negotiate(response)
+        if acked:
+            packet = struct.pack("!H", constants.OPCODE_OACK) + b"".join(
+                key.encode("latin-1") + b"\x00" + value.encode("latin-1") + b"\x00"
+                for key, value in acked.items()
+            )
+            window.append((0, packet))
+            self._send(packet)
+            await self._await_ack(window)
+        block_number = 0
+        finished = False
+        while True:
+            while not finished and len(window) < self._window_size:
+                try:
+                    data = await self._server.run_blocking(self._read_block, response)
+                except Exception as err:  # pylint: disable=broad-except
+                    logging.exception("Error while reading from source: %s", err)
+                    raise TFTPError(
+                        constants.ERR_UNDEFINED, "Error while reading from source"
+                    ) from err
+                block_number = (block_number + 1) % BLOCK_COUNT
+                packet = struct.pack("!HH", constants.OPCODE_DATA, block_number) + data
+                window.append((block_number, packet))
+                self._send(packet)
+                if self._stats.first_data_time is None:
+                    self._stats.first_data_time = time.time()
+                self._stats.bytes_sent += len(data)
+                finished = len(data) < self._block_size
+                if finished:
+                    self._stats.last_data_time = time.time()
+            if not window:
+                self._stats.last_ack_time = time.time()
+                return
+            await self._await_ack(window)
+
+    def _read_block(self, response: ResponseData) -> bytes:
+        data = response.read(self._block_size)
+        while 0 < len(data) < self._block_size:
+            more = response.read(self._block_size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    async def _resolve(self, api: xmlrpc.client.Server) -> ResponseData:
+        try:
+            response = await self._server.run_blocking(
+                self._server.resolve, api, self._path
+            )
+        except FileNotFoundError as err:
+            logging.warning(str(err), extra={"category": logs.CATEGORY_MISS})
+            raise TFTPError(constants.ERR_FILE_NOT_FOUND, str(err)) from err
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception("Caught exception: %s.", err)
+            raise TFTPError(constants.ERR_UNDEFINED, str(err)) from err
+        self._stats.resolved_time = time.time()
+        self._stats.fetch_durations = getattr(response, "fetch_durations", [])
+        return response
+
+    async def run(self) -> None:
+        """Serve the request and call the stats callback at the end."""
+        loop = asyncio.get_running_loop()
+        transport, self._protocol = await loop.create_datagram_endpoint(
+            partial(_SessionProtocol, self._peer),
+            local_addr=(self._settings.tftp_addr, 0),
+        )
+        try:
+            # The response may use the client until it is closed.
+            with self._server.client() as api:
+                await self._serve(api)
+        finally:
+            transport.close()
+            try:
+                handler_stats_cb(self._stats)
+            except Exception as err:  # pylint: disable=broad-except
+                logging.exception("Exception raised in stats callback: %s", err)
+
+    async def _serve(self, api: xmlrpc.client.Server) -> None:
+        response: Optional[ResponseData] = None
+        try:
+            response = await self._resolve(api)
+            mode = self._options.pop("mode", constants.MODE_BINARY)
+            if mode == constants.MODE_NETASCII:
+                response = NetasciiReader(response)
+            elif mode != constants.MODE_BINARY:
+                raise TFTPError(
+                    constants.ERR_ILLEGAL_OPERATION, f"Unknown mode: {mode!r}"
+                )
+            await self._transfer(response)  # type: ignore[arg-type]
+        except TFTPError as err:
+            self._send_error(err.code, err.message)
+        except _PeerAbort:
+            pass
+        finally:
+            if response is not None:
+                await self._server.run_blocking(response.close)
+
+
+class _ListenerProtocol(asyncio.DatagramProtocol):
+    """Receives read requests on the TFTP port."""
+
+    def __init__(self, server: "AsyncTFTPServer"):
+        self._server = server
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self._server.on_request(data, addr)
+
+
+class AsyncTFTPServer:
+    """
+    TFTP server running all sessions on asyncio event loops.
+
+    One event loop process is started per configured worker, all of them
+    share the TFTP port using ``SO_REUSEPORT``.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Initialize the TFTP server.
+
+        :param settings: The cobbler-tftp application settings.
+        """
+        self.settings = settings
+        self._pool = CobblerClientPool(
+            settings.uri, settings.connection_pool_size, settings.file_uri
+        )
+        self._tokens = TokenManager(self._pool, settings)
+        self._cache: Optional[SharedFileCache] = None
+        if settings.cache_max_size > 0:
+            self._cache = SharedFileCache(settings)
+        self._resolver = ResponseResolver(settings, self._cache, self._pool)
+        self._invalidator: Optional[CacheInvalidator] = None
+        if self._cache is not None and settings.cache_invalidation_interval > 0:
+            self._invalidator = CacheInvalidator(
+                self._cache, self._pool, self._tokens, settings
+            )
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessions: "Set[asyncio.Task[None]]" = set()
+        self._processes: List[multiprocessing.Process] = []
+        self._family = socket.AF_INET6
+        if isinstance(ipaddress.ip_address(settings.tftp_addr), ipaddress.IPv4Address):
+            self._family = socket.AF_INET
+
+    async def run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking function in the thread pool.
+
+        :param func: The function to run.
+        :param args: Arguments for the function.
+        :return: The result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def client(self) -> ContextManager[xmlrpc.client.ServerProxy]:
+        """
+        Borrow a Cobbler API client from the pool.
+
+        :return: Context manager yielding the client.
+        """
+        return self._pool.client()
+
+    def resolve(self, api: xmlrpc.client.Server, path: str) -> ResponseData:
+        """
+        Get the response data for a path. Called in the thread pool.
+
+        :param api: Cobbler API client borrowed for the whole session.
+        :param path: Request file path.
+        :return: The response data.
+        """
+        return self._resolver.resolve(api, self._tokens.token(), path)
+
+    def on_request(self, data: bytes, peer: Tuple[str, int]) -> None:
+        """
+        Parse a read request and start a session for it.
+
+        :param data: The received packet.
+        :param peer: Tuple containing the client address and port.
+        """
+        if len(data) < 4:
+            return
+        (opcode,) = struct.unpack("!H", data[:2])
+        if opcode != constants.OPCODE_RRQ:
+            logging.warning(
+                "unexpected TFTP opcode %d, expected %d", opcode, constants.OPCODE_RRQ
+            )
+            return
+        tokens = list(filter(bool, data[2:].decode("latin-1").split("\x00")))
+        if len(tokens) < 2 or len(tokens) % 2 != 0:
+            logging.error(
+                "Received malformed packet, ignoring (tokens length: %d)", len(tokens)
+            )
+            return
+        options = collections.OrderedDict([("mode", tokens[1].lower())])
+        for pos in range(2, len(tokens), 2):
+            options[tokens[pos].lower()] = tokens[pos + 1]
+        logging.info(
+            "New connection from peer `%s` asking for path `%s`",
+            peer,
+            tokens[0],
+            extra={"category": logs.CATEGORY_SESSION},
+        )
+        metrics.REQUESTS.inc()
+        task = asyncio.ensure_future(AsyncSession(self, peer, tokens[0], options).run())
+        self._sessions.add(task)
+        task.add_done_callback(self._sessions.discard)
+
+    async def serve(self) -> None:
+        """Listen for read requests until cancelled."""
+        self._executor = ThreadPoolExecutor(self.settings.tftp_worker_threads)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            partial(_ListenerProtocol, self),
+            local_addr=(self.settings.tftp_addr, self.settings.tftp_port),
+            family=self._family,
+            reuse_port=True,
+        )
+        try:
+            await asyncio.Event().wait()
+        finally:
+            transport.close()
+            self._executor.shutdown(wait=False)
+
+    def _run_child(self) -> None:
+        # The server process stops the children on shutdown.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        asyncio.run(self.serve())
+
+    def run(self) -> None:
+        """Start one event loop per worker and serve requests."""
+        for _ in range((self.settings.tftp_workers or os.cpu_count() or 1) - 1):
+            process = multiprocessing.Process(target=self._run_child, daemon=True)
+            process.start()
+            self._processes.append(process)
+        asyncio.run(self.serve())
+
+    def cleanup(self) -> None:
+        """Stop the event loop processes and log out of Cobbler."""
+        for process in self._processes:
+            process.terminate()
+        if self._invalidator is not None:
+            self._invalidator.close()
+        self._tokens.close()
+        self._pool.close()
+        self._resolver.close()
+        if self._cache is not None:
+            self._cache.close()
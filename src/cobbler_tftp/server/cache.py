@@ -0,0 +1,835 @@
+"""
+This module contains the cache for files fetched from Cobbler.
+
+The cache index lives in a manager process, so all forked handler processes
+share it. The file contents are stored in a directory that is ideally located
+on a tmpfs, which allows serving them like static files. Alternatively, the
+cache can be kept in a persistent directory together with its index, so it
+survives restarts.
+
+The manager process also coordinates concurrent downloads of the same file,
+so that only one session fetches it from Cobbler while the others read the
+fetched chunks from the manager.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from itertools import count
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cobbler_tftp.settings import Settings
+
+# Name of the index file in a persistent cache directory.
+INDEX_FILE = "index.json"
+# Lock file preventing several servers from using the same persistent cache.
+LOCK_FILE = ".lock"
+# Names of the cached files and of the files being written, other files in
+# the directory are left alone.
+CACHE_FILE_NAME = re.compile(r"[0-9a-f]{32}(\.tmp)?")
+# Directory of the persistent cache if no directory is configured.
+DEFAULT_PERSISTENT_DIR = Path("/var/cache/cobbler-tftp")
+# Seconds changes to a persistent index are collected before it is written.
+SAVE_DELAY = 1.0
+
+
+class FileCacheIndex:
+    """
+    Size-bounded LRU index of the cached files.
+
+    An instance of this class is only ever accessed through a proxy from
+    :class:`CacheManager`. All methods are called from the manager's
+    connection threads, so they must hold the lock.
+
+    A persistent index is loaded from and saved to a JSON file in the cache
+    directory. Only entries whose file still has the recorded size are
+    loaded, their content hash is verified with the first hit. Changes are
+    written together after ``SAVE_DELAY`` seconds.
+    """
+
+    def __init__(
+        self, directory: str, max_size: int, ttl: int, persistent: bool = False
+    ):
+        """
+        Initialize the index.
+
+        :param directory: Directory containing the cached files.
+        :param max_size: Maximum total size of all cached files in bytes.
+        :param ttl: Time in seconds after which an entry expires.
+        :param persistent: Load the index from the directory and save the changes.
+        """
+        self._directory = directory
+        self._max_size = max_size
+        self._ttl = ttl
+        self._persistent = persistent
+        self._entries: "OrderedDict[str, Tuple[str, int, float, str]]" = OrderedDict()
+        # Loaded entries whose content hash was not verified yet.
+        self._unverified: Set[str] = set()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        if persistent:
+            self._load()
+
+    def _load(self) -> None:
+        index_path = os.path.join(self._directory, INDEX_FILE)
+        try:
+            with open(index_path, encoding="UTF-8") as index_file:
+                entries: List[Dict[str, Any]] = json.load(index_file)["entries"]
+        except FileNotFoundError:
+            entries = []
+        except (OSError, ValueError, KeyError) as err:
+            logging.warning("Ignoring invalid cache index %s: %r", index_path, err)
+            entries = []
+        now = time.time()
+        for entry in entries:
+            age = now - entry["fetched"]
+            file_path = os.path.join(self._directory, entry["name"])
+            if 0 <= age <= self._ttl and _file_size(file_path) == entry["size"]:
+                self._entries[entry["path"]] = (
+                    entry["name"],
+                    entry["size"],
+                    time.monotonic() - age,
+                    entry["sha256"],
+                )
+                self._unverified.add(entry["path"])
+                self._size += entry["size"]
+        while self._size > self._max_size:
+            self._remove(next(iter(self._entries)))
+        # Remove expired or damaged files and leftovers of interrupted writes.
+        names = {entry[0] for entry in self._entries.values()}
+        for name in os.listdir(self._directory):
+            if CACHE_FILE_NAME.fullmatch(name) and name not in names:
+                os.unlink(os.path.join(self._directory, name))
+        self._write()
+
+    def _save(self) -> None:
+        # Called with the lock held.
+        if not self._persistent or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(SAVE_DELAY, self.save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def save(self) -> None:
+        """Write the changes of a persistent index right away."""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            self._write()
+
+    def _write(self) -> None:
+        now = time.time()
+        monotonic_now = time.monotonic()
+        entries = [
+            {
+                "path": path,
+                "name": name,
+                "size": size,
+                "fetched": now - (monotonic_now - stored_at),
+                "sha256": digest,
+            }
+            for path, (name, size, stored_at, digest) in self._entries.items()
+        ]
+        index_path = os.path.join(self._directory, INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="UTF-8") as index_file:
+            json.dump({"entries": entries}, index_file)
+        os.replace(index_path + ".tmp", index_path)
+
+    def _remove(self, path: str) -> None:
+        name, size, _, _ = self._entries.pop(path)
+        self._unverified.discard(path)
+        self._size -= size
+        try:
+            os.unlink(os.path.join(self._directory, name))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, path: str) -> Optional[Tuple[str, int]]:
+        """
+        Find a file in the cache and mark it as recently used.
+
+        :param path: The requested TFTP path.
+        :return: Tuple with the name of the cache file and its size or None.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self._misses += 1
+                return None
+            name, size, stored_at, digest = entry
+            if time.monotonic() - stored_at > self._ttl:
+                self._remove(path)
+                self._save()
+                self._misses += 1
+                return None
+            if path not in self._unverified:
+                self._entries.move_to_end(path)
+                self._hits += 1
+                return name, size
+        # Hashed without the lock, so other lookups are not blocked.
+        valid = _file_digest(os.path.join(self._directory, name)) == digest
+        with self._lock:
+            if self._entries.get(path) != entry:
+                # Replaced or removed while it was hashed.
+                self._misses += 1
+                return None
+            if not valid:
+                logging.warning("Removing damaged cache file of %s", path)
+                self._remove(path)
+                self._save()
+                self._misses += 1
+                return None
+            self._unverified.discard(path)
+            self._entries.move_to_end(path)
+            self._hits += 1
+            return name, size
+
+    def insert(self, path: str, name: str, size: int, digest: str = "") -> bool:
+        """
+        Add a file that was written to the cache directory to the index.
+
+        Least recently used entries are evicted until the file fits.
+
+        :param path: The TFTP path of the file.
+        :param name: Name of the file inside the cache directory.
+        :param size: Size of the file in bytes.
+        :param digest: SHA-256 hex digest of the file contents.
+        :return: True if the file was added, False if it was rejected.
+        """
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            if size > self._max_size:
+                os.unlink(os.path.join(self._directory, name))
+                self._save()
+                return False
+            while self._size + size > self._max_size:
+                self._remove(next(iter(self._entries)))
+            self._entries[path] = (name, size, time.monotonic(), digest)
+            self._size += size
+            self._save()
+            return True
+
+    def invalidate(self, path: str) -> None:
+        """
+        Remove a file from the cache.
+
+        :param path: The TFTP path of the file.
+        """
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+                self._save()
+
+    def entries(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Get all cached files.
+
+        :return: Dictionary mapping the TFTP paths to the file sizes and the
+                 times the files were fetched.
+        """
+        with self._lock:
+            offset = time.time() - time.monotonic()
+            return {
+                path: (size, stored_at + offset)
+                for path, (_, size, stored_at, _) in self._entries.items()
+            }
+
+    def clear(self) -> None:
+        """Remove all files from the cache."""
+        with self._lock:
+            for path in list(self._entries):
+                self._remove(path)
+            self._save()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get statistics about the cache.
+
+        :return: Dictionary with the number of entries, their size, hits and misses.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+def _file_size(file_path: str) -> Optional[int]:
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return None
+
+
+def _file_digest(file_path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as cached_file:
+            for block in iter(lambda: cached_file.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class _FlightState:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, path: str):
+        self.path = path
+        # Published chunks by offset. The leader may publish them out of
+        # order when it reads ahead.
+        self.chunks: Dict[int, bytes] = {}
+        self.size = 0
+        # End of the chunks the leader fetched so far.
+        self.fetched = 0
+        # Offsets up to which each follower reads or fetches on its own.
+        self.positions: Dict[int, int] = {}
+        self.starts: Dict[int, int] = {}
+        self.overflowed = False
+        self.finished = False
+
+    def find(self, offset: int) -> Optional[bytes]:
+        for chunk_offset, data in self.chunks.items():
+            if chunk_offset <= offset < chunk_offset + len(data):
+                return data[offset - chunk_offset :]
+        return None
+
+
+class FlightRegistry:
+    """
+    Registry of the files that are currently fetched from Cobbler.
+
+    The first session requesting a file becomes the leader of a flight and
+    reports every chunk it fetches. Sessions requesting the same file while
+    the flight is active join it as followers. They fetch the chunks before
+    the position of the leader on their own and wait for all later chunks
+    instead of fetching them.
+
+    Chunks are only published while followers are attached and are dropped
+    once every follower read past them. If the chunks of all flights exceed
+    the memory limit, a flight stops publishing and its followers fetch the
+    remaining chunks on their own.
+
+    An instance of this class is only ever accessed through a proxy from
+    :class:`CacheManager`.
+    """
+
+    def __init__(self, timeout: float, max_memory: int):
+        """
+        Initialize the registry.
+
+        :param timeout: Time in seconds a follower waits for a chunk.
+        :param max_memory: Maximum total size of the published chunks in bytes.
+        """
+        self._timeout = timeout
+        self._max_memory = max_memory
+        self._memory = 0
+        self._ids = count(1)
+        self._flights: Dict[int, _FlightState] = {}
+        self._active: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def join(self, path: str) -> Tuple[int, int]:
+        """
+        Join the active flight for a file or start a new one.
+
+        :param path: The requested TFTP path.
+        :return: Tuple with the ID of the flight and the ID of the caller in
+                 the flight, which is 0 for the leader.
+        """
+        with self._cond:
+            flight_id = self._active.get(path)
+            if flight_id is not None and not self._flights[flight_id].overflowed:
+                flight = self._flights[flight_id]
+                member = next(self._ids)
+                flight.starts[member] = flight.fetched
+                flight.positions[member] = flight.fetched
+                return flight_id, member
+            flight_id = next(self._ids)
+            self._flights[flight_id] = _FlightState(path)
+            self._active[path] = flight_id
+            return flight_id, 0
+
+    def _drop_consumed(self, flight: _FlightState) -> None:
+        position = min(flight.positions.values(), default=flight.fetched)
+        for offset, data in list(flight.chunks.items()):
+            if offset + len(data) <= position:
+                del flight.chunks[offset]
+                self._memory -= len(data)
+
+    def _drop_all(self, flight: _FlightState) -> None:
+        self._memory -= sum(len(data) for data in flight.chunks.values())
+        flight.chunks.clear()
+
+    def publish(self, flight_id: int, offset: int, data: bytes, size: int) -> bool:
+        """
+        Publish a chunk fetched by the leader.
+
+        :param flight_id: ID of the flight.
+        :param offset: Offset of the chunk in the file.
+        :param data: Contents of the chunk.
+        :param size: Size of the whole file.
+        :return: Whether the contents of the next chunk are wanted.
+        """
+        with self._cond:
+            flight = self._flights[flight_id]
+            flight.size = size
+            if flight.positions and not flight.overflowed:
+                # A chunk that is published again replaces the previous one.
+                replaced = len(flight.chunks.get(offset, b""))
+                if self._memory - replaced + len(data) > self._max_memory:
+                    # The followers continue on their own.
+                    flight.overflowed = True
+                    self._drop_all(flight)
+                else:
+                    flight.chunks[offset] = data
+                    self._memory += len(data) - replaced
+            flight.fetched = max(flight.fetched, offset + len(data))
+            self._cond.notify_all()
+            return bool(flight.positions) and not flight.overflowed
+
+    def skip(self, flight_id: int, offset: int, length: int) -> bool:
+        """
+        Report a chunk fetched by the leader without sending its contents.
+        Followers fetch it on their own.
+
+        :param flight_id: ID of the flight.
+        :param offset: Offset of the chunk in the file.
+        :param length: Length of the chunk.
+        :return: Whether the contents of the next chunk are wanted.
+        """
+        with self._cond:
+            flight = self._flights[flight_id]
+            flight.fetched = max(flight.fetched, offset + length)
+            for member, start in flight.starts.items():
+                flight.starts[member] = max(start, flight.fetched)
+            self._cond.notify_all()
+            return bool(flight.positions) and not flight.overflowed
+
+    def read(
+        self, flight_id: int, member: int, offset: int
+    ) -> Optional[Tuple[bytes, int]]:
+        """
+        Wait for a chunk published by the leader.
+
+        :param flight_id: ID of the flight.
+        :param member: ID of the follower in the flight.
+        :param offset: Offset in the file.
+        :return: Tuple with the contents of the file from the offset to the end
+                 of the chunk containing it and the size of the file. The
+                 contents are empty if the follower has to fetch the chunk on
+                 its own. None if the leader will not publish the chunk in time.
+        """
+        with self._cond:
+            flight = self._flights[flight_id]
+            flight.positions[member] = offset
+            self._drop_consumed(flight)
+            data: Optional[bytes] = None
+
+            def ready() -> bool:
+                nonlocal data
+                data = flight.find(offset)
+                return (
+                    data is not None
+                    or offset < flight.starts[member]
+                    or flight.overflowed
+                    or flight.finished
+                )
+
+            self._cond.wait_for(ready, self._timeout)
+            if data is not None:
+                flight.positions[member] = offset + len(data)
+                self._drop_consumed(flight)
+                return data, flight.size
+            if offset < flight.starts[member]:
+                return b"", flight.size
+            return None
+
+    def _remove_if_done(self, flight_id: int) -> None:
+        flight = self._flights[flight_id]
+        if flight.finished and not flight.positions:
+            self._drop_all(flight)
+            del self._flights[flight_id]
+
+    def finish(self, flight_id: int) -> None:
+        """
+        Called by the leader when it stops fetching chunks.
+
+        :param flight_id: ID of the flight.
+        """
+        with self._cond:
+            flight = self._flights[flight_id]
+            flight.finished = True
+            if self._active.get(flight.path) == flight_id:
+                del self._active[flight.path]
+            self._remove_if_done(flight_id)
+            self._cond.notify_all()
+
+    def leave(self, flight_id: int, member: int) -> None:
+        """
+        Called by a follower when it does not need any more chunks.
+
+        :param flight_id: ID of the flight.
+        :param member: ID of the follower in the flight.
+        """
+        with self._cond:
+            flight = self._flights[flight_id]
+            del flight.positions[member]
+            del flight.starts[member]
+            if flight.positions:
+                self._drop_consumed(flight)
+            else:
+                self._drop_all(flight)
+            self._remove_if_done(flight_id)
+
+    def active(self) -> List[str]:
+        """
+        Get the files that are currently fetched.
+
+        :return: List of TFTP paths.
+        """
+        with self._cond:
+            return list(self._active)
+
+    def memory(self) -> int:
+        """
+        Get the total size of the published chunks.
+
+        :return: The size in bytes.
+        """
+        with self._cond:
+            return self._memory
+
+
+class NegativeCache:
+    """
+    Remembers paths that could not be served for a short time, so repeated
+    requests for them are answered without asking Cobbler again.
+
+    Unlike the file cache, it is local to each process.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        """
+        Initialize an empty negative cache.
+
+        :param ttl: Time in seconds a path is remembered.
+        :param max_entries: Maximum number of remembered paths.
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> None:
+        """
+        Remember a missing path.
+
+        :param path: The requested TFTP path.
+        """
+        with self._lock:
+            self._entries[path] = time.monotonic() + self._ttl
+            self._entries.move_to_end(path)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            expires = self._entries.get(path)
+            if expires is None:
+                return False
+            if time.monotonic() > expires:
+                del self._entries[path]
+                return False
+            return True
+
+
+class CacheManager(BaseManager):
+    """Manager process that owns the :class:`FileCacheIndex` and :class:`FlightRegistry`."""
+
+
+CacheManager.register("FileCacheIndex", FileCacheIndex)
+CacheManager.register("FlightRegistry", FlightRegistry)
+
+
+class Flight:
+    """
+    Participation of a single session in a flight of the :class:`FlightRegistry`.
+    """
+
+    def __init__(self, registry: FlightRegistry, path: str) -> None:
+        """
+        Join or start the flight for a file.
+
+        :param registry: Proxy of the flight registry.
+        :param path: The requested TFTP path.
+        """
+        self._registry = registry
+        self._id, self._member = registry.join(path)
+        self.leader = self._member == 0
+        # The followers that joined so far want the contents of the chunks.
+        self._wanted = False
+        self.closed = False
+
+    def publish(self, offset: int, data: bytes, size: int) -> None:
+        """
+        Publish a chunk to the followers. Only valid for the leader.
+
+        :param offset: Offset of the chunk in the file.
+        :param data: Contents of the chunk.
+        :param size: Size of the whole file.
+        """
+        if self.closed:
+            return
+        if self._wanted:
+            self._wanted = self._registry.publish(self._id, offset, data, size)
+        else:
+            self._wanted = self._registry.skip(self._id, offset, len(data))
+
+    def read(self, offset: int) -> Optional[Tuple[bytes, int]]:
+        """
+        Get a chunk fetched by the leader. Only valid for followers.
+
+        :param offset: Offset of the chunk in the file.
+        :return: Tuple with the contents of the file from the offset to the end
+                 of the chunk and the size of the file, or None if the chunk
+                 has to be fetched directly. The flight is closed if the
+                 leader will not publish the chunk in time.
+        """
+        if self.closed:
+            return None
+        chunk = self._registry.read(self._id, self._member, offset)
+        if chunk is None:
+            self.close()
+            return None
+        if not chunk[0]:
+            # Fetched by the leader before this session joined.
+            return None
+        return chunk
+
+    def close(self) -> None:
+        """Stop participating in the flight."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.leader:
+            self._registry.finish(self._id)
+        else:
+            self._registry.leave(self._id, self._member)
+
+
+class CacheFile:
+    """
+    File that is written to the cache directory chunk by chunk while it is
+    fetched. It only becomes visible once it is complete and stored with
+    :meth:`SharedFileCache.store`.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        Create a temporary file in the cache directory.
+
+        :param directory: The cache directory.
+        """
+        self.name = uuid.uuid4().hex
+        self.temporary = directory / f"{self.name}.tmp"
+        self.size = 0
+        self._file = open(self.temporary, "xb")  # pylint: disable=consider-using-with
+        self._digest = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Append a chunk to the file.
+
+        :param chunk: The next chunk of the file.
+        """
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.size += len(chunk)
+
+    def digest(self) -> str:
+        """
+        Get the hash of the written contents.
+
+        :return: SHA-256 hex digest of the file contents.
+        """
+        return self._digest.hexdigest()
+
+    def close(self) -> None:
+        """Close the file, keeping its contents."""
+        self._file.close()
+
+    def discard(self) -> None:
+        """Close and remove the file."""
+        self._file.close()
+        try:
+            self.temporary.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedFileCache:
+    """
+    Client side of the cache that is shared between all TFTP sessions.
+
+    Objects of this class are created in the server process and inherited by
+    the forked handler processes.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Start the manager process and create or open the cache directory.
+
+        :param settings: The cobbler-tftp application settings.
+        """
+        self._manager = CacheManager()
+        self._manager.start()  # pylint: disable=consider-using-with
+        self._lock_file: Optional[int] = None
+        if settings.cache_persistent:
+            self._open_persistent(settings.cache_dir or DEFAULT_PERSISTENT_DIR)
+        if self._lock_file is None:
+            parent: Optional[Path] = settings.cache_dir
+            if parent is None and os.path.isdir("/dev/shm"):
+                parent = Path("/dev/shm")
+            self.directory = Path(tempfile.mkdtemp(prefix="cobbler-tftp-", dir=parent))
+        self.max_file_size = settings.cache_max_file_size
+        self._index: FileCacheIndex = self._manager.FileCacheIndex(  # type: ignore
+            str(self.directory),
+            settings.cache_max_size,
+            settings.cache_ttl,
+            self._lock_file is not None,
+        )
+        self._flights: Optional[FlightRegistry] = None
+        if settings.cache_coalesce:
+            self._flights = self._manager.FlightRegistry(  # type: ignore
+                settings.tftp_timeout, settings.cache_coalesce_max_memory
+            )
+
+    def _open_persistent(self, directory: Path) -> None:
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            lock_file = os.open(directory / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as err:
+            logging.warning("Cannot use persistent cache %s: %r", directory, err)
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another listener owns the directory.
+            os.close(lock_file)
+            logging.warning(
+                "Persistent cache %s is in use, using a temporary cache", directory
+            )
+            return
+        self.directory = directory
+        self._lock_file = lock_file
+
+    def join_flight(self, path: str) -> Optional[Flight]:
+        """
+        Join or start the flight for a file that is not cached.
+
+        :param path: The requested TFTP path.
+        :return: The flight or None if coalescing is disabled.
+        """
+        if self._flights is None:
+            return None
+        return Flight(self._flights, path)
+
+    def lookup(self, path: str) -> Optional[Path]:
+        """
+        Find a file in the cache.
+
+        :param path: The requested TFTP path.
+        :return: Location of the cached file or None.
+        """
+        entry = self._index.lookup(path)
+        if entry is None:
+            return None
+        return self.directory / entry[0]
+
+    def create_file(self, path: str) -> Optional[CacheFile]:
+        """
+        Start writing a file to the cache directory.
+
+        :param path: The TFTP path of the file.
+        :return: The file or None if it cannot be created.
+        """
+        try:
+            return CacheFile(self.directory)
+        except OSError as err:
+            logging.warning("Could not cache %s: %r", path, err)
+            return None
+
+    def store(self, path: str, cache_file: CacheFile, size: int) -> None:
+        """
+        Move a completely written file into place and add it to the index.
+
+        :param path: The TFTP path of the file.
+        :param cache_file: The file created with :meth:`create_file`.
+        :param size: Size of the file in bytes, the file is discarded if it
+                     does not match.
+        """
+        if size > self.max_file_size or cache_file.size != size:
+            cache_file.discard()
+            return
+        try:
+            cache_file.close()
+            cache_file.temporary.replace(self.directory / cache_file.name)
+        except OSError as err:
+            logging.warning("Could not cache %s: %r", path, err)
+            cache_file.discard()
+            return
+        self._index.insert(path, cache_file.name, size, cache_file.digest())
+
+    def invalidate(self, path: str) -> None:
+        """
+        Remove a file from the cache.
+
+        :param path: The TFTP path of the file.
+        """
+        self._index.invalidate(path)
+
+    def entries(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Get all cached files.
+
+        :return: Dictionary mapping the TFTP paths to the file sizes and the
+                 times the files were fetched.
+        """
+        return self._index.entries()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get statistics about the cache.
+
+        :return: Dictionary with the number of entries, their size, hits and misses.
+        """
+        return self._index.stats()
+
+    def close(self) -> None:
+        """Stop the manager process and remove all cached files unless the cache is persistent."""
+        self._index.save()
+        self._manager.shutdown()
+        if self._lock_file is not None:
+            os.close(self._lock_file)
+            return
+        shutil.rmtree(self.directory, ignore_errors=True)
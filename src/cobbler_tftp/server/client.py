@@ -0,0 +1,459 @@
+"""
+This module contains the client used to talk to the Cobbler API and the
+manager for its login token.
+"""
+
+import email.utils
+import http.client
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+import xmlrpc.client
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+
+from cobbler_tftp.settings import Settings
+
+# Maximum time in seconds between retries of a failed login.
+MAX_LOGIN_BACKOFF = 60
+
+# Timeout in seconds of the socket of a file request.
+REQUEST_TIMEOUT = 30
+
+# Timeout in seconds of the socket of a streaming download.
+STREAM_TIMEOUT = 30
+
+# Parts of the messages of the faults that mean a file does not exist. Cobbler
+# reports the exception of opening the file, the HTTP client its status.
+MISSING_FILE_FAULTS = ("FileNotFoundError", "IsADirectoryError", "not found")
+
+_CONTENT_RANGE = re.compile(r"bytes (?:\d+-\d+|\*)/(\d+)")
+
+
+def is_missing_file(err: xmlrpc.client.Error) -> bool:
+    """
+    Check whether Cobbler reported that a file does not exist.
+
+    :param err: The error raised while fetching the file.
+    :return: True for faults about missing files, False for other faults like
+             invalid tokens and for errors reaching Cobbler.
+    """
+    if not isinstance(err, xmlrpc.client.Fault):
+        return False
+    message = str(err.faultString).lower()
+    return any(part.lower() in message for part in MISSING_FILE_FAULTS)
+
+
+class _ForkSafeTransportMixin:
+    """
+    Keeps the HTTP connection of a transport open between requests, but never
+    reuses a connection that was inherited from a parent process.
+    """
+
+    _connection: Any
+    _extra_headers: List[Any]
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)  # type: ignore
+        self._pid = os.getpid()
+
+    def make_connection(self, host: Any) -> Any:
+        """
+        Return the cached connection or open a new one.
+
+        :param host: The host part of the URI.
+        :return: The HTTP connection.
+        """
+        if self._pid != os.getpid():
+            # The socket is shared with the parent, so it must not be used or
+            # closed here.
+            self._connection = (None, None)
+            self._extra_headers = []
+            self._pid = os.getpid()
+        return super().make_connection(host)  # type: ignore
+
+
+class KeepAliveTransport(_ForkSafeTransportMixin, xmlrpc.client.Transport):
+    """HTTP transport with a persistent connection."""
+
+
+class SafeKeepAliveTransport(_ForkSafeTransportMixin, xmlrpc.client.SafeTransport):
+    """HTTPS transport with a persistent connection."""
+
+
+class HTTPFileServerProxy(xmlrpc.client.ServerProxy):
+    """
+    Cobbler API client that fetches file contents with HTTP range requests
+    instead of ``get_tftp_file``. This avoids the base64 encoding and the
+    XML parsing of every chunk. All other calls still use XML-RPC.
+
+    Missing files are reported as :class:`xmlrpc.client.Fault` and other
+    HTTP errors as :class:`xmlrpc.client.ProtocolError`, like XML-RPC does.
+    """
+
+    def __init__(self, uri: str, file_uri: str, transport: xmlrpc.client.Transport):
+        """
+        Initialize the client.
+
+        :param uri: URI of the Cobbler API.
+        :param file_uri: URI under which Cobbler serves the TFTP files over HTTP.
+        :param transport: Transport used for the XML-RPC calls.
+        """
+        # ServerProxy answers lookups of missing attributes with remote methods.
+        self._file_uri = file_uri.rstrip("/") + "/"
+        file_url = urllib.parse.urlsplit(file_uri)
+        self._https = file_url.scheme == "https"
+        self._host = file_url.netloc
+        self._file_path = file_url.path.rstrip("/") + "/"
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._pid = os.getpid()
+        super().__init__(uri, transport=transport)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._pid != os.getpid():
+            # The socket is shared with the parent, so it must not be used or
+            # closed here.
+            self._connection = None
+            self._pid = os.getpid()
+        if self._connection is None:
+            if self._https:
+                self._connection = http.client.HTTPSConnection(
+                    self._host, timeout=REQUEST_TIMEOUT
+                )
+            else:
+                self._connection = http.client.HTTPConnection(
+                    self._host, timeout=REQUEST_TIMEOUT
+                )
+        return self._connection
+
+    def _drop_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+    def _url_path(self, path: str) -> str:
+        # Like the static fallback directory, paths cannot leave the root.
+        path = os.path.normpath(os.path.join("/", path)).strip("/")
+        return self._file_path + urllib.parse.quote(path)
+
+    def _error(
+        self, path: str, response: http.client.HTTPResponse
+    ) -> xmlrpc.client.Error:
+        if response.status == 404:
+            return xmlrpc.client.Fault(1, f"File not found: {path}")
+        return xmlrpc.client.ProtocolError(
+            self._file_uri + path,
+            response.status,
+            response.reason,
+            response.headers,  # type: ignore[arg-type]
+        )
+
+    def _request(self, path: str, headers: Any) -> http.client.HTTPResponse:
+        reused = self._connection is not None and self._pid == os.getpid()
+        connection = self._connect()
+        try:
+            connection.request("GET", path, headers=headers)
+            return connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            self._drop_connection()
+            if not reused:
+                raise
+        # The server may have closed the idle connection.
+        return self._request(path, headers)
+
+    def _get_range(
+        self, path: str, offset: int, size: int
+    ) -> Tuple[bytes, int, http.client.HTTPResponse]:
+        # Range requests cannot be empty, so at least one byte is requested.
+        response = self._request(
+            self._url_path(path),
+            {"Range": f"bytes={offset}-{offset + max(size, 1) - 1}"},
+        )
+        if response.status == 200:
+            # The server ignored the range. Only the requested part of the
+            # body is read, so the connection cannot be reused.
+            length = response.getheader("Content-Length")
+            if offset > 0 or length is None:
+                self._drop_connection()
+                raise xmlrpc.client.ProtocolError(
+                    self._file_uri + path,
+                    response.status,
+                    "Range requests are not supported",
+                    response.headers,  # type: ignore[arg-type]
+                )
+            data = response.read(size)
+            self._drop_connection()
+            return data, int(length), response
+        data = response.read()
+        match = _CONTENT_RANGE.match(response.getheader("Content-Range", ""))
+        if response.status not in (206, 416) or match is None:
+            raise self._error(path, response)
+        # 416 means the offset is at or behind the end of the file.
+        if response.status == 416:
+            data = b""
+        return data[:size], int(match.group(1)), response
+
+    def get_tftp_file(
+        self, path: str, offset: int, size: int, token: str
+    ) -> Tuple[xmlrpc.client.Binary, int]:
+        """
+        Fetch a part of a file.
+
+        :param path: Path of the file relative to the TFTP root.
+        :param offset: Offset of the part in the file.
+        :param size: Maximum size of the part.
+        :param token: Login token, unused as the files are served publicly.
+        :return: Tuple with the contents of the part and the size of the file.
+        """
+        data, file_size, _ = self._get_range(path, offset, size)
+        return xmlrpc.client.Binary(data), file_size
+
+    def stat_tftp_file(self, path: str, token: str) -> Tuple[int, Optional[float]]:
+        """
+        Get the size and modification time of a file without downloading it.
+
+        :param path: Path of the file relative to the TFTP root.
+        :param token: Login token, unused as the files are served publicly.
+        :return: Tuple with the size of the file and the time it was last
+                 modified, or None if the server did not report it.
+        """
+        _, size, response = self._get_range(path, 0, 0)
+        last_modified = response.getheader("Last-Modified")
+        if last_modified is None:
+            return size, None
+        try:
+            return size, email.utils.parsedate_to_datetime(last_modified).timestamp()
+        except (TypeError, ValueError):
+            return size, None
+
+    def open_tftp_file(
+        self, path: str, offset: int, token: str
+    ) -> http.client.HTTPResponse:
+        """
+        Start a download of a file on its own connection, so that it can be
+        read incrementally.
+
+        :param path: Path of the file relative to the TFTP root.
+        :param offset: Offset in the file where the download starts.
+        :param token: Login token, unused as the files are served publicly.
+        :return: The response, which the caller must close.
+        """
+        if self._https:
+            connection: http.client.HTTPConnection = http.client.HTTPSConnection(
+                self._host, timeout=STREAM_TIMEOUT
+            )
+        else:
+            connection = http.client.HTTPConnection(self._host, timeout=STREAM_TIMEOUT)
+        # The response keeps the socket open after the connection is closed.
+        connection.request(
+            "GET",
+            self._url_path(path),
+            headers={"Range": f"bytes={offset}-", "Connection": "close"},
+        )
+        response = connection.getresponse()
+        if response.status == 206 or (response.status == 200 and offset == 0):
+            return response
+        response.close()
+        raise self._error(path, response)
+
+    def __call__(self, attr: str) -> Any:
+        if attr == "close":
+            return self._close
+        return super().__call__(attr)
+
+    def _close(self) -> None:
+        if self._pid == os.getpid():
+            self._drop_connection()
+        self._connection = None
+        super().__call__("close")()
+
+
+class CobblerClientPool:
+    """
+    Pool of Cobbler API clients with persistent keep-alive connections.
+
+    Clients are handed out to one user at a time. A client may still be used
+    by a forked handler process after it was returned to the pool, as its
+    transport opens a new connection after a fork.
+    """
+
+    def __init__(self, uri: str, size: int, file_uri: Optional[str] = None):
+        """
+        Initialize an empty pool.
+
+        :param uri: URI of the Cobbler API.
+        :param size: Maximum number of idle clients kept in the pool.
+        :param file_uri: URI under which Cobbler serves the TFTP files over
+                         HTTP. If given, file contents are fetched from there.
+        """
+        self._uri = uri
+        self._file_uri = file_uri
+        self._size = size
+        self._idle: List[xmlrpc.client.ServerProxy] = []
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def _create(self) -> xmlrpc.client.ServerProxy:
+        if self._uri.startswith("https:"):
+            transport: xmlrpc.client.Transport = SafeKeepAliveTransport()
+        else:
+            transport = KeepAliveTransport()
+        if self._file_uri is not None:
+            return HTTPFileServerProxy(self._uri, self._file_uri, transport)
+        return xmlrpc.client.ServerProxy(self._uri, transport=transport)
+
+    @contextmanager
+    def client(self) -> Iterator[xmlrpc.client.ServerProxy]:
+        """
+        Borrow a client from the pool.
+
+        :return: Context manager yielding the client.
+        """
+        with self._lock:
+            api = self._idle.pop() if self._idle else None
+        if api is None:
+            api = self._create()
+        try:
+            yield api
+        except:  # pylint: disable=bare-except
+            # The connection may be in an undefined state.
+            api("close")()
+            raise
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(api)
+                return
+        api("close")()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for api in idle:
+            api("close")()
+
+
+class TokenManager:
+    """
+    Keeps a valid login token for the Cobbler API.
+
+    The token is refreshed by a background thread before it expires, so
+    sessions never wait for a login, except for the very first one. Failed
+    logins are retried with exponential backoff while the previous token
+    keeps being used.
+
+    Threads do not survive a fork, so every process that asks for a token
+    starts its own refresh thread, starting from the token inherited from
+    its parent. It is refreshed when the parent would have refreshed it.
+    """
+
+    def __init__(self, pool: CobblerClientPool, settings: Settings):
+        """
+        Initialize the token manager and start the first login.
+
+        :param pool: Pool providing the clients used to log in.
+        :param settings: The cobbler-tftp application settings.
+        """
+        self._pool = pool
+        self._settings = settings
+        self._password: Optional[str] = None
+        self._token: Optional[str] = None
+        self._token_pid: Optional[int] = None
+        self._token_time = 0.0
+        self._error: Optional[Exception] = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+        self._start()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        if self._token is not None:
+            self._ready.set()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._stop = threading.Event()
+            delay = 0.0
+            if self._token is not None:
+                # The inherited token is valid until it reaches the refresh age.
+                age = time.monotonic() - self._token_time
+                delay = max(0.0, self._settings.token_refresh_interval - age)
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stop, delay), daemon=True
+            )
+            self._thread.start()
+
+    def _login(self) -> None:
+        if self._password is None:
+            # Reading the password file for every login would block on the disk.
+            self._password = self._settings.password
+        with self._pool.client() as api:
+            token: str = api.login(self._settings.user, self._password)  # type: ignore
+        # The previous token is not logged out, as forked handlers may still
+        # use it. It expires on its own.
+        self._token, self._token_pid = token, os.getpid()
+        self._token_time = time.monotonic()
+        self._ready.set()
+
+    def _logout(self, token: str) -> None:
+        try:
+            with self._pool.client() as api:
+                api.logout(token)
+        except (OSError, xmlrpc.client.Error) as err:
+            logging.debug("Logout from Cobbler failed: %r", err)
+
+    def _run(self, stop: threading.Event, delay: float) -> None:
+        failures = 0
+        while not stop.wait(delay):
+            try:
+                self._login()
+            except (OSError, xmlrpc.client.Error) as err:
+                failures += 1
+                delay = min(2**failures, MAX_LOGIN_BACKOFF)
+                logging.warning(
+                    "Login to Cobbler failed, retrying in %d seconds: %r", delay, err
+                )
+                self._error = err
+                # The password file may have been changed.
+                self._password = None
+                self._ready.set()
+                continue
+            failures = 0
+            self._error = None
+            delay = self._settings.token_refresh_interval
+
+    def token(self) -> str:
+        """
+        Get the current token. Only blocks if no login succeeded yet.
+
+        :return: The login token.
+        """
+        self._start()
+        if self._token is None:
+            self._ready.wait(self._settings.tftp_timeout)
+        if self._token is None:
+            if self._error is not None:
+                raise self._error
+            raise TimeoutError("Login to Cobbler timed out")
+        return self._token
+
+    def close(self) -> None:
+        """Stop refreshing the token and log out."""
+        self._stop.set()
+        if self._token is not None and self._token_pid == os.getpid():
+            self._logout(self._token)
+            self._token = None
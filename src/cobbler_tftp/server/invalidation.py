@@ -0,0 +1,117 @@
+"""
+This module contains the invalidation of the shared file cache when Cobbler
+reports changes.
+"""
+
+import fnmatch
+import logging
+import re
+import threading
+import xmlrpc.client
+from typing import Optional
+
+from cobbler_tftp.server.cache import SharedFileCache
+from cobbler_tftp.server.client import (
+    CobblerClientPool,
+    HTTPFileServerProxy,
+    TokenManager,
+    is_missing_file,
+)
+from cobbler_tftp.settings import Settings
+
+# Resolution of the modification times reported over HTTP in seconds.
+MTIME_RESOLUTION = 1.0
+
+
+class CacheInvalidator:
+    """
+    Polls Cobbler for changes and removes outdated files from the cache.
+
+    Whenever the last modification time reported by Cobbler changes, cached
+    files matching one of the volatile path patterns are removed right away,
+    as they are typically generated by Cobbler. All other cached files are
+    revalidated without downloading them: they are removed if their size
+    changed, or, if the files are fetched over HTTP, if they were modified
+    after they were cached. The XML-RPC API only reports the size, so files
+    changed in place to the same size stay cached until the ttl expires.
+    The first poll revalidates all files, as they may have been loaded from a
+    persistent cache. Files are only removed for faults about missing files,
+    other faults stop the revalidation until the next poll.
+    """
+
+    def __init__(
+        self,
+        cache: SharedFileCache,
+        pool: CobblerClientPool,
+        tokens: TokenManager,
+        settings: Settings,
+    ):
+        """
+        Start polling in a background thread.
+
+        :param cache: The shared file cache.
+        :param pool: Pool providing the clients used for polling.
+        :param tokens: Provides the login token.
+        :param settings: The cobbler-tftp application settings.
+        """
+        self._cache = cache
+        self._pool = pool
+        self._tokens = tokens
+        self._interval = settings.cache_invalidation_interval
+        self._volatile: Optional["re.Pattern[str]"] = None
+        if settings.cache_volatile_paths:
+            self._volatile = re.compile(
+                "|".join(
+                    fnmatch.translate(pattern)
+                    for pattern in settings.cache_volatile_paths
+                )
+            )
+        self._last_modified: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.poll()
+            except (OSError, xmlrpc.client.Error) as err:
+                logging.warning("Polling Cobbler for changes failed: %r", err)
+
+    def poll(self) -> None:
+        """Check Cobbler for changes once and revalidate the cache if needed."""
+        token = self._tokens.token()
+        with self._pool.client() as api:
+            last_modified: float = api.last_modified_time(token)  # type: ignore
+            if last_modified == self._last_modified:
+                return
+            logging.debug("Cobbler changed at %f, revalidating cache", last_modified)
+            self._revalidate(api, token)
+        self._last_modified = last_modified
+
+    def _revalidate(self, api: xmlrpc.client.ServerProxy, token: str) -> None:
+        for path, (size, fetched) in self._cache.entries().items():
+            if self._volatile is not None and self._volatile.match(path):
+                self._cache.invalidate(path)
+                continue
+            modified: Optional[float] = None
+            try:
+                if isinstance(api, HTTPFileServerProxy):
+                    current_size, modified = api.stat_tftp_file(path, token)
+                else:
+                    _, current_size = api.get_tftp_file(path, 0, 0, token)  # type: ignore
+            except xmlrpc.client.Fault as err:
+                if not is_missing_file(err):
+                    # Like an invalid token, so the cache is revalidated
+                    # again with the next poll.
+                    raise
+                self._cache.invalidate(path)
+                continue
+            if current_size != size or (
+                modified is not None and modified + MTIME_RESOLUTION > fetched
+            ):
+                self._cache.invalidate(path)
+
+    def close(self) -> None:
+        """Stop polling."""
+        self._stop.set()
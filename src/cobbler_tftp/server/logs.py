@@ -0,0 +1,325 @@
+"""
+This module contains a logging mode that keeps the log I/O off the transfer
+path.
+
+Records are appended to a queue in memory and written in batches by a
+background thread of each process, optionally as JSON lines. Processes that
+serve a single session write their records when they exit instead. Categories
+of records that are logged for every request, like requests for missing files,
+can be rate limited across all processes.
+"""
+
+import copy
+import datetime
+import json
+import logging
+import multiprocessing.util
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from cobbler_tftp.settings import Settings
+
+# Categories of records, passed as ``extra={"category": ...}``.
+CATEGORY_MISS = "miss"
+CATEGORY_SESSION = "session"
+# Seconds a closing handler waits for its writer thread.
+CLOSE_TIMEOUT = 5.0
+
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+# Process that serves a single session, see session_process().
+_SESSION_PROCESS: Optional[int] = None
+
+
+def session_process() -> None:
+    """
+    Mark the current process as serving a single session. Its records are
+    written when it exits or a batch is full, without starting a writer
+    thread.
+    """
+    global _SESSION_PROCESS  # pylint: disable=global-statement
+    _SESSION_PROCESS = os.getpid()
+
+
+def record_category(record: logging.LogRecord) -> Optional[str]:
+    """
+    Get the category of a record.
+
+    :param record: The record.
+    :return: The category, or None if the record has none.
+    """
+    category: Optional[str] = getattr(record, "category", None)
+    if category is None and record.module == "base_handler":
+        # fbtftp logs missing files and the options of each session without
+        # a category.
+        if record.levelno == logging.WARNING and record.funcName == "__init__":
+            return CATEGORY_MISS
+        if record.levelno <= logging.INFO:
+            return CATEGORY_SESSION
+    return category
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as JSON objects on a single line. Fields passed with
+    ``extra`` are included.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=repr)
+
+
+class _RateLimit:
+    """
+    Token bucket allowing a number of records per second.
+
+    The bucket lives in shared memory, so it is shared with all processes
+    forked after it was created. It is updated without a lock, so processes
+    logging at the same time may let a few more records through.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        # The tokens, the time they were last updated and the dropped records.
+        self._state = multiprocessing.RawArray("d", [rate, time.monotonic(), 0.0])
+
+    def allow(self) -> bool:
+        state = self._state
+        now = time.monotonic()
+        tokens = min(self.rate, state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        if tokens >= 1:
+            state[0] = tokens - 1
+            return True
+        state[0] = tokens
+        state[2] += 1
+        return False
+
+    def take_dropped(self) -> int:
+        """
+        Get the number of records dropped since the last call.
+
+        :return: The number of dropped records.
+        """
+        dropped = int(self._state[2])
+        self._state[2] -= dropped
+        return dropped
+
+
+class BatchingHandler(logging.Handler):
+    """
+    Hands records to a background thread, which writes them in batches to
+    the target handlers.
+
+    Messages are formatted right away, as their arguments may change later.
+    The batches are written when enough records are queued or the flush
+    interval passed. Records are dropped if the queue is full or their
+    category exceeds its rate limit, and the number of dropped records is
+    logged with the next batch.
+
+    Each process writes its own records. Processes started by
+    ``multiprocessing`` start their own writer thread with their first record,
+    unless they serve a single session, see :func:`session_process`. They
+    write their remaining records when they exit. The rate limits apply to
+    the records of all processes together.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[logging.Handler],
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_queued: int = 65536,
+        rate_limits: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Initialize the handler and start the writer thread.
+
+        :param targets: Handlers the records are written to.
+        :param batch_size: Number of queued records that are written right away.
+        :param flush_interval: Maximum time in seconds records are queued.
+        :param max_queued: Maximum number of queued records.
+        :param rate_limits: Maximum number of records per second by category.
+        """
+        super().__init__(min((target.level for target in targets), default=0))
+        self._targets = list(targets)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queued = max_queued
+        self._limits = {
+            category: _RateLimit(rate)
+            for category, rate in (rate_limits or {}).items()
+            if rate > 0
+        }
+        self._overflowed = 0
+        self._reset()
+        self._start_thread()
+        multiprocessing.util.register_after_fork(self, BatchingHandler._after_fork)
+
+    def _reset(self) -> None:
+        self._records: Deque[logging.LogRecord] = deque()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def _start_thread(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        # The parent writes the records it queued before the fork.
+        self._reset()
+        self._overflowed = 0
+        # Processes started by multiprocessing skip the atexit handlers.
+        multiprocessing.util.Finalize(None, self.flush, exitpriority=100)
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        category = record_category(record)
+        limit = self._limits.get(category or "")
+        if limit is not None and not limit.allow():
+            return
+        if len(self._records) >= self._max_queued:
+            self._overflowed += 1
+            return
+        try:
+            # Other handlers of the record must still see the original.
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        self._records.append(record)
+        # Called with the handler lock held, so only one thread is started.
+        if self._thread is None and _SESSION_PROCESS != os.getpid():
+            self._start_thread()
+        if len(self._records) >= self._batch_size:
+            if self._thread is None:
+                self.flush()
+            else:
+                self._wakeup.set()
+
+    def _dropped_records(self) -> List[logging.LogRecord]:
+        with self.lock:  # type: ignore[union-attr]
+            dropped = {
+                category: limit.take_dropped()
+                for category, limit in self._limits.items()
+            }
+            dropped = {category: count for category, count in dropped.items() if count}
+            if self._overflowed:
+                dropped["queue overflow"] = self._overflowed
+                self._overflowed = 0
+        return [
+            logging.makeLogRecord(
+                {
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": logging.getLevelName(logging.WARNING),
+                    "msg": f"Dropped {count} log records ({reason})",
+                }
+            )
+            for reason, count in dropped.items()
+        ]
+
+    def flush(self) -> None:
+        """Write all queued records."""
+        with self._write_lock:
+            records: List[logging.LogRecord] = []
+            while self._records:
+                records.append(self._records.popleft())
+            records.extend(self._dropped_records())
+            if not records:
+                return
+            for target in self._targets:
+                _write_batch(target, records)
+
+    def close(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(CLOSE_TIMEOUT)
+        self.flush()
+        for target in self._targets:
+            target.close()
+        super().close()
+
+
+def _write_batch(target: logging.Handler, records: List[logging.LogRecord]) -> None:
+    stream = getattr(target, "stream", None)
+    if not isinstance(target, logging.StreamHandler) or stream is None:
+        for record in records:
+            if record.levelno >= target.level:
+                target.handle(record)
+        return
+    # Stream handlers flush after every record, so the batch is written at once.
+    lines: List[str] = []
+    for record in records:
+        if record.levelno < target.level or not target.filter(record):
+            continue
+        try:
+            lines.append(target.format(record) + target.terminator)
+        except Exception:  # pylint: disable=broad-except
+            target.handleError(record)
+    if not lines:
+        return
+    with target.lock:  # type: ignore[union-attr]
+        try:
+            stream.write("".join(lines))
+            target.flush()
+        except Exception:  # pylint: disable=broad-except
+            target.handleError(records[-1])
+
+
+def configure_logging(settings: Settings) -> None:
+    """
+    Switch the handlers of the root logger to JSON lines and hand them the
+    records from a background thread, if the settings ask for it.
+
+    :param settings: The cobbler-tftp application settings.
+    """
+    root = logging.getLogger()
+    targets = list(root.handlers)
+    if settings.logging_json:
+        for target in targets:
+            target.setFormatter(JSONFormatter())
+    if not settings.logging_queue or not targets:
+        return
+    for target in targets:
+        root.removeHandler(target)
+    root.addHandler(
+        BatchingHandler(
+            targets,
+            settings.logging_batch_size,
+            settings.logging_flush_interval,
+            settings.logging_max_queued,
+            settings.logging_rate_limits,
+        )
+    )
@@ -0,0 +1,669 @@
+"""
+This module contains the metrics of the server and the HTTP endpoint that
+exposes them in the Prometheus text exposition format.
+
+The values live in shared memory that is allocated when the metrics are
+enabled, before any listener, worker or handler process is forked. Every
+process adds to its own shard of the values and the process serving the
+endpoint reports their totals, without any per-session IPC or locking.
+Processes that find no free shard share an overflow shard under a lock.
+"""
+
+import logging
+import multiprocessing.util
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Number of values each shard can hold.
+CAPACITY = 256
+# Number of processes that can update the metrics at the same time without
+# sharing the overflow shard.
+SHARDS = 1024
+# Seconds a process waits for the locks of the shards.
+LOCK_TIMEOUT = 0.1
+# Upper bounds of the histogram buckets for durations in seconds.
+DURATION_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+# Labels of the TFTP error codes, see RFC 1350 and RFC 2347.
+ERROR_NAMES = {
+    0: "undefined",
+    1: "file_not_found",
+    2: "access_violation",
+    3: "disk_full",
+    4: "illegal_operation",
+    5: "unknown_transfer_id",
+    6: "file_exists",
+    7: "no_such_user",
+    8: "invalid_options",
+}
+# Phases of a TFTP session, see session_phases().
+PHASES = ("token", "resolve", "first_fetch", "fetch", "first_data", "last_ack")
+
+
+class MetricsRegistry:
+    """
+    Set of metrics whose values are shared by all forked processes.
+
+    Nothing is recorded until the registry is enabled, which must happen
+    before the processes are forked. Each process claims a shard of the
+    values on its first update and is the only one writing to it until it
+    exits. Shards of processes that were killed are claimed again by other
+    processes, which keep adding to their values.
+
+    Processes that find all shards claimed by running processes add to an
+    overflow shard under a lock. Updates are only dropped if that lock is
+    held for too long, for example by a process that was killed while holding
+    it, and the number of dropped updates is reported as a metric.
+    """
+
+    def __init__(self, capacity: int = CAPACITY, shards: int = SHARDS):
+        """
+        Initialize an empty registry.
+
+        :param capacity: Number of values the registry can hold.
+        :param shards: Number of processes that can update the values at the
+                       same time.
+        """
+        self._capacity = capacity
+        self._shards = shards
+        self._values: Optional[Any] = None
+        # Process IDs of the owners of the shards, 0 for free shards.
+        self._owners: Optional[Any] = None
+        self._claim_lock: Optional[Any] = None
+        self._overflow_lock: Optional[Any] = None
+        self._dropped: Optional[Any] = None
+        self._shard: Optional[int] = None
+        self._lock = threading.Lock()
+        self._used = 0
+        self._metrics: List["_Metric"] = []
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether updates are recorded."""
+        return self._values is not None
+
+    def enable(self) -> None:
+        """Allocate the shared memory and start recording updates."""
+        if self._values is None:
+            self._owners = multiprocessing.RawArray("q", self._shards)
+            self._claim_lock = multiprocessing.Lock()
+            self._overflow_lock = multiprocessing.Lock()
+            self._dropped = multiprocessing.RawValue("q", 0)
+            # The last shard is the overflow shard.
+            self._values = multiprocessing.RawArray(
+                "d", self._capacity * (self._shards + 1)
+            )
+
+    def _after_fork(self) -> None:
+        # The shard of the parent stays with the parent.
+        self._lock = threading.Lock()
+        self._shard = None
+
+    def _allocate(self, metric: "_Metric", count: int) -> int:
+        if self._used + count > self._capacity:
+            raise ValueError(f"No space left for metric {metric.name}")
+        offset = self._used
+        self._used += count
+        self._metrics.append(metric)
+        return offset
+
+    def _claim(self) -> int:
+        owners: Any = self._owners
+        pid = os.getpid()
+        if not self._claim_lock.acquire(timeout=LOCK_TIMEOUT):  # type: ignore
+            return self._shards
+        try:
+            shard = next(
+                (shard for shard in range(self._shards) if owners[shard] == 0), None
+            )
+            if shard is None:
+                shard = next(
+                    (
+                        shard
+                        for shard in range(self._shards)
+                        if not _is_running(owners[shard])
+                    ),
+                    self._shards,
+                )
+            if shard < self._shards:
+                owners[shard] = pid
+        finally:
+            self._claim_lock.release()  # type: ignore
+        if shard < self._shards:
+            multiprocessing.util.Finalize(
+                self, self._release, args=(shard, pid), exitpriority=0
+            )
+        return shard
+
+    def _release(self, shard: int, pid: int) -> None:
+        owners: Any = self._owners
+        if owners[shard] == pid:
+            owners[shard] = 0
+
+    def add(self, updates: Sequence[Tuple[int, float]]) -> None:
+        """
+        Add to several values at once.
+
+        :param updates: Tuples of the index of a value and the amount to add.
+        """
+        values = self._values
+        if values is None:
+            return
+        with self._lock:
+            if self._shard is None:
+                self._shard = self._claim()
+            offset = self._shard * self._capacity
+            if self._shard < self._shards:
+                for index, amount in updates:
+                    values[offset + index] += amount
+                return
+        overflow_lock: Any = self._overflow_lock
+        if not overflow_lock.acquire(timeout=LOCK_TIMEOUT):
+            # Not exact, as it is updated without the lock.
+            self._dropped.value += 1  # type: ignore[union-attr]
+            logging.debug("Dropping metrics update, the overflow shard is locked")
+            return
+        try:
+            for index, amount in updates:
+                values[offset + index] += amount
+        finally:
+            overflow_lock.release()
+
+    @property
+    def dropped(self) -> int:
+        """Number of updates that were dropped."""
+        return 0 if self._dropped is None else self._dropped.value
+
+    def set(self, index: int, value: float) -> None:
+        """
+        Set a value.
+
+        :param index: Index of the value.
+        :param value: The new value.
+        """
+        self.add([(index, value - self.get(index))])
+
+    def get(self, index: int) -> float:
+        """
+        Get a value.
+
+        :param index: Index of the value.
+        :return: The current value.
+        """
+        if self._values is None:
+            return 0.0
+        return sum(self._values[index :: self._capacity])
+
+    def totals(self) -> List[float]:
+        """
+        Get all values at once.
+
+        :return: The current values by index.
+        """
+        totals = [0.0] * self._capacity
+        if self._values is None:
+            return totals
+        for offset in range(0, len(self._values), self._capacity):
+            shard = self._values[offset : offset + self._capacity]
+            totals = [total + value for total, value in zip(totals, shard)]
+        return totals
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        label: str = "",
+        values: Sequence[str] = (),
+    ) -> "Counter":
+        """
+        Create a counter.
+
+        :param name: Name of the metric.
+        :param documentation: Help text of the metric.
+        :param label: Name of the label, if the metric has one.
+        :param values: All values of the label.
+        :return: The counter.
+        """
+        return Counter(self, name, documentation, label, values)
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        label: str = "",
+        values: Sequence[str] = (),
+    ) -> "Gauge":
+        """
+        Create a gauge.
+
+        :param name: Name of the metric.
+        :param documentation: Help text of the metric.
+        :param label: Name of the label, if the metric has one.
+        :param values: All values of the label.
+        :return: The gauge.
+        """
+        return Gauge(self, name, documentation, label, values)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DURATION_BUCKETS,
+        label: str = "",
+        values: Sequence[str] = (),
+    ) -> "Histogram":
+        """
+        Create a histogram.
+
+        :param name: Name of the metric.
+        :param documentation: Help text of the metric.
+        :param buckets: Upper bounds of the buckets in ascending order.
+        :param label: Name of the label, if the metric has one.
+        :param values: All values of the label.
+        :return: The histogram.
+        """
+        return Histogram(self, name, documentation, buckets, label, values)
+
+    def render(self) -> str:
+        """
+        Format all metrics in the text exposition format.
+
+        :return: The metrics, one sample per line.
+        """
+        lines: List[str] = []
+        totals = self.totals()
+        for metric in self._metrics:
+            lines.extend(metric.render(totals))
+        lines.extend(
+            [
+                "# HELP cobbler_tftp_metrics_dropped_updates_total Metric updates "
+                "that were dropped.",
+                "# TYPE cobbler_tftp_metrics_dropped_updates_total counter",
+                f"cobbler_tftp_metrics_dropped_updates_total {self.dropped}",
+            ]
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """Base class of the metrics, holding one value per label value."""
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        name: str,
+        documentation: str,
+        label: str,
+        values: Sequence[str],
+        width: int = 1,
+    ):
+        self.name = name
+        self._registry = registry
+        self._documentation = documentation
+        self._label = label
+        self._values = list(values) if label else [""]
+        self._width = width
+        self._offset = registry._allocate(  # pylint: disable=protected-access
+            self, width * len(self._values)
+        )
+
+    def _index(self, value: str) -> int:
+        return self._offset + self._width * self._values.index(value)
+
+    def _labels(self, value: str) -> str:
+        return f'{{{self._label}="{value}"}}' if self._label else ""
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self._documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self, totals: Sequence[float]) -> List[str]:
+        """
+        Format the metric in the text exposition format.
+
+        :param totals: The values of the registry, see
+                       :meth:`MetricsRegistry.totals`.
+        :return: The lines of the metric.
+        """
+        return self._header() + [
+            f"{self.name}{self._labels(value)} {_format(totals[self._index(value)])}"
+            for value in self._values
+        ]
+
+
+class Counter(_Metric):
+    """Value that only ever increases."""
+
+    kind = "counter"
+
+    def update(self, amount: float = 1, value: str = "") -> Tuple[int, float]:
+        """
+        Prepare an increment for :meth:`MetricsRegistry.add`.
+
+        :param amount: Amount to add.
+        :param value: Value of the label.
+        :return: The update.
+        """
+        return self._index(value), amount
+
+    def inc(self, amount: float = 1, value: str = "") -> None:
+        """
+        Increase the counter.
+
+        :param amount: Amount to add.
+        :param value: Value of the label.
+        """
+        self._registry.add([self.update(amount, value)])
+
+
+class Gauge(Counter):
+    """Value that may go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, value: str = "") -> None:
+        """
+        Decrease the gauge.
+
+        :param amount: Amount to subtract.
+        :param value: Value of the label.
+        """
+        self._registry.add([self.update(-amount, value)])
+
+    def set(self, amount: float, value: str = "") -> None:
+        """
+        Set the gauge.
+
+        :param amount: The new value.
+        :param value: Value of the label.
+        """
+        self._registry.set(self._index(value), amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, counted in buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        label: str = "",
+        values: Sequence[str] = (),
+    ):
+        self._buckets = list(buckets)
+        # One value per bucket, one for larger values, the sum and the count.
+        super().__init__(registry, name, documentation, label, values, len(buckets) + 3)
+
+    def updates(self, value: float, label_value: str = "") -> List[Tuple[int, float]]:
+        """
+        Prepare an observation for :meth:`MetricsRegistry.add`.
+
+        :param value: The observed value.
+        :param label_value: Value of the label.
+        :return: The updates.
+        """
+        offset = self._index(label_value)
+        bucket = bisect_left(self._buckets, value)
+        end = offset + len(self._buckets) + 1
+        return [(offset + bucket, 1), (end, value), (end + 1, 1)]
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        """
+        Record an observation.
+
+        :param value: The observed value.
+        :param label_value: Value of the label.
+        """
+        self._registry.add(self.updates(value, label_value))
+
+    def render(self, totals: Sequence[float]) -> List[str]:
+        lines = self._header()
+        for label_value in self._values:
+            offset = self._index(label_value)
+            labels = f'{self._label}="{label_value}",' if self._label else ""
+            cumulative = 0.0
+            for index, bound in enumerate([*self._buckets, float("inf")]):
+                cumulative += totals[offset + index]
+                le = "+Inf" if bound == float("inf") else _format(bound)
+                lines.append(
+                    f'{self.name}_bucket{{{labels}le="{le}"}} {_format(cumulative)}'
+                )
+            end = offset + len(self._buckets) + 1
+            labels = self._labels(label_value)
+            lines.append(f"{self.name}_sum{labels} {_format(totals[end])}")
+            lines.append(f"{self.name}_count{labels} {_format(totals[end + 1])}")
+        return lines
+
+
+REGISTRY = MetricsRegistry()
+SESSIONS = REGISTRY.counter(
+    "cobbler_tftp_sessions_total",
+    "Finished TFTP sessions by result.",
+    "result",
+    ["ok", *ERROR_NAMES.values(), "other"],
+)
+SESSIONS_ACTIVE = REGISTRY.gauge(
+    "cobbler_tftp_sessions_active", "TFTP sessions currently being served."
+)
+SESSION_DURATION = REGISTRY.histogram(
+    "cobbler_tftp_session_duration_seconds", "Duration of the TFTP sessions."
+)
+FIRST_BYTE = REGISTRY.histogram(
+    "cobbler_tftp_time_to_first_byte_seconds",
+    "Time from the request until the first data block was sent.",
+)
+BYTES_SENT = REGISTRY.counter(
+    "cobbler_tftp_sent_bytes_total", "Bytes of file data sent to TFTP clients."
+)
+RETRANSMITS = REGISTRY.counter(
+    "cobbler_tftp_retransmits_total", "Packets sent again after a timeout."
+)
+REQUESTS = REGISTRY.counter(
+    "cobbler_tftp_requests_total", "TFTP read requests handed to a handler."
+)
+COBBLER_FETCHES = REGISTRY.counter(
+    "cobbler_tftp_cobbler_fetches_total",
+    "Chunks fetched from Cobbler by result.",
+    "result",
+    ["ok", "error"],
+)
+COBBLER_FETCH_DURATION = REGISTRY.histogram(
+    "cobbler_tftp_cobbler_fetch_duration_seconds",
+    "Duration of the successful chunk fetches from Cobbler.",
+)
+COBBLER_FETCH_BYTES = REGISTRY.counter(
+    "cobbler_tftp_cobbler_fetched_bytes_total", "Bytes fetched from Cobbler."
+)
+SESSION_PHASES = REGISTRY.histogram(
+    "cobbler_tftp_session_phase_seconds",
+    "Duration of the phases of the TFTP sessions.",
+    label="phase",
+    values=PHASES,
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "cobbler_tftp_cache_lookups_total",
+    "Lookups in the shared file cache by result.",
+    "result",
+    ["hit", "miss"],
+)
+
+
+def session_phases(stats: Any) -> Dict[str, float]:
+    """
+    Get the durations of the phases of a TFTP session. The phases are:
+
+    * ``token``: From the request until the login token was acquired.
+    * ``resolve``: Finding the file, including the first fetch from Cobbler.
+    * ``first_fetch``: The first fetch from Cobbler.
+    * ``fetch``: All fetches from Cobbler, which may overlap the transfer.
+    * ``first_data``: From finding the file until the first data block was
+      sent, including the round trip of the option acknowledgement.
+    * ``last_ack``: From sending the last data block until it was
+      acknowledged.
+
+    The times are read from the optional ``request_time``, ``token_time``,
+    ``resolved_time``, ``first_data_time``, ``last_data_time`` and
+    ``last_ack_time`` attributes and the ``fetch_durations`` list of the
+    stats. Phases a session did not reach are left out.
+
+    :param stats: The fbtftp ``SessionStats`` of the session.
+    :return: The durations in seconds by phase.
+    """
+    times: Dict[str, Optional[float]] = {
+        name: getattr(stats, f"{name}_time", None)
+        for name in (
+            "request",
+            "token",
+            "resolved",
+            "first_data",
+            "last_data",
+            "last_ack",
+        )
+    }
+    spans = {
+        "token": ("request", "token"),
+        # Without a token time, the token is acquired while resolving.
+        "resolve": ("token" if times["token"] is not None else "request", "resolved"),
+        "first_data": ("resolved", "first_data"),
+        "last_ack": ("last_data", "last_ack"),
+    }
+    phases: Dict[str, float] = {}
+    for phase, (start, end) in spans.items():
+        start_time, end_time = times[start], times[end]
+        if start_time is not None and end_time is not None:
+            phases[phase] = max(end_time - start_time, 0.0)
+    fetch_durations: List[float] = getattr(stats, "fetch_durations", [])
+    if fetch_durations:
+        phases["first_fetch"] = fetch_durations[0]
+        phases["fetch"] = sum(fetch_durations)
+    return phases
+
+
+def record_session(stats: Any, phases: Optional[Dict[str, float]] = None) -> None:
+    """
+    Record a finished TFTP session.
+
+    :param stats: The fbtftp ``SessionStats`` of the session. The time the
+                  first data block was sent is read from its optional
+                  ``first_data_time`` attribute.
+    :param phases: Durations of the phases of the session, which are taken
+                   from the stats if not given.
+    """
+    if not REGISTRY.enabled:
+        return
+    error: Dict[str, Any] = stats.error
+    if error:
+        result = ERROR_NAMES.get(error.get("error_code", 0), "other")
+    else:
+        result = "ok"
+    updates = [
+        SESSIONS.update(1, result),
+        SESSIONS_ACTIVE.update(-1),
+        BYTES_SENT.update(stats.bytes_sent),
+        RETRANSMITS.update(stats.retransmits),
+        *SESSION_DURATION.updates(stats.duration()),
+    ]
+    first_data_time: Optional[float] = getattr(stats, "first_data_time", None)
+    if first_data_time is not None:
+        updates.extend(FIRST_BYTE.updates(first_data_time - stats.start_time))
+    if phases is None:
+        phases = session_phases(stats)
+    for phase, duration in phases.items():
+        updates.extend(SESSION_PHASES.updates(duration, phase))
+    REGISTRY.add(updates)
+
+
+def record_fetch(duration: float, size: Optional[int]) -> None:
+    """
+    Record a chunk fetch from Cobbler.
+
+    :param duration: Time in seconds the fetch took.
+    :param size: Size of the fetched chunk, or None if the fetch failed.
+    """
+    if not REGISTRY.enabled:
+        return
+    if size is None:
+        COBBLER_FETCHES.inc(1, "error")
+        return
+    REGISTRY.add(
+        [
+            COBBLER_FETCHES.update(1, "ok"),
+            COBBLER_FETCH_BYTES.update(size),
+            *COBBLER_FETCH_DURATION.updates(duration),
+        ]
+    )
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the metrics of the registry at ``/metrics``."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):  # pylint: disable=W0622
+        logging.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(address: str, port: int) -> ThreadingHTTPServer:
+    """
+    Serve the metrics over HTTP in a background thread.
+
+    :param address: Address to listen on.
+    :param port: Port to listen on.
+    :return: The HTTP server, which is shut down with ``shutdown()``.
+    """
+    server = ThreadingHTTPServer((address, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,122 @@
+"""
+This module samples TFTP sessions with cProfile.
+
+A fraction of the sessions is profiled from the creation of the handler to the
+final ACK. Each profile is added to an aggregate profile in a directory, which
+can be inspected with ``python -m pstats`` or tools like snakeviz.
+
+Whether profiling is switched on lives in shared memory that is allocated when
+this module is imported, so sending ``PROFILE_SIGNAL`` to the main process
+switches it for all listener, worker and handler processes. Every time it is
+switched on, a new aggregate profile is started.
+"""
+
+import cProfile
+import fcntl
+import logging
+import multiprocessing
+import os
+import pstats
+import random
+import signal
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from cobbler_tftp.settings import Settings
+
+# Signal that switches profiling on and off.
+PROFILE_SIGNAL = signal.SIGUSR1
+
+# Time profiling was last switched on, or 0 if it is off.
+_ENABLED_SINCE = multiprocessing.RawValue("d", 0.0)
+
+
+def enable() -> None:
+    """Switch profiling on and start a new aggregate profile."""
+    _ENABLED_SINCE.value = time.time()
+
+
+def disable() -> None:
+    """Switch profiling off."""
+    _ENABLED_SINCE.value = 0.0
+
+
+def is_enabled() -> bool:
+    """
+    Check whether profiling is switched on.
+
+    :return: True if sessions are sampled.
+    """
+    return _ENABLED_SINCE.value != 0.0
+
+
+def toggle(signum: int, frame: Any) -> None:
+    """Switch profiling on or off, for use as a signal handler."""
+    if is_enabled():
+        disable()
+        logging.info("Session profiling disabled")
+    else:
+        enable()
+        logging.info("Session profiling enabled")
+
+
+class SessionProfile(cProfile.Profile):
+    """Profile of a single session."""
+
+    def __init__(self, path: Path):
+        """
+        Initialize a profile.
+
+        :param path: Aggregate profile the profile is added to.
+        """
+        super().__init__()
+        self.path = path
+
+
+class SessionProfiler:
+    """
+    Decides which sessions are profiled and adds their profiles to the
+    aggregate profiles.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Initialize the profiler.
+
+        :param settings: The cobbler-tftp application settings.
+        """
+        self._sample_rate = settings.profiling_sample_rate
+        self._directory = settings.profiling_dir
+
+    def sample(self) -> Optional[SessionProfile]:
+        """
+        Decide whether to profile a new session.
+
+        :return: A profile for the session, or None if it is not profiled.
+        """
+        enabled_since = _ENABLED_SINCE.value
+        if enabled_since == 0.0 or random.random() >= self._sample_rate:
+            return None
+        name = time.strftime("sessions-%Y%m%d-%H%M%S.prof", time.gmtime(enabled_since))
+        return SessionProfile(self._directory / name)
+
+    def dump(self, profile: SessionProfile) -> None:
+        """
+        Add the profile of a finished session to its aggregate profile.
+
+        :param profile: The profile, which must not be enabled.
+        """
+        try:
+            profile.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(profile.path.with_suffix(".lock"), "wb") as lock:
+                # Sessions in other processes add to the same file.
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                stats = pstats.Stats(profile)
+                if profile.path.exists():
+                    stats.add(str(profile.path))
+                temporary = profile.path.with_suffix(f".{os.getpid()}.tmp")
+                stats.dump_stats(temporary)
+                temporary.replace(profile.path)
+        except (OSError, EOFError, TypeError, ValueError) as err:
+            logging.warning("Could not write the profile %s: %r", profile.path, err)
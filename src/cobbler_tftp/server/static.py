@@ -0,0 +1,292 @@
+"""
+This module contains an in-memory index of the static fallback directory.
+"""
+
+import ctypes
+import logging
+import os
+import posixpath
+import select
+import stat
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Set, Tuple
+
+# inotify event masks, see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+# Seconds between rescans of directories that cannot be watched
+RESCAN_INTERVAL = 60.0
+
+
+class StaticFile(NamedTuple):
+    """A regular file in the static fallback directory."""
+
+    size: int
+    mtime: float
+    inode: int
+
+
+class _Inotify:
+    """Minimal wrapper of the Linux inotify API."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd: int = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        """
+        Watch a directory.
+
+        :param path: Path of the directory.
+        :return: The watch descriptor.
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        """
+        Stop watching a directory.
+
+        :param wd: The watch descriptor.
+        """
+        self._rm_watch(self.fd, wd)
+
+    def read(self) -> Iterator[Tuple[int, int, str]]:
+        """
+        Read the pending events.
+
+        :return: Tuples of the watch descriptor, the event mask and the name.
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, name
+
+    def close(self) -> None:
+        """Close the inotify instance and all of its watches."""
+        os.close(self.fd)
+
+
+class StaticIndex:
+    """
+    Index of the regular files in a directory, so that requests for missing
+    files and the size of existing files are answered without touching the
+    filesystem.
+
+    The index is kept current with inotify. Where inotify is not available,
+    the directory is rescanned periodically instead. Threads do not survive a
+    fork, so every process that uses the index starts its own thread and
+    stats the files directly until its first scan is complete.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        Initialize the index. Scanning starts with the first lookup.
+
+        :param directory: The static fallback directory.
+        """
+        self._directory = directory
+        self._files: Dict[str, StaticFile] = {}
+        self._ready = False
+        self._watches: Dict[int, str] = {}
+        self._inotify: Optional[_Inotify] = None
+        self._stop = threading.Event()
+        self._thread_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        # Changes made before the watches of this process exist would be lost.
+        self._ready = False
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, args=(self._stop,), daemon=True).start()
+
+    def get(self, path: str) -> Optional[StaticFile]:
+        """
+        Look up a file.
+
+        :param path: Normalized path relative to the directory.
+        :return: The file, or None if there is no such regular file.
+        """
+        self._start()
+        if not self._ready:
+            return self._stat(path)
+        return self._files.get(path)
+
+    def close(self) -> None:
+        """Stop keeping the index current."""
+        self._stop.set()
+
+    def _stat(self, path: str) -> Optional[StaticFile]:
+        try:
+            result = os.stat(os.path.join(self._directory, path))
+        except OSError:
+            return None
+        if not stat.S_ISREG(result.st_mode):
+            return None
+        return StaticFile(result.st_size, result.st_mtime, result.st_ino)
+
+    def _run(self, stop: threading.Event) -> None:
+        try:
+            self._inotify = _Inotify()
+        except (AttributeError, OSError) as err:
+            logging.info(
+                "Cannot watch %s, rescanning it every %d seconds: %r",
+                self._directory,
+                RESCAN_INTERVAL,
+                err,
+            )
+        try:
+            while not stop.is_set():
+                if self._rescan():
+                    self._watch(stop)
+                else:
+                    stop.wait(RESCAN_INTERVAL)
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+    def _rescan(self) -> bool:
+        """Rebuild the index, returning whether all directories are watched."""
+        files: Dict[str, StaticFile] = {}
+        self._watches = {}
+        try:
+            watched = self._scan("", files, set())
+        except OSError as err:
+            logging.warning("Cannot watch %s: %r", self._directory, err)
+            self._inotify.close()  # type: ignore[union-attr]
+            self._inotify = None
+            watched = False
+            self._scan("", files, set())
+        self._files = files
+        self._ready = True
+        return watched
+
+    def _scan(
+        self, directory: str, files: Dict[str, StaticFile], seen: Set[Tuple[int, int]]
+    ) -> bool:
+        full_path = os.path.join(self._directory, directory)
+        if self._inotify is not None:
+            self._watches[self._inotify.add_watch(full_path)] = directory
+        try:
+            entries = list(os.scandir(full_path))
+        except OSError:
+            return self._inotify is not None
+        for entry in entries:
+            path = posixpath.join(directory, entry.name)
+            try:
+                result = entry.stat()
+            except OSError:
+                continue
+            if stat.S_ISDIR(result.st_mode):
+                # Symbolic links may create loops.
+                if (result.st_dev, result.st_ino) not in seen:
+                    seen.add((result.st_dev, result.st_ino))
+                    self._scan(path, files, seen)
+            elif stat.S_ISREG(result.st_mode):
+                files[path] = StaticFile(result.st_size, result.st_mtime, result.st_ino)
+        return self._inotify is not None
+
+    def _watch(self, stop: threading.Event) -> None:
+        """Apply events until the index must be rebuilt or stop is set."""
+        inotify: _Inotify = self._inotify  # type: ignore[assignment]
+        while not stop.is_set():
+            readable, _, _ = select.select([inotify.fd], [], [], 1)
+            if not readable:
+                continue
+            for wd, mask, name in inotify.read():
+                try:
+                    if not self._apply(wd, mask, name):
+                        return
+                except OSError as err:
+                    logging.warning("Cannot watch %s: %r", self._directory, err)
+                    return
+
+    def _apply(self, wd: int, mask: int, name: str) -> bool:
+        if mask & IN_Q_OVERFLOW:
+            return False
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return True
+        directory = self._watches.get(wd)
+        if directory is None:
+            return True
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # Subdirectories are handled through the events of their parent.
+            return directory != ""
+        path = posixpath.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_tree(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._scan(path, self._files, set())
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._files.pop(path, None)
+        else:
+            entry = self._stat(path)
+            if entry is None:
+                self._files.pop(path, None)
+            else:
+                self._files[path] = entry
+        return True
+
+    def _remove_tree(self, path: str) -> None:
+        prefix = path + "/"
+        for wd, directory in list(self._watches.items()):
+            if directory == path or directory.startswith(prefix):
+                self._inotify.rm_watch(wd)  # type: ignore[union-attr]
+                del self._watches[wd]
+        for file_path in list(self._files):
+            if file_path.startswith(prefix):
+                self._files.pop(file_path, None)
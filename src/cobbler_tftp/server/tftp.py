@@ -2,12 +2,26 @@
 This module contains the main TFTP server class.
 """
 
+import contextlib
+import errno
+import fnmatch
+import http.client
 import logging
+import mmap
+import multiprocessing
 import os
+import queue
+import re
+import selectors
+import socket
+import struct
+import threading
 import time
 import xmlrpc.client
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
 
 from fbtftp import (  # type: ignore[reportMissingTypeStubs]
     BaseHandler,
@@ -16,51 +30,327 @@ from fbtftp import (  # type: ignore[reportMissingTypeStubs]
     SessionStats,
 )
 from fbtftp.base_server import ServerStats  # type: ignore[reportMissingTypeStubs]
+from fbtftp.constants import (  # type: ignore[reportMissingTypeStubs]
+    MAX_BLOCK_NUMBER,
+    OPCODE_DATA,
+)
 
+from cobbler_tftp.server import logs, metrics
+from cobbler_tftp.server.cache import CacheFile, Flight, NegativeCache, SharedFileCache
+from cobbler_tftp.server.client import (
+    CobblerClientPool,
+    HTTPFileServerProxy,
+    TokenManager,
+    is_missing_file,
+)
+from cobbler_tftp.server.invalidation import CacheInvalidator
+from cobbler_tftp.server.profiling import SessionProfiler
+from cobbler_tftp.server.static import StaticIndex
 from cobbler_tftp.settings import Settings
 
+# Sources of the routes
+ROUTE_STATIC = "static"
+ROUTE_COBBLER = "cobbler"
+ROUTE_CACHE = "cache"
+
+
+class ChunkSizer:
+    """
+    Chooses the size of the chunks fetched from Cobbler for a single file.
+
+    Starting from the configured prefetch size, the chunk size is doubled
+    after every full chunk that was fetched well within the target latency,
+    and halved after every chunk that took longer than the target latency.
+    """
+
+    def __init__(self, min_size: int, max_size: int, target_latency: float):
+        """
+        Initialize the sizer.
+
+        :param min_size: Initial and minimum chunk size in bytes.
+        :param max_size: Maximum chunk size in bytes. If it is not larger than
+                         ``min_size``, the chunk size never changes.
+        :param target_latency: Time in seconds a single fetch should take.
+        """
+        self.size = min_size
+        self._min_size = min_size
+        self._max_size = max(max_size, min_size)
+        self._target_latency = target_latency
+
+    def update(self, requested: int, received: int, duration: float) -> None:
+        """
+        Adjust the chunk size after a fetch.
+
+        :param requested: Number of bytes requested.
+        :param received: Number of bytes received.
+        :param duration: Time in seconds the fetch took.
+        """
+        if duration > self._target_latency:
+            self.size = max(self._min_size, requested // 2)
+        elif received == requested and duration < self._target_latency / 2:
+            self.size = min(self._max_size, max(self.size, requested * 2))
+
 
 class CobblerResponseData(ResponseData):
     """
     File-like object representing the response from the TFTP server.
     Data is fetched from the API in chunks. These chunks may be larger
     than the TFTP request chunks, so the returned chunks are cached.
+    The chunk size is chosen by a :class:`ChunkSizer`.
+    Full blocks are returned as memoryview slices of the chunk, so they are
+    not copied.
+    If a read-ahead depth is given, the following chunks are fetched in a
+    background thread while the current chunk is being sent. With a
+    concurrency above one, that many chunks are fetched in parallel, each
+    with a client borrowed from the pool, and still returned in order.
+    Files of at least the streaming size are instead read from a single
+    download by a background thread, which stays at most the read-ahead depth
+    ahead. This needs a client that can stream files, otherwise or if the
+    download fails, the chunks are fetched one by one.
+    If a shared file cache is given, the chunks are written to a file in the
+    cache directory, which is stored in the cache once it was read to the
+    end.
+    If a flight is given, the chunks are either published to or read from
+    other sessions requesting the same file.
+    The durations of all fetches from Cobbler are kept in ``fetch_durations``.
     """
 
     def __init__(
-        self, api: xmlrpc.client.Server, token: str, path: str, prefetch_size: int
+        self,
+        api: xmlrpc.client.Server,
+        token: str,
+        path: str,
+        sizer: ChunkSizer,
+        cache: Optional[SharedFileCache] = None,
+        prefetch_depth: int = 0,
+        flight: Optional[Flight] = None,
+        stream_size: int = 0,
+        pool: Optional[CobblerClientPool] = None,
+        concurrency: int = 1,
     ):
         self._api = api
         self._token = token
         self._path = path
         self._size: Optional[int] = None
         self._chunk: Optional[bytes] = None
+        self._view = memoryview(b"")
         self._chunk_offset = 0
         self._file_offset = 0
-        self._prefetch_size = prefetch_size
-
-    def load(self) -> None:
+        self._sizer = sizer
+        # Every fetch in flight except the current one is a read-ahead.
+        self._prefetch_depth = max(prefetch_depth, concurrency - 1)
+        self._pool = pool
+        self._concurrency = concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Deque[Tuple[int, int, "Future[Tuple[bytes, int]]"]] = deque()
+        self._cache = cache
+        # The file is written to the cache while it is read, the leader of a
+        # flight stores it for its followers.
+        self._cache_file: Optional[CacheFile] = None
+        self._caching = cache is not None and (flight is None or flight.leader)
+        self._flight = flight
+        self._stream_size = stream_size
+        self._stream: Optional[
+            "queue.Queue[Union[Tuple[bytes, int], Exception]]"
+        ] = None
+        self._stream_stop = threading.Event()
+        self._stream_response: Any = None
+        self.fetch_durations: List[float] = []
+
+    def _following(self) -> bool:
+        return self._flight is not None and not self._flight.leader
+
+    def _fetch(self, offset: int, length: int) -> Tuple[bytes, int]:
+        if self._following():
+            chunk = self._flight.read(offset)  # type: ignore
+            if chunk is not None:
+                return chunk
+            if self._flight.closed:  # type: ignore
+                # The leader failed or is too slow, continue on our own.
+                self._flight = None
         binary: xmlrpc.client.Binary
-        binary, self._size = self._api.get_tftp_file(  # type: ignore
-            self._path, self._file_offset, self._prefetch_size, self._token
+        start_time = time.monotonic()
+        try:
+            if self._pool is not None and self._concurrency > 1:
+                # Connections cannot be shared between the fetching threads.
+                with self._pool.client() as api:
+                    binary, size = api.get_tftp_file(  # type: ignore
+                        self._path, offset, length, self._token
+                    )
+            else:
+                binary, size = self._api.get_tftp_file(  # type: ignore
+                    self._path, offset, length, self._token
+                )
+        except:  # pylint: disable=bare-except
+            metrics.record_fetch(time.monotonic() - start_time, None)
+            raise
+        duration = time.monotonic() - start_time
+        metrics.record_fetch(duration, len(binary.data))
+        self.fetch_durations.append(duration)
+        self._sizer.update(length, len(binary.data), duration)
+        if self._flight is not None and self._flight.leader:
+            self._flight.publish(offset, binary.data, size)
+        return binary.data, size
+
+    def _read_ahead(self) -> Tuple[bytes, int]:
+        # The executor is created lazily, because the first chunk is loaded
+        # before the handler process is forked.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._concurrency)
+        if self._pending:
+            next_offset = self._pending[-1][0] + self._pending[-1][1]
+        else:
+            next_offset = self._file_offset
+        while (
+            len(self._pending) <= self._prefetch_depth
+            and next_offset < self._size  # type: ignore
+        ):
+            length = self._sizer.size
+            future = self._executor.submit(self._fetch, next_offset, length)
+            self._pending.append((next_offset, length, future))
+            next_offset += length
+        offset, length, future = self._pending.popleft()
+        if offset != self._file_offset:
+            self._cancel_pending()
+            return self._fetch(self._file_offset, self._sizer.size)
+        data, size = future.result()
+        if len(data) < length and offset + len(data) < size:
+            # The chunks ahead were requested at the offsets after a full
+            # chunk, they are fetched again after this one.
+            self._cancel_pending()
+        return data, size
+
+    def _cancel_pending(self) -> None:
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def _should_stream(self) -> bool:
+        return (
+            self._stream_size > 0
+            and self._size is not None
+            and self._size >= self._stream_size
+            and not self._following()
+            and isinstance(self._api, HTTPFileServerProxy)
         )
-        self._chunk = binary.data
+
+    def _open_stream(self) -> None:
+        try:
+            self._stream_response = self._api.open_tftp_file(  # type: ignore
+                self._path, self._file_offset, self._token
+            )
+        except (OSError, http.client.HTTPException, xmlrpc.client.Error) as err:
+            logging.debug("Streaming %s failed: %r", self._path, err)
+            self._stream_size = 0
+            return
+        self._stream = queue.Queue(max(self._prefetch_depth, 1))
+        threading.Thread(
+            target=self._run_stream,
+            args=(self._stream_response, self._file_offset),
+            daemon=True,
+        ).start()
+
+    def _run_stream(self, response: Any, offset: int) -> None:
+        size: int = self._size  # type: ignore[assignment]
+        try:
+            while offset < size and not self._stream_stop.is_set():
+                start_time = time.monotonic()
+                data: bytes = response.read(self._sizer.size)
+                if not data:
+                    raise http.client.IncompleteRead(b"", size - offset)
+                duration = time.monotonic() - start_time
+                metrics.record_fetch(duration, len(data))
+                self.fetch_durations.append(duration)
+                if self._flight is not None and self._flight.leader:
+                    self._flight.publish(offset, data, size)
+                self._put_streamed((data, size))
+                offset += len(data)
+        except Exception as err:  # pylint: disable=broad-except
+            self._put_streamed(err)
+
+    def _put_streamed(self, item: "Union[Tuple[bytes, int], Exception]") -> None:
+        while not self._stream_stop.is_set():
+            try:
+                self._stream.put(item, timeout=1)  # type: ignore[union-attr]
+                return
+            except queue.Full:
+                continue
+
+    def _close_stream(self) -> None:
+        self._stream_stop.set()
+        if self._stream_response is not None:
+            self._stream_response.close()
+        self._stream = None
+
+    def _read_streamed(self) -> Tuple[bytes, int]:
+        item = self._stream.get()  # type: ignore[union-attr]
+        if isinstance(item, Exception):
+            logging.debug("Streaming %s failed: %r", self._path, item)
+            self._close_stream()
+            self._stream_size = 0
+            return self._fetch(self._file_offset, self._sizer.size)
+        return item
+
+    def load(self) -> None:
+        """Fetch the chunk starting at the current file offset."""
+        if self._stream is None and self._should_stream():
+            self._open_stream()
+        # Followers do not read ahead, as the leader may use other chunk sizes.
+        if self._stream is not None:
+            self._chunk, self._size = self._read_streamed()
+        elif (
+            self._prefetch_depth > 0
+            and self._size is not None
+            and not self._following()
+        ):
+            self._chunk, self._size = self._read_ahead()
+        else:
+            self._chunk, self._size = self._fetch(self._file_offset, self._sizer.size)
+        if not self._chunk and self._file_offset < self._size:
+            raise EOFError(f"No data for {self._path} at offset {self._file_offset}")
+        self._view = memoryview(self._chunk)
+        if self._caching and self._cache_file is not None:
+            self._write_cache_file()
+
+    def _write_cache_file(self) -> None:
+        cache: SharedFileCache = self._cache  # type: ignore[assignment]
+        if self._cache_file is None and self._size <= cache.max_file_size:  # type: ignore
+            self._cache_file = cache.create_file(self._path)
+        if self._cache_file is None:
+            self._caching = False
+            return
+        try:
+            self._cache_file.write(self._chunk)  # type: ignore[arg-type]
+        except OSError as err:
+            logging.warning("Could not cache %s: %r", self._path, err)
+            self._cache_file.discard()
+            self._cache_file = None
+            self._caching = False
 
     def read(self, n: int) -> bytes:
         if self._chunk is None:
             raise RuntimeError("load() not called")
-        if n > self._prefetch_size:
-            raise ValueError("Chunk too large")
-        end = self._chunk_offset + n
-        if end <= self._prefetch_size:
-            data = self._chunk[self._chunk_offset : end]
-            self._chunk_offset = end
-            return data
-        self._file_offset += self._chunk_offset
-        self.load()
-        data = self._chunk[:n]
-        self._chunk_offset = len(data)
-        return data
+        if self._caching and self._cache_file is None:
+            # The first chunk is loaded before the handler process is forked.
+            # The cache file is only opened in the process serving the
+            # session, as a buffered file inherited by the server process
+            # would be flushed into the cached file when it is collected.
+            self._write_cache_file()
+        if self._chunk_offset >= len(self._chunk):
+            next_offset = self._file_offset + len(self._chunk)
+            if next_offset >= self.size():
+                return b""
+            self._file_offset = next_offset
+            self._chunk_offset = 0
+            self.load()
+        # Reads may be short at the end of a chunk, fbtftp keeps reading
+        # until the block is complete. It concatenates short reads, which
+        # memoryviews do not support, so only those are copied.
+        data = self._view[self._chunk_offset : self._chunk_offset + n]
+        self._chunk_offset += len(data)
+        if len(data) < n:
+            return data.tobytes()
+        return data  # type: ignore[return-value]
 
     def size(self) -> int:
         if self._size is None:
@@ -68,15 +358,25 @@ class CobblerResponseData(ResponseData):
         return self._size
 
     def close(self):
-        pass
+        if self._stream is not None:
+            self._close_stream()
+        if self._executor is not None:
+            self._cancel_pending()
+            self._executor.shutdown()
+        if self._flight is not None:
+            self._flight.close()
+        if self._cache_file is not None:
+            # Incomplete files are discarded.
+            self._cache.store(self._path, self._cache_file, self._size)  # type: ignore
+            self._cache_file = None
 
 
 class FileResponseData(ResponseData):
     """Object representing a static file response from the TFTP server."""
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, size: Optional[int] = None):
         self._io = open(path, "rb")
-        self._size = path.stat().st_size
+        self._size = path.stat().st_size if size is None else size
 
     def read(self, n: int) -> bytes:
         return self._io.read(n)
@@ -88,27 +388,266 @@ class FileResponseData(ResponseData):
         self._io.close()
 
 
+class MappedResponseData(ResponseData):
+    """
+    Object representing a file response that is served from a memory map.
+
+    Full blocks are slices of the map, so they are neither allocated nor
+    copied, and all sessions of a file share its pages in the page cache.
+    The file must not be truncated while it is mapped.
+    """
+
+    def __init__(self, path: Path, size: Optional[int] = None):
+        with open(path, "rb") as file:
+            # mmap duplicates the file descriptor.
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._size = len(self._map) if size is None else min(size, len(self._map))
+        self._offset = 0
+
+    def read(self, n: int) -> bytes:
+        data = self._view[self._offset : min(self._offset + n, self._size)]
+        self._offset += len(data)
+        if len(data) < n:
+            # fbtftp concatenates short reads, which memoryviews do not support.
+            return data.tobytes()
+        return data  # type: ignore[return-value]
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Blocks that were not acknowledged yet still reference the map,
+            # it is unmapped when they are released.
+            pass
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalize a requested path relative to the TFTP root, so it cannot leave
+    the root and clients requesting ``/file`` or ``./file`` get ``file``.
+
+    :param path: Request file path.
+    :return: The normalized path without leading or trailing slashes.
+    """
+    return os.path.normpath(os.path.join("/", path)).strip("/")
+
+
+def open_file(
+    path: Path, size: Optional[int] = None, use_mmap: bool = True
+) -> ResponseData:
+    """
+    Open a file for serving it.
+
+    :param path: Location of the file.
+    :param size: Size of the file, if it is already known.
+    :param use_mmap: Whether to serve the file from a memory map.
+    :return: The response data.
+    """
+    if use_mmap and size != 0:
+        try:
+            return MappedResponseData(path, size)
+        except ValueError:
+            # Empty files cannot be mapped.
+            pass
+    return FileResponseData(path, size)
+
+
 def handler_stats_cb(stats: SessionStats):
+    phases = metrics.session_phases(stats)
+    metrics.record_session(stats, phases)
     duration = stats.duration() * 1000
     logging.info(
         "Spent %fms processing request for %r from %r",
         duration,
         stats.file_path,  # type: ignore[reportUnkownArgumentType]
         stats.peer,  # type: ignore[reportUnkownArgumentType]
+        # The phases are passed as a field for structured formatters.
+        extra={"category": logs.CATEGORY_SESSION, "phases": phases},
     )
     logging.info(
         "%r, sent %d bytes with %d retransmits",
         stats.error,  # type: ignore[reportUnkownArgumentType]
         stats.bytes_sent,
         stats.retransmits,
+        extra={"category": logs.CATEGORY_SESSION},
     )
+    if phases and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "Phases of %r: %s",
+            stats.file_path,  # type: ignore[reportUnkownArgumentType]
+            ", ".join(
+                f"{phase} {duration * 1000:f}ms" for phase, duration in phases.items()
+            ),
+            extra={"category": logs.CATEGORY_SESSION},
+        )
 
 
 def server_stats_cb(stats: ServerStats):
     """
-    Called by the fbtftp to log server stats. Currently unused.
+    Called by the fbtftp to publish server stats. Adds the requests counted
+    since the last call to the metrics.
+    """
+    counters: Dict[str, int] = stats.get_and_reset_all_counters()  # type: ignore
+    metrics.REQUESTS.inc(counters.get("process_count", 0))
+
+
+class ResponseResolver:
+    """
+    Finds the response data for a requested path. Files are served from the
+    shared cache, fetched from Cobbler or read from the static fallback
+    directory, in that order. Paths that none of them could serve are
+    remembered in a negative cache for a short time.
+
+    The configured routes may direct paths to the static directory only, or
+    to Cobbler without using the cache. The first matching route wins.
     """
 
+    def __init__(
+        self,
+        settings: Settings,
+        cache: Optional[SharedFileCache] = None,
+        pool: Optional[CobblerClientPool] = None,
+    ):
+        """
+        Initialize the resolver.
+
+        :param settings: The cobbler-tftp application settings.
+        :param cache: The shared file cache, if enabled.
+        :param pool: The client pool used for fetching chunks in parallel.
+        """
+        self._settings = settings
+        self._cache = cache
+        self._pool = pool
+        self._missing: Optional[NegativeCache] = None
+        if settings.cache_negative_ttl > 0:
+            self._missing = NegativeCache(settings.cache_negative_ttl)
+        self._static: Optional[StaticIndex] = None
+        if settings.static_fallback_dir is not None and settings.static_fallback_index:
+            self._static = StaticIndex(settings.static_fallback_dir)
+        self._sources = [route["source"] for route in settings.tftp_routes]
+        self._routes: Optional["re.Pattern[str]"] = None
+        if settings.tftp_routes:
+            # A single regular expression with one group per route, so each
+            # request is matched only once.
+            self._routes = re.compile(
+                "|".join(
+                    f"(?P<route{index}>{fnmatch.translate(route['pattern'])})"
+                    for index, route in enumerate(settings.tftp_routes)
+                )
+            )
+
+    def route(self, path: str) -> str:
+        """
+        Find the source of a path.
+
+        :param path: Request file path.
+        :return: ``static``, ``cobbler`` or ``cache``.
+        """
+        if self._routes is not None:
+            match = self._routes.match(normalize_path(path))
+            if match is not None and match.lastgroup is not None:
+                return self._sources[int(match.lastgroup[len("route") :])]
+        return ROUTE_CACHE
+
+    def _open_static(self, path: str) -> ResponseData:
+        if self._settings.static_fallback_dir is None:
+            raise FileNotFoundError(errno.ENOENT, "File not found", path)
+        static_path = normalize_path(path)
+        if self._static is None:
+            return open_file(
+                self._settings.static_fallback_dir / static_path,
+                use_mmap=self._settings.tftp_mmap,
+            )
+        entry = self._static.get(static_path)
+        if entry is None:
+            raise FileNotFoundError(errno.ENOENT, "File not found", path)
+        return open_file(
+            self._settings.static_fallback_dir / static_path,
+            entry.size,
+            self._settings.tftp_mmap,
+        )
+
+    def close(self) -> None:
+        """Stop keeping the index of the static fallback directory current."""
+        if self._static is not None:
+            self._static.close()
+
+    def _not_found(self, path: str, err: xmlrpc.client.Error) -> FileNotFoundError:
+        # Other errors may be gone with the next request.
+        if self._missing is not None and is_missing_file(err):
+            self._missing.add(path)
+        return FileNotFoundError(errno.ENOENT, "File not found", path)
+
+    def resolve(self, api: xmlrpc.client.Server, token: str, path: str) -> ResponseData:
+        """
+        Get the response data for a path.
+
+        :param api: The Cobbler API object.
+        :param token: Login token for accessing the Cobbler API.
+        :param path: Request file path.
+        :return: The response data, the first chunk of Cobbler files is already loaded.
+        """
+        if self._missing is not None and path in self._missing:
+            raise FileNotFoundError(errno.ENOENT, "File not found", path)
+        source = self.route(path)
+        if source == ROUTE_STATIC:
+            return self._open_static(path)
+        cache = self._cache if source == ROUTE_CACHE else None
+        if cache is not None:
+            cached_path = cache.lookup(path)
+            metrics.CACHE_LOOKUPS.inc(1, "miss" if cached_path is None else "hit")
+            if cached_path is not None:
+                try:
+                    return open_file(cached_path, use_mmap=self._settings.tftp_mmap)
+                except FileNotFoundError:
+                    # Evicted between lookup and open
+                    pass
+            flight = cache.join_flight(path)
+        else:
+            flight = None
+        resp = CobblerResponseData(
+            api,
+            token,
+            path,
+            ChunkSizer(
+                self._settings.prefetch_size,
+                self._settings.prefetch_max_size,
+                self._settings.prefetch_target_latency / 1000,
+            ),
+            cache,
+            self._settings.prefetch_depth,
+            flight,
+            self._settings.prefetch_stream_size,
+            self._pool,
+            self._settings.prefetch_concurrency,
+        )
+        try:
+            resp.load()
+            return resp
+        except xmlrpc.client.Error as err:
+            resp.close()
+            # Missing files are requested often.
+            missing = is_missing_file(err)
+            logging.warning(
+                "Could not fetch %s from server: %r",
+                path,
+                err,
+                extra={"category": logs.CATEGORY_MISS if missing else None},
+            )
+            if self._settings.static_fallback_dir is None:
+                if missing:
+                    raise self._not_found(path, err) from err
+                raise err
+            try:
+                return self._open_static(path)
+            except FileNotFoundError:
+                raise self._not_found(path, err) from err
+
 
 class CobblerRequestHandler(BaseHandler):
     """
@@ -124,6 +663,9 @@ class CobblerRequestHandler(BaseHandler):
         api: xmlrpc.client.Server,
         token: str,
         settings: Settings,
+        resolver: ResponseResolver,
+        profiler: Optional[SessionProfiler] = None,
+        request_time: Optional[float] = None,
     ):
         """
         Initialize a handler for a specific request.
@@ -135,25 +677,145 @@ class CobblerRequestHandler(BaseHandler):
         :param api: The Cobbler API object.
         :param token: Login token for accessing the Cobbler API.
         :param settings: The cobbler-tftp application settings.
+        :param resolver: Finds the response data for the requested path.
+        :param profiler: Decides whether the session is profiled.
+        :param request_time: Time the request was received, before the token
+                             was acquired. Defaults to now.
         """
+        token_time = time.time()
+        self._resolved_time: Optional[float] = None
+        self._fetch_durations: List[float] = []
         self._api = api
         self._token = token
         self._settings = settings
-        super().__init__(server_addr, peer, path, options, handler_stats_cb)
+        self._resolver = resolver
+        self._window_size = 1
+        self._window: Deque[Tuple[int, bytes]] = deque()
+        self._profiler = profiler
+        self._profile = profiler.sample() if profiler is not None else None
+        with self._profiling():
+            super().__init__(server_addr, peer, path, options, handler_stats_cb)
+        self._stats.request_time = token_time if request_time is None else request_time
+        self._stats.token_time = token_time
+        self._stats.resolved_time = self._resolved_time
+        self._stats.fetch_durations = self._fetch_durations
+        self._stats.first_data_time = None
+        self._stats.last_data_time = None
+        self._stats.last_ack_time = None
+
+    @contextlib.contextmanager
+    def _profiling(self) -> Iterator[None]:
+        if self._profile is not None:
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Another session of this process is already being profiled.
+                self._profile = None
+        try:
+            yield
+        finally:
+            if self._profile is not None:
+                self._profile.disable()
+
+    def run(self):
+        if multiprocessing.current_process() is self:
+            # Forked for this session only.
+            logs.session_process()
+        # Decreased by the stats callback in the same process, which keeps
+        # the shards of the metrics balanced.
+        metrics.SESSIONS_ACTIVE.inc()
+        try:
+            with self._profiling():
+                super().run()
+        finally:
+            if self._profiler is not None and self._profile is not None:
+                self._profiler.dump(self._profile)
 
     def get_response_data(self):
-        resp = CobblerResponseData(
-            self._api, self._token, self._path, self._settings.prefetch_size  # type: ignore[reportUnkownArgumentType]
-        )
+        response = self._resolver.resolve(self._api, self._token, self._path)  # type: ignore[reportUnkownArgumentType]
+        self._resolved_time = time.time()
+        self._fetch_durations = getattr(response, "fetch_durations", [])
+        return response
+
+    def _on_close(self):
+        if self._waiting_last_ack and not self._stats.error:
+            self._stats.last_ack_time = time.time()
+        super()._on_close()
+
+    def _parse_options(self):
+        # fbtftp only acknowledges the options it knows about.
+        window_size = self._options.pop("windowsize", None)
+        super()._parse_options()
+        if window_size is None or self._settings.tftp_max_window_size <= 1:
+            return
         try:
-            resp.load()
-            return resp
-        except xmlrpc.client.Error as err:
-            logging.warning("Could not fetch %s from server: %r", self._path, err)  # type: ignore[reportUnkownArgumentType]
-            if self._settings.static_fallback_dir is not None:
-                path = os.path.normpath(os.path.join("/", self._path)).strip("/")  # type: ignore[reportUnkownArgumentType]
-                return FileResponseData(self._settings.static_fallback_dir / path)
-            raise err
+            self._window_size = min(
+                max(int(window_size), 1), self._settings.tftp_max_window_size
+            )
+        except ValueError:
+            return
+        self._options["windowsize"] = str(self._window_size)
+
+    def _send_block(self, block_number: int, block: bytes) -> None:
+        # Blocks may be memoryviews, which fbtftp cannot pack.
+        packet = struct.pack("!HH", OPCODE_DATA, block_number) + block
+        if self._stats.first_data_time is None:
+            self._stats.first_data_time = time.time()
+        if len(block) < self._block_size:
+            self._stats.last_data_time = time.time()
+        self._get_listener().sendto(packet, self._peer)
+        self._stats.packets_sent += 1
+        self._stats.bytes_sent += len(block)
+
+    def _fill_window(self) -> None:
+        while len(self._window) < self._window_size and not self._waiting_last_ack:
+            self._next_block()
+            if self._should_stop:
+                return
+            self._window.append((self._last_block_sent, self._current_block))
+            self._send_block(self._last_block_sent, self._current_block)
+            if len(self._current_block) < self._block_size:
+                self._waiting_last_ack = True
+
+    def _handle_ack(self, block_number: int):
+        if self._window_size == 1:
+            super()._handle_ack(block_number)
+            return
+        if not self._window:
+            if block_number == 0 and self._last_block_sent == 0:
+                # The client acknowledged the OACK.
+                self._reset_timeout()
+                self._retransmits = 0
+                self._stats.packets_acked += 1
+                self._fill_window()
+            return
+        if block_number == (self._window[0][0] - 1) % (MAX_BLOCK_NUMBER + 1):
+            # The client missed the first block of the window, see RFC 7440.
+            self._transmit_data()
+            return
+        if all(number != block_number for number, _ in self._window):
+            return
+        while self._window.popleft()[0] != block_number:
+            pass
+        self._reset_timeout()
+        self._retransmits = 0
+        self._stats.packets_acked += 1
+        if self._waiting_last_ack and not self._window:
+            self._should_stop = True
+            return
+        self._fill_window()
+
+    def _transmit_data(self):
+        if not self._window:
+            if self._current_block is None:
+                super()._transmit_data()
+                return
+            self._send_block(self._last_block_sent, self._current_block)
+            if len(self._current_block) < self._block_size:
+                self._waiting_last_ack = True
+            return
+        for block_number, block in self._window:
+            self._send_block(block_number, block)
 
 
 class TFTPServer(BaseServer):
@@ -167,29 +829,62 @@ class TFTPServer(BaseServer):
 
         :param settings: The cobbler-tftp application settings.
         """
-        self._token = None
-        self._token_renew_time = 0.0
         self._settings = settings
-        super().__init__(  # type: ignore[reportUnkownMemberType]
-            settings.tftp_addr,
-            settings.tftp_port,
-            settings.tftp_retries,
-            settings.tftp_timeout,
-            server_stats_cb,
+        self._pool = CobblerClientPool(
+            settings.uri, settings.connection_pool_size, settings.file_uri
         )
-
-    def _renew_token(self, api: xmlrpc.client.Server):
-        start_time = time.monotonic()
-        if start_time >= self._token_renew_time:
-            self._token = api.login(self._settings.user, self._settings.password)
-            self._token_renew_time = start_time + self._settings.token_refresh_interval
+        self._tokens = TokenManager(self._pool, settings)
+        self._cache: Optional[SharedFileCache] = None
+        if settings.cache_max_size > 0:
+            self._cache = SharedFileCache(settings)
+        self._resolver = ResponseResolver(settings, self._cache, self._pool)
+        self._profiler = SessionProfiler(settings)
+        try:
+            # fbtftp binds the listener without SO_REUSEPORT, so it is bound to
+            # a random port first if the port is shared with other listeners.
+            super().__init__(  # type: ignore[reportUnkownMemberType]
+                settings.tftp_addr,
+                0 if settings.tftp_listeners > 1 else settings.tftp_port,
+                settings.tftp_retries,
+                settings.tftp_timeout,
+                server_stats_cb,
+            )
+            if settings.tftp_listeners > 1:
+                self._share_listener()
+        except:  # pylint: disable=bare-except
+            if self._cache is not None:
+                self._cache.close()
+            raise
+        self._invalidator: Optional[CacheInvalidator] = None
+        if self._cache is not None and settings.cache_invalidation_interval > 0:
+            self._invalidator = CacheInvalidator(
+                self._cache, self._pool, self._tokens, settings
+            )
+
+    def _share_listener(self):
+        self._selector.unregister(self._listener)  # type: ignore
+        self._listener.close()  # type: ignore
+        self._listener = socket.socket(self._family, socket.SOCK_DGRAM)  # type: ignore
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._listener.setblocking(False)
+        self._listener.bind((self._settings.tftp_addr, self._settings.tftp_port))
+        self._selector.register(self._listener, selectors.EVENT_READ)  # type: ignore
+        self._port = self._settings.tftp_port
+
+    def _logout(self):
+        self._tokens.close()
+        self._pool.close()
 
     def cleanup(self):
-        if self._token is not None:
-            if time.monotonic() < self._token_renew_time:
-                xmlrpc.client.Server(self._settings.uri).logout(self._token)
+        if self._invalidator is not None:
+            self._invalidator.close()
+        self._logout()
+        self._resolver.close()
+        if self._cache is not None:
+            self._cache.close()
         # fbtftp doesn't clean up after exceptions, so we do it here ourselves
-        self._metrics_timer.cancel()  # type: ignore
+        if self._metrics_timer is not None:  # type: ignore
+            self._metrics_timer.cancel()  # type: ignore
 
     def get_handler(
         self,
@@ -198,8 +893,32 @@ class TFTPServer(BaseServer):
         path: str,
         options: Dict[str, Any],
     ):
-        api = xmlrpc.client.Server(self._settings.uri)
-        self._renew_token(api)
+        request_time = time.time()
+        # The handler keeps using the client after it was returned to the
+        # pool, but only in the forked process.
+        with self._pool.client() as api:
+            return self._create_handler(
+                api, server_addr, peer, path, options, request_time
+            )
+
+    def _create_handler(
+        self,
+        api: xmlrpc.client.Server,
+        server_addr: Tuple[str, int],
+        peer: Tuple[str, int],
+        path: str,
+        options: Dict[str, Any],
+        request_time: Optional[float] = None,
+    ) -> CobblerRequestHandler:
         return CobblerRequestHandler(
-            server_addr, peer, path, options, api, self._token, self._settings  # type: ignore[reportArgumentType]
+            server_addr,
+            peer,
+            path,
+            options,
+            api,
+            self._tokens.token(),
+            self._settings,
+            self._resolver,
+            self._profiler,
+            request_time,
         )
@@ -0,0 +1,145 @@
+"""
+This module contains a TFTP server that hands sessions to a pool of
+long-lived worker processes instead of forking a process for each session.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from cobbler_tftp.server.tftp import TFTPServer
+from cobbler_tftp.settings import Settings
+
+Session = Tuple[Tuple[str, int], Tuple[str, int], str, Dict[str, Any], float]
+
+
+class _QueuedSession:
+    """
+    Stands in for the handler process that fbtftp expects from
+    ``get_handler()``. Starting it hands the session to a worker.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, queue: "multiprocessing.Queue[Any]", session: Session):
+        self.daemon = True
+        self._queue = queue
+        self._session = session
+
+    def start(self) -> None:
+        """Queue the session for the worker."""
+        self._queue.put(self._session)
+
+
+class PreforkTFTPServer(TFTPServer):
+    """
+    TFTP server that serves sessions in a fixed pool of worker processes.
+
+    Each worker serves several sessions concurrently in threads and keeps its
+    connection pool and login token between sessions. Sessions are handed to
+    the worker serving the fewest sessions. Every worker has its own queue, as
+    a worker killed while waiting for a session would keep a shared queue
+    locked.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Initialize the TFTP server and start the workers.
+
+        :param settings: The cobbler-tftp application settings.
+        """
+        super().__init__(settings)
+        count = settings.tftp_workers or os.cpu_count() or 1
+        self._workers: List[multiprocessing.Process] = []
+        self._queues: "List[multiprocessing.Queue[Any]]" = []
+        # Sessions handed to each worker, and finished by it.
+        self._dispatched = [0] * count
+        self._finished = multiprocessing.RawArray("Q", count)
+        for index in range(count):
+            self._workers.append(self._start_worker(index))
+
+    def _start_worker(self, index: int) -> multiprocessing.Process:
+        session_queue: "multiprocessing.Queue[Any]" = multiprocessing.Queue()
+        self._dispatched[index] = 0
+        self._finished[index] = 0
+        worker = multiprocessing.Process(
+            target=self._run_worker, args=(index, session_queue), daemon=True
+        )
+        worker.start()
+        if index < len(self._queues):
+            self._queues[index] = session_queue
+        else:
+            self._queues.append(session_queue)
+        return worker
+
+    def _run_worker(self, index: int, session_queue: "multiprocessing.Queue[Any]"):
+        # The server process stops the workers on shutdown.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        executor = ThreadPoolExecutor(self._settings.tftp_worker_threads)
+        lock = threading.Lock()
+
+        def finished(_: "Future[None]") -> None:
+            with lock:
+                self._finished[index] += 1
+
+        while True:
+            session = session_queue.get()
+            if session is None:
+                break
+            executor.submit(self._serve, *session).add_done_callback(finished)
+        executor.shutdown()
+        self._logout()
+
+    def _serve(
+        self,
+        server_addr: Tuple[str, int],
+        peer: Tuple[str, int],
+        path: str,
+        options: Dict[str, Any],
+        request_time: float,
+    ) -> None:
+        try:
+            with self._pool.client() as api:
+                handler = self._create_handler(
+                    api, server_addr, peer, path, options, request_time
+                )
+                try:
+                    handler.run()
+                except SystemExit:
+                    # The handler exits the process when the session is done.
+                    pass
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Error while serving %r for %r", path, peer)
+
+    def get_handler(
+        self,
+        server_addr: Tuple[str, int],
+        peer: Tuple[str, int],
+        path: str,
+        options: Dict[str, Any],
+    ):
+        for index, worker in enumerate(self._workers):
+            if not worker.is_alive():
+                logging.error("Worker %d died, restarting it", worker.pid)
+                self._queues[index].close()
+                self._workers[index] = self._start_worker(index)
+        index = min(
+            range(len(self._workers)),
+            key=lambda other: self._dispatched[other] - self._finished[other],
+        )
+        self._dispatched[index] += 1
+        return _QueuedSession(
+            self._queues[index], (server_addr, peer, path, options, time.time())
+        )
+
+    def cleanup(self):
+        for session_queue in self._queues:
+            session_queue.put(None)
+        for worker in self._workers:
+            worker.join(self._settings.tftp_timeout)
+        super().cleanup()
@@ -3,7 +3,7 @@
 import os
 from importlib.resources import files
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import yaml
 
@@ -28,13 +28,49 @@ class Settings:
         password: Optional[str],
         password_file: Optional[Path],
         token_refresh_interval: int,
+        connection_pool_size: int,
+        file_uri: Optional[str],
         prefetch_size: int,
+        prefetch_depth: int,
+        prefetch_max_size: int,
+        prefetch_target_latency: int,
+        prefetch_stream_size: int,
+        prefetch_concurrency: int,
         tftp_addr: str,
         tftp_port: int,
         tftp_retries: int,
         tftp_timeout: int,
+        tftp_max_window_size: int,
+        tftp_engine: str,
+        tftp_workers: int,
+        tftp_worker_threads: int,
+        tftp_listeners: int,
+        tftp_routes: List[Dict[str, str]],
         logging_conf: Optional[Path],
+        logging_queue: bool,
+        logging_batch_size: int,
+        logging_flush_interval: float,
+        logging_max_queued: int,
+        logging_json: bool,
+        logging_rate_limits: Dict[str, float],
         static_fallback_dir: Optional[Path],
+        static_fallback_index: bool,
+        tftp_mmap: bool,
+        cache_max_size: int,
+        cache_max_file_size: int,
+        cache_ttl: int,
+        cache_dir: Optional[Path],
+        cache_coalesce: bool,
+        cache_coalesce_max_memory: int,
+        cache_persistent: bool,
+        cache_invalidation_interval: int,
+        cache_volatile_paths: List[str],
+        cache_negative_ttl: int,
+        metrics_addr: str,
+        metrics_port: int,
+        profiling_enabled: bool,
+        profiling_sample_rate: float,
+        profiling_dir: Path,
     ) -> None:
         """
         Initialize a new instance of the Settings.
@@ -45,8 +81,50 @@ class Settings:
         :param username: Username to authenticate at Cobbler's API.
         :param password: Password for authentication with Cobbler.
         :param password_file: Path to the file containing the password.
+        :param connection_pool_size: Number of idle keep-alive connections to Cobbler.
+        :param file_uri: URI under which Cobbler serves the TFTP files over HTTP, used instead of XML-RPC for
+                         fetching file contents.
         :param prefetch_size: Chunk size when fetching files from Cobbler.
+        :param prefetch_depth: Number of chunks fetched ahead of the current one. 0 disables read-ahead.
+        :param prefetch_max_size: Maximum chunk size when adapting it to the latency of Cobbler. Values not larger than
+                                  ``prefetch_size`` disable the adaptation.
+        :param prefetch_target_latency: Time in milliseconds a single chunk fetch should take.
+        :param prefetch_stream_size: Minimum size of files that are fetched with a single streaming download. 0
+                                     disables streaming.
+        :param prefetch_concurrency: Number of chunks of a file fetched from Cobbler in parallel.
+        :param tftp_max_window_size: Maximum number of blocks sent before waiting for an ACK (RFC 7440). 1 disables
+                                     the ``windowsize`` option.
+        :param tftp_engine: How TFTP sessions are served, either ``fork``, ``prefork`` or ``asyncio``.
+        :param tftp_workers: Number of worker processes of the ``prefork`` and ``asyncio`` engines. 0 uses one per
+                             CPU core.
+        :param tftp_worker_threads: Number of threads per worker process.
+        :param tftp_listeners: Number of listener processes sharing the TFTP port with ``SO_REUSEPORT``.
+        :param tftp_routes: Routes with a glob ``pattern`` and a ``source``, which is ``static``, ``cobbler`` or
+                            ``cache``.
+        :param logging_queue: Write log records in batches from a background thread of each process.
+        :param logging_batch_size: Number of queued log records that are written right away.
+        :param logging_flush_interval: Maximum time in seconds log records are queued.
+        :param logging_max_queued: Maximum number of queued log records, further records are dropped.
+        :param logging_json: Write log records as JSON objects, one per line.
+        :param logging_rate_limits: Maximum number of queued log records per second by category.
         :param static_fallback_dir: Path to the directory with static TFTP files.
+        :param static_fallback_index: Whether to keep an index of the static TFTP files in memory.
+        :param tftp_mmap: Whether to serve static and cached files from memory maps.
+        :param cache_max_size: Maximum size of the shared file cache in bytes. 0 disables the cache.
+        :param cache_max_file_size: Maximum size of a single file in the shared file cache.
+        :param cache_ttl: Time in seconds after which cached files are fetched again.
+        :param cache_dir: Directory for the shared file cache. Defaults to a directory in ``/dev/shm``.
+        :param cache_coalesce: Share the download between sessions requesting the same file at the same time.
+        :param cache_coalesce_max_memory: Maximum size in bytes of the chunks held for sessions sharing a download.
+        :param cache_persistent: Keep the cached files and their index in ``cache_dir`` across restarts.
+        :param cache_invalidation_interval: Time in seconds between polls for changes in Cobbler. 0 disables polling.
+        :param cache_volatile_paths: Patterns of cached paths that are removed whenever Cobbler changes.
+        :param cache_negative_ttl: Time in seconds missing files are remembered. 0 disables the negative cache.
+        :param metrics_addr: Address of the HTTP endpoint serving the metrics.
+        :param metrics_port: Port of the HTTP endpoint serving the metrics. 0 disables the endpoint.
+        :param profiling_enabled: Whether sessions are profiled from the start. ``SIGUSR1`` switches it at runtime.
+        :param profiling_sample_rate: Fraction of the sessions that are profiled.
+        :param profiling_dir: Directory for the aggregate profiles.
         """
         # pylint: disable=R0913
 
@@ -56,13 +134,49 @@ class Settings:
         self.uri: str = uri
         self.user: str = username
         self.token_refresh_interval: int = token_refresh_interval
+        self.connection_pool_size: int = connection_pool_size
+        self.file_uri: Optional[str] = file_uri
         self.prefetch_size: int = prefetch_size
+        self.prefetch_depth: int = prefetch_depth
+        self.prefetch_max_size: int = prefetch_max_size
+        self.prefetch_target_latency: int = prefetch_target_latency
+        self.prefetch_stream_size: int = prefetch_stream_size
+        self.prefetch_concurrency: int = prefetch_concurrency
         self.tftp_addr: str = tftp_addr
         self.tftp_port: int = tftp_port
         self.tftp_retries: int = tftp_retries
         self.tftp_timeout: int = tftp_timeout
+        self.tftp_max_window_size: int = tftp_max_window_size
+        self.tftp_engine: str = tftp_engine
+        self.tftp_workers: int = tftp_workers
+        self.tftp_worker_threads: int = tftp_worker_threads
+        self.tftp_listeners: int = tftp_listeners
+        self.tftp_routes: List[Dict[str, str]] = tftp_routes
         self.logging_conf: Optional[Path] = logging_conf
+        self.logging_queue: bool = logging_queue
+        self.logging_batch_size: int = logging_batch_size
+        self.logging_flush_interval: float = logging_flush_interval
+        self.logging_max_queued: int = logging_max_queued
+        self.logging_json: bool = logging_json
+        self.logging_rate_limits: Dict[str, float] = logging_rate_limits
         self.static_fallback_dir: Optional[Path] = static_fallback_dir
+        self.static_fallback_index: bool = static_fallback_index
+        self.tftp_mmap: bool = tftp_mmap
+        self.cache_max_size: int = cache_max_size
+        self.cache_max_file_size: int = cache_max_file_size
+        self.cache_ttl: int = cache_ttl
+        self.cache_dir: Optional[Path] = cache_dir
+        self.cache_coalesce: bool = cache_coalesce
+        self.cache_coalesce_max_memory: int = cache_coalesce_max_memory
+        self.cache_persistent: bool = cache_persistent
+        self.cache_invalidation_interval: int = cache_invalidation_interval
+        self.cache_volatile_paths: List[str] = cache_volatile_paths
+        self.cache_negative_ttl: int = cache_negative_ttl
+        self.metrics_addr: str = metrics_addr
+        self.metrics_port: int = metrics_port
+        self.profiling_enabled: bool = profiling_enabled
+        self.profiling_sample_rate: float = profiling_sample_rate
+        self.profiling_dir: Path = profiling_dir
         self.__password: Optional[str] = password
         self.__password_file: Optional[Path] = password_file
 
@@ -152,20 +266,63 @@ class SettingsFactory:
         else:
             password_file = None
         token_refresh_interval: int = cobbler_settings.get("token_refresh_interval", 1800)  # type: ignore
+        connection_pool_size: int = cobbler_settings.get("connection_pool_size", 4)  # type: ignore
+        file_uri: Optional[str] = cobbler_settings.get("file_uri", None)  # type: ignore
         prefetch_size: int = self._settings_dict.get("prefetch_size", 4096)  # type: ignore
+        prefetch_depth: int = self._settings_dict.get("prefetch_depth", 0)  # type: ignore
+        prefetch_max_size: int = self._settings_dict.get("prefetch_max_size", 0)  # type: ignore
+        prefetch_target_latency: int = self._settings_dict.get("prefetch_target_latency", 200)  # type: ignore
+        prefetch_stream_size: int = self._settings_dict.get("prefetch_stream_size", 0)  # type: ignore
+        prefetch_concurrency: int = self._settings_dict.get("prefetch_concurrency", 1)  # type: ignore
         tftp_settings = self._settings_dict.get("tftp", {})
         tftp_addr: str = tftp_settings.get("address", "127.0.0.1")  # type: ignore
         tftp_port: int = tftp_settings.get("port", 69)  # type: ignore
         tftp_retries: int = tftp_settings.get("retries", 5)  # type: ignore
         tftp_timeout: int = tftp_settings.get("timeout", 2)  # type: ignore
+        tftp_max_window_size: int = tftp_settings.get("max_window_size", 1)  # type: ignore
+        tftp_engine: str = tftp_settings.get("engine", "fork")  # type: ignore
+        tftp_workers: int = tftp_settings.get("workers", 0)  # type: ignore
+        tftp_worker_threads: int = tftp_settings.get("worker_threads", 32)  # type: ignore
+        tftp_listeners: int = tftp_settings.get("listeners", 1)  # type: ignore
+        tftp_routes: List[Dict[str, str]] = tftp_settings.get("routes", [])  # type: ignore
         if tftp_settings.get("static_fallback_dir", None) is not None:  # type: ignore
             static_fallback_dir: Optional[Path] = Path(tftp_settings.get("static_fallback_dir", None))  # type: ignore
         else:
             static_fallback_dir = None
+        static_fallback_index: bool = tftp_settings.get("static_fallback_index", False)  # type: ignore
+        tftp_mmap: bool = tftp_settings.get("mmap", False)  # type: ignore
         if self._settings_dict.get("logging_conf", None) is not None:  # type: ignore
             logging_conf: Optional[Path] = Path(self._settings_dict.get("logging_conf", None))  # type: ignore
         else:
             logging_conf = None
+        logging_settings = self._settings_dict.get("logging", {})
+        logging_queue: bool = logging_settings.get("queue", False)  # type: ignore
+        logging_batch_size: int = logging_settings.get("batch_size", 256)  # type: ignore
+        logging_flush_interval: float = logging_settings.get("flush_interval", 1.0)  # type: ignore
+        logging_max_queued: int = logging_settings.get("max_queued", 65536)  # type: ignore
+        logging_json: bool = logging_settings.get("json", False)  # type: ignore
+        logging_rate_limits: Dict[str, float] = logging_settings.get("rate_limits", {})  # type: ignore
+        cache_settings = self._settings_dict.get("cache", {})
+        cache_max_size: int = cache_settings.get("max_size", 0)  # type: ignore
+        cache_max_file_size: int = cache_settings.get("max_file_size", 134217728)  # type: ignore
+        cache_ttl: int = cache_settings.get("ttl", 300)  # type: ignore
+        if cache_settings.get("directory", None) is not None:  # type: ignore
+            cache_dir: Optional[Path] = Path(cache_settings.get("directory", None))  # type: ignore
+        else:
+            cache_dir = None
+        cache_coalesce: bool = cache_settings.get("coalesce", False)  # type: ignore
+        cache_coalesce_max_memory: int = cache_settings.get("coalesce_max_memory", 67108864)  # type: ignore
+        cache_persistent: bool = cache_settings.get("persistent", False)  # type: ignore
+        cache_invalidation_interval: int = cache_settings.get("invalidation_interval", 0)  # type: ignore
+        cache_volatile_paths: List[str] = cache_settings.get("volatile_paths", [])  # type: ignore
+        cache_negative_ttl: int = cache_settings.get("negative_ttl", 0)  # type: ignore
+        metrics_settings = self._settings_dict.get("metrics", {})
+        metrics_addr: str = metrics_settings.get("address", "127.0.0.1")  # type: ignore
+        metrics_port: int = metrics_settings.get("port", 0)  # type: ignore
+        profiling_settings = self._settings_dict.get("profiling", {})
+        profiling_enabled: bool = profiling_settings.get("enabled", False)  # type: ignore
+        profiling_sample_rate: float = profiling_settings.get("sample_rate", 0.01)  # type: ignore
+        profiling_dir: Path = Path(profiling_settings.get("directory", "/var/lib/cobbler-tftp/profiles"))  # type: ignore
 
         # Create and return a new Settings object
         settings = Settings(
@@ -177,13 +334,49 @@ class SettingsFactory:
             password,
             password_file,
             token_refresh_interval,
+            connection_pool_size,
+            file_uri,
             prefetch_size,
+            prefetch_depth,
+            prefetch_max_size,
+            prefetch_target_latency,
+            prefetch_stream_size,
+            prefetch_concurrency,
             tftp_addr,
             tftp_port,
             tftp_retries,
             tftp_timeout,
+            tftp_max_window_size,
+            tftp_engine,
+            tftp_workers,
+            tftp_worker_threads,
+            tftp_listeners,
+            tftp_routes,
             logging_conf,
+            logging_queue,
+            logging_batch_size,
+            logging_flush_interval,
+            logging_max_queued,
+            logging_json,
+            logging_rate_limits,
             static_fallback_dir,
+            static_fallback_index,
+            tftp_mmap,
+            cache_max_size,
+            cache_max_file_size,
+            cache_ttl,
+            cache_dir,
+            cache_coalesce,
+            cache_coalesce_max_memory,
+            cache_persistent,
+            cache_invalidation_interval,
+            cache_volatile_paths,
+            cache_negative_ttl,
+            metrics_addr,
+            metrics_port,
+            profiling_enabled,
+            profiling_sample_rate,
+            profiling_dir,
         )
 
         return settings
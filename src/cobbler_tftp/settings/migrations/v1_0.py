@@ -26,16 +26,62 @@ settings_schema: Schema = Schema(
             Optional("password"): Or(str, Path),  # type: ignore[reportArgumentType]
             Optional("password_file"): Or(str, Path),  # type: ignore[reportArgumentType]
             Optional("token_refresh_interval"): int,
+            Optional("connection_pool_size"): int,
+            Optional("file_uri"): str,
         },
         Optional("prefetch_size"): int,
+        Optional("prefetch_depth"): int,
+        Optional("prefetch_max_size"): int,
+        Optional("prefetch_target_latency"): int,
+        Optional("prefetch_stream_size"): int,
+        Optional("prefetch_concurrency"): int,
         Optional("tftp"): {
             Optional("address"): str,
             Optional("port"): int,
             Optional("retries"): int,
             Optional("timeout"): int,
+            Optional("max_window_size"): int,
+            Optional("engine"): Or("fork", "prefork", "asyncio"),
+            Optional("workers"): int,
+            Optional("worker_threads"): int,
+            Optional("listeners"): int,
+            Optional("routes"): [
+                {"pattern": str, "source": Or("static", "cobbler", "cache")}
+            ],
             Optional("static_fallback_dir"): str,
+            Optional("static_fallback_index"): bool,
+            Optional("mmap"): bool,
         },
         Optional("logging_conf"): str,
+        Optional("logging"): {
+            Optional("queue"): bool,
+            Optional("batch_size"): int,
+            Optional("flush_interval"): Or(int, float),
+            Optional("max_queued"): int,
+            Optional("json"): bool,
+            Optional("rate_limits"): {str: Or(int, float)},
+        },
+        Optional("cache"): {
+            Optional("max_size"): int,
+            Optional("max_file_size"): int,
+            Optional("ttl"): int,
+            Optional("directory"): str,
+            Optional("coalesce"): bool,
+            Optional("coalesce_max_memory"): int,
+            Optional("persistent"): bool,
+            Optional("invalidation_interval"): int,
+            Optional("volatile_paths"): [str],
+            Optional("negative_ttl"): int,
+        },
+        Optional("metrics"): {
+            Optional("address"): str,
+            Optional("port"): int,
+        },
+        Optional("profiling"): {
+            Optional("enabled"): bool,
+            Optional("sample_rate"): Or(int, float),
+            Optional("directory"): str,
+        },
     }
 )
 
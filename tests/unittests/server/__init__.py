@@ -0,0 +1,3 @@
+"""
+Cobbler-tftp unittest module for the TFTP server component.
+"""
@@ -0,0 +1,75 @@
+"""
+Fixtures for the TFTP server unittests.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+from cobbler_tftp.settings import Settings, SettingsFactory
+
+FILE_CONTENT = bytes(range(256)) * 8
+FILE_MODIFIED = "Sat, 01 Jan 2022 00:00:00 GMT"
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == "/tftpboot/plain.cfg":
+            # Like a server that does not support range requests.
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(FILE_CONTENT)))
+            self.end_headers()
+            self.wfile.write(FILE_CONTENT)
+            return
+        if self.path != "/tftpboot/grub/grub.cfg":
+            self.send_error(404)
+            return
+        start, end = self.headers["Range"][len("bytes=") :].split("-")
+        size = len(FILE_CONTENT)
+        end = end or str(size - 1)
+        if int(start) >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = FILE_CONTENT[int(start) : int(end) + 1]
+        self.send_response(206)
+        self.send_header(
+            "Content-Range", f"bytes {start}-{int(start) + len(data) - 1}/{size}"
+        )
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Last-Modified", FILE_MODIFIED)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: object):
+        pass
+
+
+@pytest.fixture
+def file_server() -> Iterator[str]:
+    """
+    Fixture that serves FILE_CONTENT as /tftpboot/grub/grub.cfg with range
+    requests and FILE_MODIFIED as its modification time, like a web server
+    exposing the TFTP root of Cobbler, and as /tftpboot/plain.cfg without
+    range requests.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/tftpboot/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def settings() -> Settings:
+    """
+    Fixture that represents the default application settings.
+    """
+    return SettingsFactory().build_settings(None)
@@ -0,0 +1,240 @@
+"""
+Tests for the asyncio engine.
+"""
+
+import asyncio
+import socket
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytest
+from fbtftp import ResponseData  # type: ignore[reportMissingTypeStubs]
+from pytest_mock import MockerFixture
+
+from cobbler_tftp.server.aio import AsyncSession, AsyncTFTPServer
+from cobbler_tftp.server.tftp import FileResponseData
+from cobbler_tftp.settings import Settings
+
+
+def _receive(sock: socket.socket, blocks: List[bytes]) -> None:
+    while True:
+        packet, addr = sock.recvfrom(65536)
+        opcode, block_number = struct.unpack("!HH", packet[:4])
+        assert opcode == 3
+        blocks.append(packet[4:])
+        sock.sendto(struct.pack("!HH", 4, block_number), addr)
+        if len(packet) - 4 < 512:
+            return
+
+
+def _parse_error(packet: bytes) -> Tuple[int, str]:
+    opcode, code = struct.unpack("!HH", packet[:4])
+    assert opcode == 5
+    return code, packet[4:-1].decode("latin-1")
+
+
+def _run_session(
+    settings: Settings,
+    mocker: MockerFixture,
+    tmp_path: Path,
+    options: Dict[str, str],
+    client: Callable[[socket.socket], None],
+    response: Optional[ResponseData] = None,
+) -> None:
+    settings.tftp_addr = "127.0.0.1"
+    settings.cache_max_size = 0
+    (tmp_path / "pxelinux.0").write_bytes(bytes(range(256)) * 5)
+    server = AsyncTFTPServer(settings)
+    mocker.patch.object(server, "client")
+    mocker.patch.object(
+        server,
+        "resolve",
+        return_value=response or FileResponseData(tmp_path / "pxelinux.0"),
+    )
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+    thread = threading.Thread(target=client, args=(sock,))
+    thread.start()
+
+    session = AsyncSession(server, sock.getsockname(), "pxelinux.0", options)
+    asyncio.run(session.run())
+    thread.join()
+    sock.close()
+
+
+def test_session_negotiates_options(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.tftp_max_window_size = 4
+    packets: List[bytes] = []
+
+    def client(sock: socket.socket) -> None:
+        packet, addr = sock.recvfrom(65536)
+        packets.append(packet)
+        sock.sendto(struct.pack("!HH", 4, 0), addr)
+        # Both blocks fit into the window.
+        packets.extend(sock.recvfrom(65536)[0] for _ in range(2))
+        sock.sendto(struct.pack("!HH", 4, 2), addr)
+
+    options = {"mode": "octet", "blksize": "1024", "tsize": "0", "windowsize": "8"}
+    _run_session(settings, mocker, tmp_path, options, client)
+
+    assert (
+        packets[0] == b"\x00\x06blksize\x001024\x00tsize\x001280\x00windowsize\x004\x00"
+    )
+    assert [struct.unpack("!HH", packet[:4]) for packet in packets[1:]] == [
+        (3, 1),
+        (3, 2),
+    ]
+    assert [len(packet) - 4 for packet in packets[1:]] == [1024, 256]
+
+
+def test_session_ignores_windowsize(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.tftp_max_window_size = 1
+    packets: List[bytes] = []
+
+    def client(sock: socket.socket) -> None:
+        packet, addr = sock.recvfrom(65536)
+        packets.append(packet)
+        sock.sendto(struct.pack("!HH", 5, 0) + b"done\x00", addr)
+
+    options = {"mode": "octet", "blksize": "100000", "windowsize": "8"}
+    _run_session(settings, mocker, tmp_path, options, client)
+
+    assert packets == [b"\x00\x06blksize\x0065464\x00"]
+
+
+def test_session_retransmits_on_lost_ack(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.tftp_timeout = 1
+    numbers: List[int] = []
+
+    def client(sock: socket.socket) -> None:
+        dropped = False
+        while True:
+            packet, addr = sock.recvfrom(65536)
+            number = struct.unpack("!HH", packet[:4])[1]
+            numbers.append(number)
+            if number == 2 and not dropped:
+                # The ACK of the second block is lost.
+                dropped = True
+                continue
+            sock.sendto(struct.pack("!HH", 4, number), addr)
+            if len(packet) - 4 < 512:
+                return
+
+    _run_session(settings, mocker, tmp_path, {"mode": "octet"}, client)
+
+    assert numbers == [1, 2, 2, 3]
+
+
+@pytest.mark.parametrize("option", ["blksize", "timeout", "windowsize"])
+def test_session_malformed_option(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path, option: str
+):
+    settings.tftp_max_window_size = 16
+    packets: List[bytes] = []
+
+    _run_session(
+        settings,
+        mocker,
+        tmp_path,
+        {"mode": "octet", option: "many"},
+        lambda sock: packets.append(sock.recvfrom(65536)[0]),
+    )
+
+    assert _parse_error(packets[0]) == (8, f"Invalid value for {option}: 'many'")
+
+
+def test_session_clamps_timeout(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    packets: List[bytes] = []
+
+    def client(sock: socket.socket) -> None:
+        packet, addr = sock.recvfrom(65536)
+        packets.append(packet)
+        sock.sendto(struct.pack("!HH", 5, 0) + b"done\x00", addr)
+
+    _run_session(
+        settings, mocker, tmp_path, {"mode": "octet", "timeout": "1000"}, client
+    )
+
+    assert packets == [b"\x00\x06timeout\x00255\x00"]
+
+
+def test_session_short_packet(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    packets: List[bytes] = []
+
+    def client(sock: socket.socket) -> None:
+        _, addr = sock.recvfrom(65536)
+        sock.sendto(b"\x00\x04", addr)
+        packets.append(sock.recvfrom(65536)[0])
+
+    _run_session(settings, mocker, tmp_path, {"mode": "octet"}, client)
+
+    assert _parse_error(packets[0]) == (4, "Packet too short")
+
+
+def test_session_unexpected_opcode(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    packets: List[bytes] = []
+
+    def client(sock: socket.socket) -> None:
+        _, addr = sock.recvfrom(65536)
+        sock.sendto(struct.pack("!HH", 3, 1) + b"data", addr)
+        packets.append(sock.recvfrom(65536)[0])
+
+    _run_session(settings, mocker, tmp_path, {"mode": "octet"}, client)
+
+    assert _parse_error(packets[0]) == (4, "I only do reads, really")
+
+
+def test_session_read_error(settings: Settings, mocker: MockerFixture, tmp_path: Path):
+    packets: List[bytes] = []
+    response = mocker.Mock()
+    response.size.return_value = 1024
+    response.read.side_effect = [b"x" * 512, EOFError("No data")]
+
+    def client(sock: socket.socket) -> None:
+        packet, addr = sock.recvfrom(65536)
+        packets.append(packet)
+        sock.sendto(struct.pack("!HH", 4, 1), addr)
+        packets.append(sock.recvfrom(65536)[0])
+
+    stats_cb = mocker.patch("cobbler_tftp.server.aio.handler_stats_cb")
+    _run_session(
+        settings, mocker, tmp_path, {"mode": "octet"}, client, response=response
+    )
+
+    assert struct.unpack("!HH", packets[0][:4]) == (3, 1)
+    assert _parse_error(packets[1]) == (0, "Error while reading from source")
+    assert stats_cb.call_args[0][0].error == {
+        "error_code": 0,
+        "error_message": "Error while reading from source",
+    }
+    response.close.assert_called_once()
+
+
+def test_session_transfer(settings: Settings, mocker: MockerFixture, tmp_path: Path):
+    blocks: List[bytes] = []
+
+    _run_session(
+        settings,
+        mocker,
+        tmp_path,
+        {"mode": "octet"},
+        lambda sock: _receive(sock, blocks),
+    )
+
+    assert b"".join(blocks) == bytes(range(256)) * 5
+    assert [len(block) for block in blocks] == [512, 512, 256]
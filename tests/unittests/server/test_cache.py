@@ -0,0 +1,315 @@
+"""
+Tests for the shared file cache.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from cobbler_tftp.server.cache import (
+    INDEX_FILE,
+    FileCacheIndex,
+    Flight,
+    FlightRegistry,
+    SharedFileCache,
+)
+from cobbler_tftp.settings import Settings
+
+
+def make_entry(directory: Path, name: str, size: int) -> str:
+    (directory / name).write_bytes(b"x" * size)
+    return name
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def store(cache: SharedFileCache, path: str, chunks: List[bytes], size: int) -> None:
+    cache_file = cache.create_file(path)
+    assert cache_file is not None
+    for chunk in chunks:
+        cache_file.write(chunk)
+    cache.store(path, cache_file, size)
+
+
+def test_lookup_miss(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60)
+
+    assert index.lookup("pxelinux.0") is None
+    assert index.stats()["misses"] == 1
+
+
+def test_insert_and_lookup(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60)
+
+    assert index.insert("pxelinux.0", make_entry(tmp_path, "a", 10), 10)
+
+    assert index.lookup("pxelinux.0") == ("a", 10)
+    assert index.stats() == {"entries": 1, "size": 10, "hits": 1, "misses": 0}
+
+
+def test_insert_evicts_least_recently_used(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60)
+    index.insert("a", make_entry(tmp_path, "a", 40), 40)
+    index.insert("b", make_entry(tmp_path, "b", 40), 40)
+    index.lookup("a")
+
+    index.insert("c", make_entry(tmp_path, "c", 40), 40)
+
+    assert index.lookup("b") is None
+    assert index.lookup("a") is not None
+    assert not (tmp_path / "b").exists()
+
+
+def test_insert_rejects_oversized(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60)
+
+    assert not index.insert("a", make_entry(tmp_path, "a", 101), 101)
+    assert not (tmp_path / "a").exists()
+
+
+def test_lookup_expired(tmp_path: Path, mocker):
+    index = FileCacheIndex(str(tmp_path), 100, 60)
+    monotonic = mocker.patch("cobbler_tftp.server.cache.time.monotonic")
+    monotonic.return_value = 0.0
+    index.insert("a", make_entry(tmp_path, "a", 10), 10)
+
+    monotonic.return_value = 61.0
+
+    assert index.lookup("a") is None
+    assert index.stats()["size"] == 0
+
+
+@pytest.fixture
+def shared_cache(settings: Settings, tmp_path: Path):
+    settings.cache_max_size = 1024
+    settings.cache_max_file_size = 512
+    settings.cache_dir = tmp_path
+    cache = SharedFileCache(settings)
+    yield cache
+    cache.close()
+
+
+def test_shared_cache_store(shared_cache: SharedFileCache):
+    cache_file = shared_cache.create_file("pxelinux.0")
+    assert cache_file is not None
+    cache_file.write(b"abc")
+
+    # Files being written are not visible.
+    assert shared_cache.lookup("pxelinux.0") is None
+
+    cache_file.write(b"def")
+    shared_cache.store("pxelinux.0", cache_file, 6)
+    cached_path = shared_cache.lookup("pxelinux.0")
+
+    assert cached_path is not None
+    assert cached_path.read_bytes() == b"abcdef"
+    assert not list(shared_cache.directory.glob("*.tmp"))
+
+
+def test_shared_cache_store_incomplete(shared_cache: SharedFileCache):
+    store(shared_cache, "pxelinux.0", [b"abc"], 6)
+
+    assert shared_cache.lookup("pxelinux.0") is None
+    assert not list(shared_cache.directory.iterdir())
+
+
+def test_shared_cache_store_too_large(shared_cache: SharedFileCache):
+    store(shared_cache, "initrd", [b"x" * 513], 513)
+
+    assert shared_cache.lookup("initrd") is None
+
+
+def test_persistent_index_survives_restart(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60, True)
+    index.insert("a", make_entry(tmp_path, "a" * 32, 10), 10, sha256(b"x" * 10))
+    index.insert("b", make_entry(tmp_path, "b" * 32, 10), 10, sha256(b"x" * 10))
+    index.insert("e", make_entry(tmp_path, "e" * 32, 10), 10, sha256(b"x" * 10))
+    index.save()
+    (tmp_path / ("b" * 32)).write_bytes(b"y" * 10)
+    (tmp_path / ("e" * 32)).write_bytes(b"x" * 5)
+    make_entry(tmp_path, "c" * 32, 10)
+    make_entry(tmp_path, "d" * 32 + ".tmp", 10)
+    make_entry(tmp_path, "unrelated", 10)
+
+    index = FileCacheIndex(str(tmp_path), 100, 60, True)
+
+    # Files with another size are removed while loading
+    assert not (tmp_path / ("e" * 32)).exists()
+    assert index.stats()["entries"] == 2
+    assert index.lookup("a") == ("a" * 32, 10)
+    # Damaged files are removed with their first hit
+    assert index.lookup("b") is None
+    assert not (tmp_path / ("b" * 32)).exists()
+    # Files missing in the index are removed
+    assert not (tmp_path / ("c" * 32)).exists()
+    assert not (tmp_path / ("d" * 32 + ".tmp")).exists()
+    assert (tmp_path / "unrelated").exists()
+
+
+def test_persistent_index_saves_changes_together(tmp_path: Path):
+    index = FileCacheIndex(str(tmp_path), 100, 60, True)
+    index.insert("a", make_entry(tmp_path, "a" * 32, 10), 10, sha256(b"x" * 10))
+    index.insert("b", make_entry(tmp_path, "b" * 32, 10), 10, sha256(b"x" * 10))
+
+    # Only the index loaded at startup was written so far
+    assert json.loads((tmp_path / INDEX_FILE).read_text()) == {"entries": []}
+    index.save()
+
+    entries = json.loads((tmp_path / INDEX_FILE).read_text())["entries"]
+    assert [entry["path"] for entry in entries] == ["a", "b"]
+
+
+def test_persistent_shared_cache(settings: Settings, tmp_path: Path):
+    settings.cache_max_size = 1024
+    settings.cache_max_file_size = 512
+    settings.cache_dir = tmp_path
+    settings.cache_persistent = True
+    cache = SharedFileCache(settings)
+    store(cache, "pxelinux.0", [b"abc"], 3)
+    second = SharedFileCache(settings)
+    # The directory is locked by the first cache
+    assert second.directory != tmp_path
+    second.close()
+    cache.close()
+
+    cache = SharedFileCache(settings)
+    cached_path = cache.lookup("pxelinux.0")
+    cache.close()
+
+    assert cache.directory == tmp_path
+    assert cached_path is not None
+    assert cached_path.read_bytes() == b"abc"
+
+
+def test_flight_registry_leader_and_followers():
+    registry = FlightRegistry(0.1, 1024)
+
+    leader_id, leader = registry.join("initrd")
+    follower_id, follower = registry.join("initrd")
+
+    assert leader == 0
+    assert follower != 0
+    assert leader_id == follower_id
+    assert registry.active() == ["initrd"]
+
+
+def test_flight_registry_read_published_chunk():
+    registry = FlightRegistry(0.1, 1024)
+    flight_id, _ = registry.join("initrd")
+    _, follower = registry.join("initrd")
+
+    assert registry.publish(flight_id, 0, b"abc", 6)
+
+    assert registry.read(flight_id, follower, 1) == (b"bc", 6)
+    assert registry.read(flight_id, follower, 3) is None
+    # Chunks all followers read are dropped
+    assert registry.memory() == 0
+
+
+def test_flight_registry_keeps_chunks_for_all_followers():
+    registry = FlightRegistry(0.1, 1024)
+    flight_id, _ = registry.join("initrd")
+    _, first = registry.join("initrd")
+    _, second = registry.join("initrd")
+    registry.publish(flight_id, 0, b"abc", 6)
+
+    assert registry.read(flight_id, first, 0) == (b"abc", 6)
+    assert registry.memory() == 3
+    registry.leave(flight_id, second)
+    assert registry.memory() == 0
+
+
+def test_flight_registry_republished_chunk():
+    registry = FlightRegistry(0.1, 4)
+    flight_id, _ = registry.join("initrd")
+    registry.join("initrd")
+
+    assert registry.publish(flight_id, 0, b"abc", 6)
+    # Replaces the first chunk instead of adding to the memory.
+    assert registry.publish(flight_id, 0, b"abc", 6)
+
+    assert registry.memory() == 3
+
+
+def test_flight_registry_chunks_out_of_order():
+    registry = FlightRegistry(0.1, 1024)
+    flight_id, _ = registry.join("initrd")
+    _, follower = registry.join("initrd")
+
+    # Read ahead chunks may arrive before earlier ones.
+    registry.publish(flight_id, 3, b"def", 9)
+    registry.publish(flight_id, 0, b"abc", 9)
+    registry.publish(flight_id, 6, b"ghi", 9)
+
+    assert registry.read(flight_id, follower, 0) == (b"abc", 9)
+    assert registry.memory() == 6
+    assert registry.read(flight_id, follower, 3) == (b"def", 9)
+    assert registry.memory() == 3
+
+
+def test_flight_registry_late_follower():
+    registry = FlightRegistry(0.1, 1024)
+    flight_id, _ = registry.join("initrd")
+
+    # Without followers, the contents are not sent
+    assert not registry.skip(flight_id, 0, 3)
+    _, follower = registry.join("initrd")
+    assert registry.publish(flight_id, 3, b"def", 6)
+
+    # The follower fetches the chunks before it joined on its own
+    assert registry.read(flight_id, follower, 0) == (b"", 6)
+    assert registry.read(flight_id, follower, 3) == (b"def", 6)
+
+
+def test_flight_registry_memory_limit():
+    registry = FlightRegistry(10, 4)
+    flight_id, _ = registry.join("initrd")
+    _, follower = registry.join("initrd")
+
+    assert registry.publish(flight_id, 0, b"abc", 6)
+    assert not registry.publish(flight_id, 3, b"def", 6)
+
+    # The follower falls back to fetching on its own
+    assert registry.read(flight_id, follower, 0) is None
+    assert registry.memory() == 0
+    # New sessions start a new flight
+    assert registry.join("initrd")[1] == 0
+
+
+def test_flight_registry_finish():
+    registry = FlightRegistry(10, 1024)
+    flight_id, _ = registry.join("initrd")
+    _, follower = registry.join("initrd")
+    registry.publish(flight_id, 0, b"abcdef", 12)
+
+    registry.finish(flight_id)
+
+    # Followers still get the published chunks, but do not wait for others
+    assert registry.read(flight_id, follower, 3) == (b"def", 12)
+    assert registry.read(flight_id, follower, 6) is None
+    # New sessions start a new flight
+    assert registry.join("initrd")[1] == 0
+
+
+def test_flight_follower_fetches_missed_chunks():
+    registry = FlightRegistry(0.1, 1024)
+    leader = Flight(registry, "initrd")
+    leader.publish(0, b"abc", 9)
+    follower = Flight(registry, "initrd")
+    assert registry.memory() == 0
+
+    leader.publish(3, b"def", 9)
+    leader.publish(6, b"ghi", 9)
+
+    assert follower.read(0) is None
+    assert follower.read(3) is None
+    assert not follower.closed
+    assert follower.read(6) == (b"ghi", 9)
+    leader.close()
+    follower.close()
+    assert registry.active() == []
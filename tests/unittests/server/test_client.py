@@ -0,0 +1,196 @@
+"""
+Tests for the Cobbler API client pool and token manager.
+"""
+
+import time
+import xmlrpc.client
+from typing import TYPE_CHECKING
+
+import pytest
+
+from cobbler_tftp.server.client import (
+    CobblerClientPool,
+    HTTPFileServerProxy,
+    KeepAliveTransport,
+    SafeKeepAliveTransport,
+    TokenManager,
+    is_missing_file,
+)
+from cobbler_tftp.settings import Settings
+from tests.unittests.server.conftest import FILE_CONTENT
+
+if TYPE_CHECKING:
+    import pytest_mock
+
+
+def test_pool_reuses_clients():
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+
+    with pool.client() as first:
+        pass
+    with pool.client() as second:
+        pass
+
+    assert first is second
+
+
+def test_pool_limits_idle_clients():
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+
+    with pool.client() as first:
+        with pool.client() as second:
+            pass
+
+    with pool.client() as third:
+        assert third is second
+        with pool.client() as fourth:
+            assert fourth is not first
+
+
+def test_pool_discards_client_on_error():
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+
+    with pytest.raises(OSError):
+        with pool.client() as first:
+            raise OSError()
+
+    with pool.client() as second:
+        assert second is not first
+
+
+@pytest.mark.parametrize(
+    "uri,transport_type",
+    [
+        ("http://localhost/cobbler_api", KeepAliveTransport),
+        ("https://localhost/cobbler_api", SafeKeepAliveTransport),
+    ],
+)
+def test_pool_transport_type(uri: str, transport_type: type):
+    pool = CobblerClientPool(uri, 1)
+
+    with pool.client() as api:
+        assert isinstance(api("transport"), transport_type)
+
+
+def test_pool_fetches_files_over_http(file_server: str):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1, file_server)
+
+    with pool.client() as api:
+        assert isinstance(api, HTTPFileServerProxy)
+        first, size = api.get_tftp_file("grub/grub.cfg", 0, 1024, "token")
+        second, _ = api.get_tftp_file("grub/grub.cfg", 1024, 4096, "token")
+        end, _ = api.get_tftp_file("grub/grub.cfg", 2048, 1024, "token")
+        with pytest.raises(xmlrpc.client.Fault):
+            api.get_tftp_file("missing", 0, 1024, "token")
+    pool.close()
+
+    assert size == len(FILE_CONTENT)
+    assert first.data + second.data == FILE_CONTENT
+    assert end.data == b""
+
+
+def test_pool_fetches_file_size_over_http(file_server: str):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1, file_server)
+
+    with pool.client() as api:
+        data, size = api.get_tftp_file("grub/../grub/grub.cfg", 0, 0, "token")
+        plain, plain_size = api.get_tftp_file("plain.cfg", 0, 0, "token")
+    pool.close()
+
+    assert (data.data, size) == (b"", len(FILE_CONTENT))
+    assert (plain.data, plain_size) == (b"", len(FILE_CONTENT))
+
+
+def test_pool_rejects_ignored_ranges_over_http(file_server: str):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1, file_server)
+
+    with pool.client() as api:
+        first, size = api.get_tftp_file("/../plain.cfg", 0, 1024, "token")
+        with pytest.raises(xmlrpc.client.ProtocolError):
+            api.get_tftp_file("plain.cfg", 1024, 1024, "token")
+    pool.close()
+
+    assert first.data == FILE_CONTENT[:1024]
+    assert size == len(FILE_CONTENT)
+
+
+def test_transport_drops_inherited_connection(mocker: "pytest_mock.MockerFixture"):
+    transport = KeepAliveTransport()
+    inherited = transport.make_connection("localhost")
+    assert transport.make_connection("localhost") is inherited
+
+    mocker.patch("cobbler_tftp.server.client.os.getpid", return_value=-1)
+
+    assert transport.make_connection("localhost") is not inherited
+
+
+def test_token_manager_logs_in_once(
+    settings: Settings, mocker: "pytest_mock.MockerFixture"
+):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+    api = mocker.MagicMock()
+    api.login.return_value = "token"
+    mocker.patch.object(pool, "client").return_value.__enter__.return_value = api
+
+    tokens = TokenManager(pool, settings)
+
+    assert tokens.token() == "token"
+    assert tokens.token() == "token"
+    api.login.assert_called_once_with(settings.user, settings.password)
+    tokens.close()
+    api.logout.assert_called_once_with("token")
+
+
+def test_token_manager_refreshes_inherited_token_by_age(
+    settings: Settings, mocker: "pytest_mock.MockerFixture"
+):
+    settings.token_refresh_interval = 60
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+    api = mocker.MagicMock()
+    api.login.side_effect = ["token", "refreshed"]
+    mocker.patch.object(pool, "client").return_value.__enter__.return_value = api
+    tokens = TokenManager(pool, settings)
+    assert tokens.token() == "token"
+
+    # A process forked when the token is due for a refresh
+    tokens._token_time -= 60  # type: ignore
+    mocker.patch("cobbler_tftp.server.client.os.getpid", return_value=-1)
+    tokens.token()
+    deadline = time.monotonic() + 5
+    while api.login.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert api.login.call_count == 2
+    tokens.close()
+
+
+def test_token_manager_login_error(
+    settings: Settings, mocker: "pytest_mock.MockerFixture"
+):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1)
+    api = mocker.MagicMock()
+    api.login.side_effect = xmlrpc.client.Fault(1, "login failed")
+    mocker.patch.object(pool, "client").return_value.__enter__.return_value = api
+
+    tokens = TokenManager(pool, settings)
+
+    with pytest.raises(xmlrpc.client.Fault):
+        tokens.token()
+    tokens.close()
+
+
+@pytest.mark.parametrize(
+    "message,missing",
+    [
+        ("File not found: pxelinux.cfg/default", True),
+        (
+            "<class 'FileNotFoundError'>:[Errno 2] No such file or directory: "
+            "'/srv/tftpboot/pxelinux.cfg/default'",
+            True,
+        ),
+        ("<class 'cobbler.cexceptions.CX'>:'invalid token: 1234'", False),
+        ("<class 'PermissionError'>:[Errno 13] Permission denied", False),
+    ],
+)
+def test_is_missing_file(message: str, missing: bool):
+    assert is_missing_file(xmlrpc.client.Fault(1, message)) == missing
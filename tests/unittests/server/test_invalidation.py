@@ -0,0 +1,108 @@
+"""
+Tests for the cache invalidation.
+"""
+
+import email.utils
+import time
+import xmlrpc.client
+from typing import TYPE_CHECKING, Tuple
+
+import pytest
+
+from cobbler_tftp.server.client import HTTPFileServerProxy, KeepAliveTransport
+from cobbler_tftp.server.invalidation import CacheInvalidator
+from cobbler_tftp.settings import Settings
+from tests.unittests.server.conftest import FILE_MODIFIED
+
+if TYPE_CHECKING:
+    import pytest_mock
+
+
+def test_poll_revalidates_cache(
+    settings: Settings, mocker: "pytest_mock.MockerFixture"
+):
+    settings.cache_invalidation_interval = 3600
+    settings.cache_volatile_paths = ["pxelinux.cfg/*"]
+    sizes = {"vmlinuz": 100, "initrd": 300}
+
+    def get_tftp_file(
+        path: str, offset: int, size: int, token: str
+    ) -> Tuple[bytes, int]:
+        if path not in sizes:
+            raise xmlrpc.client.Fault(1, "not found")
+        return b"", sizes[path]
+
+    cache = mocker.Mock()
+    cache.entries.return_value = {
+        "vmlinuz": (100, 0.0),
+        "initrd": (200, 0.0),
+        "pxelinux.cfg/default": (10, 0.0),
+        "removed": (10, 0.0),
+    }
+    pool = mocker.MagicMock()
+    api = pool.client.return_value.__enter__.return_value
+    api.last_modified_time.return_value = 1.0
+    api.get_tftp_file.side_effect = get_tftp_file
+    invalidator = CacheInvalidator(cache, pool, mocker.Mock(), settings)
+
+    invalidator.poll()
+    invalidated = {call.args[0] for call in cache.invalidate.call_args_list}
+    invalidator.poll()
+    invalidator.close()
+
+    assert invalidated == {"initrd", "pxelinux.cfg/default", "removed"}
+    # Nothing changed since the first poll
+    assert cache.invalidate.call_count == 3
+
+
+def test_poll_keeps_cache_on_other_faults(
+    settings: Settings, mocker: "pytest_mock.MockerFixture"
+):
+    settings.cache_invalidation_interval = 3600
+    settings.cache_volatile_paths = []
+    cache = mocker.Mock()
+    cache.entries.return_value = {"vmlinuz": (100, 0.0), "initrd": (200, 0.0)}
+    pool = mocker.MagicMock()
+    api = pool.client.return_value.__enter__.return_value
+    api.last_modified_time.return_value = 1.0
+    api.get_tftp_file.side_effect = xmlrpc.client.Fault(
+        1, "<class 'cobbler.cexceptions.CX'>:'invalid token: 1234'"
+    )
+    invalidator = CacheInvalidator(cache, pool, mocker.Mock(), settings)
+
+    with pytest.raises(xmlrpc.client.Fault):
+        invalidator.poll()
+    api.get_tftp_file.side_effect = None
+    api.get_tftp_file.return_value = (b"", 100)
+    invalidator.poll()
+    invalidator.close()
+
+    # The failed revalidation is repeated with the next poll.
+    cache.invalidate.assert_called_once_with("initrd")
+
+
+def test_poll_compares_modification_time_over_http(
+    settings: Settings, mocker: "pytest_mock.MockerFixture", file_server: str
+):
+    settings.cache_invalidation_interval = 3600
+    settings.cache_volatile_paths = []
+    modified = email.utils.parsedate_to_datetime(FILE_MODIFIED).timestamp()
+    cache = mocker.Mock()
+    cache.entries.return_value = {
+        # Same size, but fetched before the file was changed
+        "grub/grub.cfg": (2048, modified - 60),
+        "grub/../grub/grub.cfg": (2048, time.time()),
+    }
+    api = HTTPFileServerProxy(
+        "http://localhost/cobbler_api", file_server, KeepAliveTransport()
+    )
+    mocker.patch.object(api, "last_modified_time", return_value=1.0)
+    pool = mocker.MagicMock()
+    pool.client.return_value.__enter__.return_value = api
+    invalidator = CacheInvalidator(cache, pool, mocker.Mock(), settings)
+
+    invalidator.poll()
+    invalidator.close()
+    api("close")()
+
+    cache.invalidate.assert_called_once_with("grub/grub.cfg")
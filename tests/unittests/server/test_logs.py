@@ -0,0 +1,137 @@
+"""
+Tests for the batched logging mode.
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import threading
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from cobbler_tftp.server import logs
+from cobbler_tftp.server.logs import CATEGORY_MISS, BatchingHandler, JSONFormatter
+
+
+@pytest.fixture
+def logger() -> Iterator[logging.Logger]:
+    """
+    Fixture that represents a logger whose records do not reach the root
+    logger.
+    """
+    test_logger = logging.getLogger("cobbler_tftp.tests")
+    test_logger.propagate = False
+    test_logger.setLevel(logging.DEBUG)
+    yield test_logger
+    for handler in list(test_logger.handlers):
+        test_logger.removeHandler(handler)
+        handler.close()
+
+
+def test_batching_handler_json(logger: logging.Logger):
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(JSONFormatter())
+    handler = BatchingHandler([target], flush_interval=60)
+    logger.addHandler(handler)
+
+    logger.info("Phases of %r", "pxelinux.0", extra={"phases": {"resolve": 0.5}})
+    assert stream.getvalue() == ""
+    handler.flush()
+
+    (line,) = stream.getvalue().splitlines()
+    record = json.loads(line)
+    assert record["message"] == "Phases of 'pxelinux.0'"
+    assert record["level"] == "INFO"
+    assert record["phases"] == {"resolve": 0.5}
+
+
+def test_batching_handler_rate_limit(logger: logging.Logger):
+    stream = io.StringIO()
+    handler = BatchingHandler(
+        [logging.StreamHandler(stream)],
+        flush_interval=60,
+        rate_limits={CATEGORY_MISS: 2},
+    )
+    logger.addHandler(handler)
+
+    for index in range(5):
+        logger.warning("Missing %d", index, extra={"category": CATEGORY_MISS})
+    logger.warning("Not limited")
+    handler.flush()
+
+    assert stream.getvalue().splitlines() == [
+        "Missing 0",
+        "Missing 1",
+        "Not limited",
+        "Dropped 3 log records (miss)",
+    ]
+
+
+def _log_in_child(logger: logging.Logger) -> None:
+    logger.info("From the child")
+
+
+def test_batching_handler_flushes_in_child(logger: logging.Logger, tmp_path: Path):
+    log_file = tmp_path / "cobbler-tftp.log"
+    handler = BatchingHandler([logging.FileHandler(log_file)], flush_interval=60)
+    logger.addHandler(handler)
+
+    logger.info("Before the fork")
+    child = multiprocessing.Process(target=_log_in_child, args=(logger,))
+    child.start()
+    child.join()
+    lines: List[str] = log_file.read_text().splitlines()
+    handler.flush()
+
+    assert lines == ["From the child"]
+    assert log_file.read_text().splitlines() == ["From the child", "Before the fork"]
+
+
+def _log_missing_in_child(logger: logging.Logger) -> None:
+    for index in range(2):
+        logger.warning("Child missing %d", index, extra={"category": CATEGORY_MISS})
+
+
+def test_batching_handler_rate_limit_shared(logger: logging.Logger, tmp_path: Path):
+    log_file = tmp_path / "cobbler-tftp.log"
+    handler = BatchingHandler(
+        [logging.FileHandler(log_file)],
+        flush_interval=60,
+        rate_limits={CATEGORY_MISS: 1},
+    )
+    logger.addHandler(handler)
+
+    logger.warning("Parent missing", extra={"category": CATEGORY_MISS})
+    child = multiprocessing.Process(target=_log_missing_in_child, args=(logger,))
+    child.start()
+    child.join()
+    handler.flush()
+
+    assert log_file.read_text().splitlines() == [
+        "Dropped 2 log records (miss)",
+        "Parent missing",
+    ]
+
+
+def _log_in_session(logger: logging.Logger, threads: "multiprocessing.Queue[int]"):
+    logs.session_process()
+    logger.info("From the session")
+    threads.put(sum(thread.name == "LogWriter" for thread in threading.enumerate()))
+
+
+def test_batching_handler_session_process(logger: logging.Logger, tmp_path: Path):
+    log_file = tmp_path / "cobbler-tftp.log"
+    handler = BatchingHandler([logging.FileHandler(log_file)], flush_interval=60)
+    logger.addHandler(handler)
+    threads: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+
+    child = multiprocessing.Process(target=_log_in_session, args=(logger, threads))
+    child.start()
+    child.join()
+
+    assert threads.get(timeout=1) == 0
+    assert log_file.read_text().splitlines() == ["From the session"]
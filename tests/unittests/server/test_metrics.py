@@ -0,0 +1,205 @@
+"""
+Tests for the metrics registry and its HTTP endpoint.
+"""
+
+import os
+import urllib.request
+from typing import Iterator
+
+import pytest
+from fbtftp import SessionStats  # type: ignore[reportMissingTypeStubs]
+
+from cobbler_tftp.server import metrics
+from cobbler_tftp.server.metrics import MetricsRegistry, start_metrics_server
+
+
+@pytest.fixture
+def enabled() -> Iterator[None]:
+    """
+    Fixture that enables the metrics of the server.
+    """
+    metrics.REGISTRY.enable()
+    yield
+
+
+def test_registry_render():
+    registry = MetricsRegistry(64, 4)
+    registry.enable()
+    sessions = registry.counter(
+        "sessions_total", "Sessions.", "result", ["ok", "error"]
+    )
+    active = registry.gauge("sessions_active", "Active sessions.")
+    duration = registry.histogram("duration_seconds", "Durations.", [0.1, 1])
+
+    sessions.inc(2, "ok")
+    active.inc()
+    active.inc()
+    active.dec()
+    duration.observe(0.05)
+    duration.observe(0.5)
+    duration.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP sessions_total Sessions.",
+        "# TYPE sessions_total counter",
+        'sessions_total{result="ok"} 2',
+        'sessions_total{result="error"} 0',
+        "# HELP sessions_active Active sessions.",
+        "# TYPE sessions_active gauge",
+        "sessions_active 1",
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{le="0.1"} 1',
+        'duration_seconds_bucket{le="1"} 2',
+        'duration_seconds_bucket{le="+Inf"} 3',
+        "duration_seconds_sum 5.55",
+        "duration_seconds_count 3",
+        "# HELP cobbler_tftp_metrics_dropped_updates_total Metric updates that "
+        "were dropped.",
+        "# TYPE cobbler_tftp_metrics_dropped_updates_total counter",
+        "cobbler_tftp_metrics_dropped_updates_total 0",
+    ]
+
+
+def test_registry_labelled_histogram():
+    registry = MetricsRegistry(64, 4)
+    registry.enable()
+    phases = registry.histogram(
+        "phase_seconds", "Phases.", [1], "phase", ["token", "fetch"]
+    )
+
+    phases.observe(0.5, "fetch")
+    phases.observe(2, "fetch")
+
+    assert registry.render().splitlines()[2:-3] == [
+        'phase_seconds_bucket{phase="token",le="1"} 0',
+        'phase_seconds_bucket{phase="token",le="+Inf"} 0',
+        'phase_seconds_sum{phase="token"} 0',
+        'phase_seconds_count{phase="token"} 0',
+        'phase_seconds_bucket{phase="fetch",le="1"} 1',
+        'phase_seconds_bucket{phase="fetch",le="+Inf"} 2',
+        'phase_seconds_sum{phase="fetch"} 2.5',
+        'phase_seconds_count{phase="fetch"} 2',
+    ]
+
+
+def test_registry_disabled():
+    registry = MetricsRegistry(8, 4)
+    counter = registry.counter("requests_total", "Requests.")
+
+    counter.inc()
+
+    assert "requests_total 0" in registry.render()
+
+
+def test_registry_shared_with_forked_processes():
+    registry = MetricsRegistry(8, 4)
+    registry.enable()
+    counter = registry.counter("requests_total", "Requests.")
+    counter.inc()
+
+    pid = os.fork()
+    if pid == 0:
+        counter.inc(3)
+        os._exit(0)  # pylint: disable=protected-access
+    os.waitpid(pid, 0)
+    counter.inc()
+
+    assert "requests_total 5" in registry.render()
+
+
+def test_registry_survives_killed_process():
+    registry = MetricsRegistry(8, 2)
+    registry.enable()
+    counter = registry.counter("requests_total", "Requests.")
+
+    for _ in range(2):
+        pid = os.fork()
+        if pid == 0:
+            counter.inc()
+            os._exit(0)  # pylint: disable=protected-access
+        os.waitpid(pid, 0)
+    # Both shards belong to processes that exited without releasing them.
+    counter.inc()
+
+    assert "requests_total 3" in registry.render()
+
+
+def test_registry_overflow_shard():
+    registry = MetricsRegistry(8, 1)
+    registry.enable()
+    counter = registry.counter("requests_total", "Requests.")
+    counter.inc()
+
+    for _ in range(2):
+        pid = os.fork()
+        if pid == 0:
+            # The only shard belongs to the parent.
+            counter.inc(2)
+            os._exit(0)  # pylint: disable=protected-access
+        os.waitpid(pid, 0)
+    registry._overflow_lock.acquire()  # type: ignore
+    pid = os.fork()
+    if pid == 0:
+        counter.inc(4)
+        os._exit(0)  # pylint: disable=protected-access
+    os.waitpid(pid, 0)
+    registry._overflow_lock.release()  # type: ignore
+
+    rendered = registry.render()
+    assert "requests_total 5" in rendered
+    assert "cobbler_tftp_metrics_dropped_updates_total 1" in rendered
+
+
+def _sample(name: str) -> float:
+    for line in metrics.REGISTRY.render().splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    raise KeyError(name)
+
+
+def test_record_session(enabled: None):
+    stats = SessionStats(("127.0.0.1", 69), ("127.0.0.1", 1234), "pxelinux.0")
+    stats.error = {"error_code": 1, "error_message": "File not found"}
+    stats.first_data_time = None
+    name = 'cobbler_tftp_sessions_total{result="file_not_found"}'
+    before = _sample(name)
+
+    metrics.record_session(stats)
+
+    assert _sample(name) == before + 1
+
+
+def test_session_phases():
+    stats = SessionStats(("127.0.0.1", 69), ("127.0.0.1", 1234), "pxelinux.0")
+    stats.request_time = 100.0
+    stats.token_time = 100.5
+    stats.resolved_time = 102.0
+    stats.fetch_durations = [1.0, 0.25, 0.25]
+    stats.first_data_time = 102.25
+    stats.last_data_time = 105.0
+    stats.last_ack_time = None
+
+    assert metrics.session_phases(stats) == {
+        "token": 0.5,
+        "resolve": 1.5,
+        "first_data": 0.25,
+        "first_fetch": 1.0,
+        "fetch": 1.5,
+    }
+
+
+def test_metrics_endpoint(enabled: None):
+    metrics.REQUESTS.inc()
+    server = start_metrics_server("127.0.0.1", 0)
+
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode("UTF-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "# TYPE cobbler_tftp_requests_total counter" in body
+    assert "cobbler_tftp_requests_total 0" not in body
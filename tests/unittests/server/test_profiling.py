@@ -0,0 +1,94 @@
+"""
+Tests for the sampling session profiler.
+"""
+
+import pstats
+import socket
+from pathlib import Path
+from typing import Dict, Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cobbler_tftp.server import profiling
+from cobbler_tftp.server.profiling import SessionProfiler
+from cobbler_tftp.server.tftp import CobblerRequestHandler
+from cobbler_tftp.settings import Settings
+
+
+@pytest.fixture
+def profiler(settings: Settings, tmp_path: Path) -> Iterator[SessionProfiler]:
+    """
+    Fixture that represents a profiler sampling every session, with profiling
+    switched on.
+    """
+    settings.profiling_dir = tmp_path
+    settings.profiling_sample_rate = 1
+    profiling.enable()
+    yield SessionProfiler(settings)
+    profiling.disable()
+
+
+def _calls(path: Path) -> Dict[str, int]:
+    stats = pstats.Stats(str(path))
+    return {
+        name: values[1] for (_, _, name), values in stats.stats.items()  # type: ignore
+    }
+
+
+def test_profiler_samples_only_when_enabled(profiler: SessionProfiler):
+    profiling.toggle(profiling.PROFILE_SIGNAL, None)
+
+    assert not profiling.is_enabled()
+    assert profiler.sample() is None
+
+    profiling.toggle(profiling.PROFILE_SIGNAL, None)
+
+    assert profiling.is_enabled()
+    assert profiler.sample() is not None
+
+
+def test_profiler_aggregates_sessions(profiler: SessionProfiler, tmp_path: Path):
+    for _ in range(2):
+        profile = profiler.sample()
+        assert profile is not None
+        profile.enable()
+        sorted(range(10))
+        profile.disable()
+        profiler.dump(profile)
+
+    (path,) = tmp_path.glob("*.prof")
+    assert _calls(path)["<built-in method builtins.sorted>"] == 2
+
+
+def test_handler_profiles_session(
+    settings: Settings,
+    profiler: SessionProfiler,
+    mocker: MockerFixture,
+    tmp_path: Path,
+):
+    resolver = mocker.Mock()
+    resolver.resolve.side_effect = FileNotFoundError("pxelinux.0")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    options = {"mode": "octet", "default_timeout": 1, "retries": 5}
+    handler = CobblerRequestHandler(
+        ("127.0.0.1", 0),
+        sock.getsockname(),
+        "pxelinux.0",
+        options,
+        mocker.Mock(),
+        "token",
+        settings,
+        resolver,
+        profiler,
+    )
+
+    with pytest.raises(SystemExit):
+        handler.run()
+    sock.close()
+
+    (path,) = tmp_path.glob("*.prof")
+    calls = _calls(path)
+    assert calls["get_response_data"] == 1
+    assert calls["_transmit_error"] == 1
@@ -0,0 +1,53 @@
+"""
+Tests for the index of the static fallback directory.
+"""
+
+import time
+from pathlib import Path
+
+from cobbler_tftp.server.static import StaticIndex
+
+
+def _wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_index_lookup(tmp_path: Path):
+    (tmp_path / "grub").mkdir()
+    (tmp_path / "grub" / "grubx64.efi").write_bytes(b"grub")
+    index = StaticIndex(tmp_path)
+
+    try:
+        entry = index.get("grub/grubx64.efi")
+        assert entry is not None
+        assert entry.size == 4
+        assert index.get("grub") is None
+        assert index.get("missing") is None
+        assert _wait_for(lambda: index._ready)  # type: ignore[reportPrivateUsage]
+        assert index.get("grub/grubx64.efi") == entry
+        assert index.get("grub") is None
+        assert index.get("missing") is None
+    finally:
+        index.close()
+
+
+def test_index_follows_changes(tmp_path: Path):
+    index = StaticIndex(tmp_path)
+
+    try:
+        assert index.get("pxelinux.0") is None
+        assert _wait_for(lambda: index._ready)  # type: ignore[reportPrivateUsage]
+        (tmp_path / "pxelinux.0").write_bytes(b"pxe")
+        (tmp_path / "grub").mkdir()
+        (tmp_path / "grub" / "grub.cfg").write_bytes(b"cfg")
+        assert _wait_for(lambda: index.get("pxelinux.0") is not None)
+        assert _wait_for(lambda: index.get("grub/grub.cfg") is not None)
+        (tmp_path / "pxelinux.0").unlink()
+        assert _wait_for(lambda: index.get("pxelinux.0") is None)
+    finally:
+        index.close()
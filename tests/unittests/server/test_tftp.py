@@ -0,0 +1,506 @@
+"""
+Tests for the TFTP request handler.
+"""
+
+import logging
+import signal
+import socket
+import struct
+import threading
+import time
+import xmlrpc.client
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cobbler_tftp.server import _supervise_listeners, metrics, start_listener
+from cobbler_tftp.server.client import CobblerClientPool
+from cobbler_tftp.server.tftp import (
+    ChunkSizer,
+    CobblerRequestHandler,
+    CobblerResponseData,
+    FileResponseData,
+    MappedResponseData,
+    ResponseResolver,
+    TFTPServer,
+    handler_stats_cb,
+    open_file,
+)
+from cobbler_tftp.settings import Settings
+from tests.unittests.server.conftest import FILE_CONTENT
+
+
+def _receive_window(sock: socket.socket, blocks: List[bytes], drop: int) -> None:
+    """Download a file with a window of 4 blocks, dropping one block once."""
+    packet, addr = sock.recvfrom(65536)
+    assert packet == struct.pack("!H", 6) + b"windowsize\x004\x00"
+    sock.sendto(struct.pack("!HH", 4, 0), addr)
+    while True:
+        packet, addr = sock.recvfrom(65536)
+        block_number = struct.unpack("!HH", packet[:4])[1]
+        if block_number == drop:
+            drop = -1
+            continue
+        if block_number != len(blocks) + 1:
+            continue
+        blocks.append(packet[4:])
+        last = len(packet) - 4 < 512
+        if last or block_number % 4 == 0:
+            sock.sendto(struct.pack("!HH", 4, block_number), addr)
+        if last:
+            return
+
+
+def _active_sessions() -> float:
+    for line in metrics.REGISTRY.render().splitlines():
+        if line.startswith("cobbler_tftp_sessions_active "):
+            return float(line.split()[-1])
+    raise KeyError("cobbler_tftp_sessions_active")
+
+
+def test_handler_windowsize(settings: Settings, mocker: MockerFixture, tmp_path: Path):
+    settings.tftp_max_window_size = 4
+    settings.tftp_timeout = 1
+    content = bytes(range(256)) * 20
+    (tmp_path / "pxelinux.0").write_bytes(content)
+    resolver = mocker.Mock()
+    resolver.resolve.return_value = FileResponseData(tmp_path / "pxelinux.0")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+    blocks: List[bytes] = []
+    client = threading.Thread(target=_receive_window, args=(sock, blocks, 6))
+    client.start()
+    options = {"mode": "octet", "default_timeout": 1, "retries": 5, "windowsize": "8"}
+    handler = CobblerRequestHandler(
+        ("127.0.0.1", 0),
+        sock.getsockname(),
+        "pxelinux.0",
+        options,
+        mocker.Mock(),
+        "token",
+        settings,
+        resolver,
+    )
+
+    metrics.REGISTRY.enable()
+    active = _active_sessions()
+
+    with pytest.raises(SystemExit):
+        handler.run()
+    client.join()
+    sock.close()
+
+    assert b"".join(blocks) == content
+    # The gauge is increased and decreased while the session is served.
+    assert _active_sessions() == active
+    assert handler._stats.options == {"windowsize": "4"}  # type: ignore
+    phases = metrics.session_phases(handler._stats)  # type: ignore
+    assert set(phases) == {"token", "resolve", "first_data", "last_ack"}
+
+
+def test_handler_stats_phases(mocker: MockerFixture, caplog: pytest.LogCaptureFixture):
+    stats = mocker.Mock(
+        spec=["duration", "file_path", "peer", "error", "bytes_sent", "retransmits"],
+        file_path="pxelinux.0",
+        peer=("127.0.0.1", 1234),
+        error={},
+        bytes_sent=512,
+        retransmits=0,
+    )
+    stats.duration.return_value = 0.5
+    stats.request_time, stats.resolved_time = 10.0, 10.25
+    caplog.set_level(logging.INFO)
+
+    handler_stats_cb(stats)
+
+    assert [record.levelno for record in caplog.records] == [logging.INFO] * 2
+    assert caplog.records[0].phases == {"resolve": 0.25}  # type: ignore
+
+    caplog.clear()
+    caplog.set_level(logging.DEBUG)
+    handler_stats_cb(stats)
+
+    assert (
+        caplog.records[-1].getMessage()
+        == "Phases of 'pxelinux.0': resolve 250.000000ms"
+    )
+
+
+def test_listeners_share_port(settings: Settings):
+    settings.tftp_addr = "127.0.0.1"
+    settings.cache_max_size = 0
+    settings.tftp_listeners = 2
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(("127.0.0.1", 0))
+    settings.tftp_port = probe.getsockname()[1]
+    probe.close()
+
+    servers = [TFTPServer(settings), TFTPServer(settings)]
+
+    for server in servers:
+        assert server._listener.getsockname()[1] == settings.tftp_port  # type: ignore
+        server._listener.close()  # type: ignore
+
+
+def test_supervisor_gives_up_on_failing_listeners(
+    settings: Settings, mocker: MockerFixture
+):
+    # Not assigned to this host, so the listeners fail to bind.
+    settings.tftp_addr = "192.0.2.1"
+    settings.tftp_listeners = 2
+    mocker.patch("cobbler_tftp.server.LISTENER_MAX_FAILURES", 3)
+    starts = mocker.patch(
+        "cobbler_tftp.server.start_listener", side_effect=start_listener
+    )
+
+    sigterm = signal.getsignal(signal.SIGTERM)
+    with pytest.raises(SystemExit) as exc_info:
+        _supervise_listeners(settings)
+    signal.signal(signal.SIGTERM, sigterm)
+
+    assert exc_info.value.code == 1
+    # Both listeners and at least one restart failed.
+    assert starts.call_count >= 3
+
+
+def test_chunk_sizer_grows_up_to_max():
+    sizer = ChunkSizer(4096, 16384, 0.2)
+
+    for _ in range(5):
+        sizer.update(sizer.size, sizer.size, 0.01)
+
+    assert sizer.size == 16384
+
+
+def test_chunk_sizer_shrinks_on_slow_fetch():
+    sizer = ChunkSizer(4096, 65536, 0.2)
+    sizer.size = 65536
+
+    sizer.update(65536, 65536, 0.5)
+    assert sizer.size == 32768
+    sizer.update(32768, 32768, 0.15)
+    assert sizer.size == 32768
+    sizer.update(32768, 1000, 0.01)
+    assert sizer.size == 32768
+
+
+def test_chunk_sizer_fixed_size():
+    sizer = ChunkSizer(4096, 0, 0.2)
+
+    sizer.update(4096, 4096, 0.01)
+    sizer.update(4096, 4096, 1)
+
+    assert sizer.size == 4096
+
+
+def test_resolver_remembers_missing_paths(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.cache_negative_ttl = 5
+    settings.static_fallback_dir = tmp_path
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = xmlrpc.client.Fault(1, "not found")
+    resolver = ResponseResolver(settings)
+
+    for _ in range(3):
+        with pytest.raises(FileNotFoundError):
+            resolver.resolve(api, "token", "pxelinux.cfg/default")
+
+    assert api.get_tftp_file.call_count == 1
+
+
+def test_resolver_does_not_remember_other_faults(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.cache_negative_ttl = 5
+    settings.static_fallback_dir = tmp_path
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = xmlrpc.client.Fault(
+        1, "<class 'cobbler.cexceptions.CX'>:'invalid token: 1234'"
+    )
+    resolver = ResponseResolver(settings)
+
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            resolver.resolve(api, "token", "pxelinux.cfg/default")
+
+    assert api.get_tftp_file.call_count == 2
+
+
+def test_resolver_does_not_remember_unreachable_cobbler(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.cache_negative_ttl = 5
+    settings.static_fallback_dir = tmp_path
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = xmlrpc.client.ProtocolError("", 503, "", {})
+    resolver = ResponseResolver(settings)
+
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            resolver.resolve(api, "token", "pxelinux.cfg/default")
+
+    assert api.get_tftp_file.call_count == 2
+
+
+def test_resolver_routes(settings: Settings, mocker: MockerFixture, tmp_path: Path):
+    settings.static_fallback_dir = tmp_path
+    settings.tftp_routes = [
+        {"pattern": "grub/*.efi", "source": "static"},
+        {"pattern": "ipxe.efi", "source": "static"},
+        {"pattern": "grub/*", "source": "cobbler"},
+    ]
+    (tmp_path / "grub").mkdir()
+    (tmp_path / "grub" / "grubx64.efi").write_bytes(b"grub")
+    api = mocker.Mock()
+    cache = mocker.Mock()
+    resolver = ResponseResolver(settings, cache)
+
+    assert resolver.route("grub/grubx64.efi") == "static"
+    assert resolver.route("/grub/grubx64.efi") == "static"
+    assert resolver.route("./grub/grubx64.efi") == "static"
+    assert resolver.route("grub/grub.cfg") == "cobbler"
+    assert resolver.route("/grub/grub.cfg") == "cobbler"
+    assert resolver.route("pxelinux.0") == "cache"
+    response = resolver.resolve(api, "token", "/grub/grubx64.efi")
+    assert response.read(512) == b"grub"
+    response.close()
+    with pytest.raises(FileNotFoundError):
+        resolver.resolve(api, "token", "ipxe.efi")
+    api.get_tftp_file.assert_not_called()
+    cache.lookup.assert_not_called()
+
+
+def test_resolver_static_index(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+):
+    settings.static_fallback_dir = tmp_path
+    settings.static_fallback_index = True
+    settings.tftp_routes = [{"pattern": "*.efi", "source": "static"}]
+    (tmp_path / "ipxe.efi").write_bytes(b"ipxe")
+    api = mocker.Mock()
+    resolver = ResponseResolver(settings)
+
+    try:
+        response = resolver.resolve(api, "token", "ipxe.efi")
+        assert response.size() == 4
+        response.close()
+        with pytest.raises(FileNotFoundError):
+            resolver.resolve(api, "token", "grubx64.efi")
+    finally:
+        resolver.close()
+
+
+def test_mapped_response_data(tmp_path: Path):
+    content = bytes(range(256)) * 5
+    (tmp_path / "initrd").write_bytes(content)
+    (tmp_path / "empty").write_bytes(b"")
+    response = MappedResponseData(tmp_path / "initrd")
+
+    blocks = [response.read(512) for _ in range(4)]
+    response.close()
+
+    assert response.size() == len(content)
+    assert isinstance(blocks[0], memoryview)
+    assert b"".join(blocks) == content
+    assert blocks[3] == b""
+    assert isinstance(open_file(tmp_path / "empty"), FileResponseData)
+    assert isinstance(open_file(tmp_path / "initrd", use_mmap=False), FileResponseData)
+
+
+def test_cobbler_response_data_slices_chunks(mocker: MockerFixture):
+    content = bytes(range(256)) * 6
+
+    def get_tftp_file(path: str, offset: int, size: int, token: str):
+        return xmlrpc.client.Binary(content[offset : offset + size]), len(content)
+
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = get_tftp_file
+    response = CobblerResponseData(api, "token", "initrd", ChunkSizer(1024, 0, 0.2))
+    response.load()
+
+    blocks = [response.read(512), response.read(512), response.read(700)]
+    blocks.append(response.read(700))
+    blocks.append(response.read(700))
+
+    assert isinstance(blocks[0], memoryview)
+    assert isinstance(blocks[2], bytes)
+    assert b"".join(blocks) == content
+    assert api.get_tftp_file.call_count == 2
+
+
+def test_cobbler_response_data_streams_large_files(
+    mocker: MockerFixture, file_server: str
+):
+    pool = CobblerClientPool("http://localhost/cobbler_api", 1, file_server)
+
+    with pool.client() as api:
+        fetch = mocker.spy(api, "get_tftp_file")
+        response = CobblerResponseData(
+            api, "token", "grub/grub.cfg", ChunkSizer(512, 0, 0.2), None, 1, None, 1
+        )
+        response.load()
+        blocks = [response.read(512) for _ in range(5)]
+        response.close()
+    pool.close()
+
+    assert b"".join(blocks) == FILE_CONTENT
+    assert fetch.call_count == 1
+
+
+def test_cobbler_response_data_stream_fallback(mocker: MockerFixture):
+    def get_tftp_file(path: str, offset: int, size: int, token: str):
+        return xmlrpc.client.Binary(FILE_CONTENT[offset : offset + size]), 2048
+
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = get_tftp_file
+    response = CobblerResponseData(
+        api, "token", "grub/grub.cfg", ChunkSizer(512, 0, 0.2), None, 0, None, 1
+    )
+    response.load()
+
+    blocks = [response.read(512) for _ in range(5)]
+
+    assert b"".join(blocks) == FILE_CONTENT
+    assert api.get_tftp_file.call_count == 4
+    api.open_tftp_file.assert_not_called()
+
+
+def test_cobbler_response_data_reads_ahead_in_order(mocker: MockerFixture):
+    offsets: List[int] = []
+
+    def get_tftp_file(path: str, offset: int, size: int, token: str):
+        if offset == 512:
+            # Finishes after the chunks fetched in parallel behind it.
+            time.sleep(0.2)
+        offsets.append(offset)
+        return xmlrpc.client.Binary(FILE_CONTENT[offset : offset + size]), 2048
+
+    @contextmanager
+    def client() -> Iterator[object]:
+        api = mocker.Mock()
+        api.get_tftp_file.side_effect = get_tftp_file
+        yield api
+
+    pool = mocker.Mock()
+    pool.client.side_effect = client
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = get_tftp_file
+    response = CobblerResponseData(
+        api,
+        "token",
+        "initrd",
+        ChunkSizer(512, 0, 0.2),
+        None,
+        2,
+        pool=pool,
+        concurrency=3,
+    )
+    response.load()
+
+    blocks = [bytes(response.read(512)) for _ in range(4)]
+    response.close()
+
+    assert blocks == [
+        FILE_CONTENT[offset : offset + 512] for offset in range(0, 2048, 512)
+    ]
+    # The second chunk was fetched last, but still served in its place.
+    assert len(offsets) == 4
+    assert offsets[-1] == 512
+
+
+def test_cobbler_response_data_read_ahead_stops_at_eof(mocker: MockerFixture):
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = lambda path, offset, size, token: (
+        xmlrpc.client.Binary(FILE_CONTENT[offset : offset + size]),
+        2048,
+    )
+    response = CobblerResponseData(
+        api, "token", "initrd", ChunkSizer(512, 0, 0.2), None, 8
+    )
+    response.load()
+
+    data = b"".join(bytes(response.read(512)) for _ in range(4))
+    assert response.read(512) == b""
+    response.close()
+
+    assert data == FILE_CONTENT
+    # No chunk is requested beyond the end of the file.
+    assert [call.args[1] for call in api.get_tftp_file.call_args_list] == [
+        0,
+        512,
+        1024,
+        1536,
+    ]
+
+
+def test_cobbler_response_data_short_chunk_ahead(mocker: MockerFixture):
+    def get_tftp_file(path: str, offset: int, size: int, token: str):
+        if offset == 512:
+            # Shorter than requested, the chunks ahead start too late.
+            size = 100
+        return xmlrpc.client.Binary(FILE_CONTENT[offset : offset + size]), 2048
+
+    api = mocker.Mock()
+    api.get_tftp_file.side_effect = get_tftp_file
+    response = CobblerResponseData(
+        api, "token", "grub/grub.cfg", ChunkSizer(512, 0, 0.2), None, 2
+    )
+    response.load()
+
+    data = b""
+    while len(data) < 2048:
+        data += response.read(512)
+    response.close()
+
+    assert data == FILE_CONTENT
+
+
+def test_cobbler_response_data_empty_chunk(mocker: MockerFixture):
+    api = mocker.Mock()
+    api.get_tftp_file.return_value = xmlrpc.client.Binary(b""), 2048
+    response = CobblerResponseData(
+        api, "token", "grub/grub.cfg", ChunkSizer(512, 0, 0.2)
+    )
+
+    with pytest.raises(EOFError):
+        response.load()
+
+
+def test_cobbler_response_data_fetches_in_parallel(mocker: MockerFixture):
+    barrier = threading.Barrier(3, timeout=5)
+
+    def get_tftp_file(path: str, offset: int, size: int, token: str):
+        if offset > 0:
+            # The chunks after the first one are only returned once three
+            # fetches are in flight.
+            barrier.wait()
+        return xmlrpc.client.Binary(FILE_CONTENT[offset : offset + size]), 2048
+
+    @contextmanager
+    def client() -> Iterator[object]:
+        api = mocker.Mock()
+        api.get_tftp_file.side_effect = get_tftp_file
+        yield api
+
+    pool = mocker.Mock()
+    pool.client.side_effect = client
+    response = CobblerResponseData(
+        mocker.Mock(),
+        "token",
+        "initrd",
+        ChunkSizer(512, 0, 0.2),
+        pool=pool,
+        concurrency=3,
+    )
+    response.load()
+
+    blocks = [response.read(512) for _ in range(5)]
+    response.close()
+
+    assert b"".join(blocks) == FILE_CONTENT
+    assert pool.client.call_count == 4
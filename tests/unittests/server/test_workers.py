@@ -0,0 +1,115 @@
+"""
+Tests for the pre-forked worker engine.
+"""
+
+import queue
+import socket
+import struct
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cobbler_tftp.server.client import TokenManager
+from cobbler_tftp.server.workers import (  # type: ignore[reportPrivateUsage]
+    PreforkTFTPServer,
+    _QueuedSession,
+)
+from cobbler_tftp.settings import Settings
+
+CONTENT = b"DEFAULT local\n"
+
+
+@pytest.fixture
+def prefork_server(
+    settings: Settings, mocker: MockerFixture, tmp_path: Path
+) -> Iterator[PreforkTFTPServer]:
+    """
+    Fixture that represents a server with a single worker serving one session
+    at a time, which serves all files from a static directory.
+    """
+    (tmp_path / "pxelinux.cfg").write_bytes(CONTENT)
+    settings.tftp_addr = "127.0.0.1"
+    settings.tftp_port = 0
+    settings.tftp_timeout = 1
+    settings.tftp_retries = 1
+    settings.tftp_workers = 1
+    settings.tftp_worker_threads = 1
+    settings.tftp_routes = [{"pattern": "*", "source": "static"}]
+    settings.static_fallback_dir = tmp_path
+    settings.cache_max_size = 0
+    # Inherited by the workers, which never log in to Cobbler.
+    mocker.patch.object(TokenManager, "token", return_value="token")
+    server = PreforkTFTPServer(settings)
+    yield server
+    server.cleanup()
+    server._listener.close()  # type: ignore
+
+
+def _request(server: PreforkTFTPServer) -> socket.socket:
+    """Send a read request for pxelinux.cfg and hand it to the workers."""
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    client.sendto(
+        struct.pack("!H", 1) + b"pxelinux.cfg\x00octet\x00",
+        server._listener.getsockname(),  # type: ignore
+    )
+    server.run_once()
+    return client
+
+
+def _download(client: socket.socket) -> bytes:
+    """Receive the only data block of the session and acknowledge it."""
+    packet, addr = client.recvfrom(65536)
+    assert struct.unpack("!HH", packet[:4]) == (3, 1)
+    client.sendto(struct.pack("!HH", 4, 1), addr)
+    client.close()
+    return packet[4:]
+
+
+def test_queued_session_start():
+    session_queue: "queue.Queue[Any]" = queue.Queue()
+    session = (("127.0.0.1", 69), ("127.0.0.1", 1234), "pxelinux.0", {})
+    queued = _QueuedSession(session_queue, session)  # type: ignore[reportArgumentType]
+
+    queued.start()
+
+    assert queued.daemon
+    assert session_queue.get_nowait() == session
+
+
+def test_prefork_server_serves_session(prefork_server: PreforkTFTPServer):
+    client = _request(prefork_server)
+
+    assert _download(client) == CONTENT
+
+
+def test_prefork_server_restarts_dead_worker(prefork_server: PreforkTFTPServer):
+    (worker,) = prefork_server._workers  # type: ignore
+    worker.kill()
+    worker.join()
+
+    client = _request(prefork_server)
+
+    (restarted,) = prefork_server._workers  # type: ignore
+    assert restarted.pid != worker.pid
+    assert restarted.is_alive()
+    assert _download(client) == CONTENT
+
+
+def test_prefork_server_limits_worker_sessions(prefork_server: PreforkTFTPServer):
+    first = _request(prefork_server)
+    packet, addr = first.recvfrom(65536)
+    second = _request(prefork_server)
+    second.settimeout(0.5)
+
+    # The only thread of the worker waits for the first acknowledgement.
+    with pytest.raises(socket.timeout):
+        second.recvfrom(65536)
+    first.sendto(struct.pack("!HH", 4, 1), addr)
+    first.close()
+    second.settimeout(5)
+
+    assert packet[4:] == CONTENT
+    assert _download(second) == CONTENT
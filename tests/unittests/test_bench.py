@@ -0,0 +1,42 @@
+"""
+Tests for the benchmark.
+"""
+
+from cobbler_tftp.bench import run_benchmark
+from cobbler_tftp.settings import SettingsFactory
+
+
+def test_run_benchmark():
+    settings = SettingsFactory().build_settings(None)
+    settings.tftp_engine = "asyncio"
+    settings.tftp_workers = 1
+    settings.cache_max_size = 0
+    settings.cache_negative_ttl = 0
+    settings.prefetch_size = 4096
+    settings.prefetch_max_size = 0
+
+    result = run_benchmark(settings, [10000, 20000], 4, 2, block_size=1024)
+
+    assert [session.error for session in result.sessions] == [None] * 4
+    assert sum(session.size for session in result.sessions) == 60000
+    # Three chunks for each of the small files and five for the large ones.
+    assert result.calls["get_tftp_file"] == 16
+    assert result.percentile(0.99) >= result.percentile(0.5) > 0
+    assert "Sessions:      4 (0 failed)" in result.report()
+
+
+def test_run_benchmark_fork_cache():
+    settings = SettingsFactory().build_settings(None)
+    settings.tftp_engine = "fork"
+    settings.cache_max_size = 64 * 1024 * 1024
+    settings.cache_negative_ttl = 0
+    settings.prefetch_size = 4096
+    settings.prefetch_max_size = 0
+
+    result = run_benchmark(settings, [100000], 3, 1, block_size=1024)
+
+    assert [session.error for session in result.sessions] == [None] * 3
+    assert [session.size for session in result.sessions] == [100000] * 3
+    # The file is stored after the last ACK, so at most one more session
+    # fetches all 25 chunks instead of reading the cached file.
+    assert result.calls.get("get_tftp_file", 0) <= 25